@@ -17,6 +17,7 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dir_path)
 
 from subhub.app import create_app
+from subhub.hub.archive import flush_event_archives
 from subhub.log import get_logger
 
 logger = get_logger()
@@ -41,3 +42,6 @@ def handle(event, context):
         logger.exception("exception occurred", subhub_event=event, context=context, error=e)
         # TODO: Add Sentry exception catch here
         raise
+    finally:
+        # the container may be frozen or reclaimed before the next invocation
+        flush_event_archives()
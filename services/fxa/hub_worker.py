@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import newrelic.agent
+
+from aws_xray_sdk.core import xray_recorder
+
+newrelic.agent.initialize()
+
+# First some funky path manipulation so that we can work properly in
+# the AWS environment
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path)
+
+from subhub.app import create_app
+from subhub.cfg import CFG
+from subhub.hub import outbox, worker
+from subhub.log import get_logger
+
+logger = get_logger()
+
+xray_recorder.configure(service="subhub-hub-worker")
+
+# Create app at module scope to cache it for repeat invocations
+try:
+    app = create_app()
+except Exception:  # pylint: disable=broad-except
+    logger.exception("Exception occurred while loading app")
+    raise
+
+@newrelic.agent.lambda_handler()
+def handle(event, context):
+    try:
+        logger.info("handling event", subhub_event=event, context=context)
+        with worker.app_context(app.app):
+            records = (event or {}).get("Records")
+            if not records:
+                # scheduled or manual invocation: drain the queue directly
+                stats = worker.drain()
+                if CFG.HUB_OUTBOX_ENABLED:
+                    stats["outbox"] = outbox.drain()
+                return stats
+            remaining_millis = getattr(context, "get_remaining_time_in_millis", None)
+            failures = worker.batch_item_failures(records, remaining_millis)
+            if failures:
+                logger.error("hub events failed", failures=failures)
+            if CFG.HUB_OUTBOX_ENABLED:
+                outbox.drain()
+            # only the failed records are left on the queue for a retry
+            return dict(batchItemFailures=failures)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("exception occurred", subhub_event=event, context=context, error=e)
+        raise
@@ -17,7 +17,12 @@ logger = get_logger()
 def handle(event, context):
     try:
         logger.info("handling event", subhub_event=event, context=context)
-        events_check.process_events(6)
+        hours_back = (event or {}).get("hours_back")
+        if hours_back:
+            # manual backfill: check the whole window, ignoring the watermark
+            events_check.process_events(int(hours_back))
+        else:
+            events_check.process_events(6, use_watermark=True)
     except Exception as e:  # pylint: disable=broad-except
         logger.exception("exception occurred", subhub_event=event, context=context, error=e)
         # TODO: Add Sentry exception catch here
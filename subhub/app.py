@@ -15,9 +15,19 @@ from flask import request
 from subhub import secrets
 from subhub.cfg import CFG
 from subhub.exceptions import SubHubError
-from subhub.db import SubHubAccount, HubEvent, SubHubDeletedAccount
+from subhub.db import (
+    SubHubAccount,
+    HubEvent,
+    HubCheckpoint,
+    HubPlanCatalog,
+    HubOutbox,
+    SubHubDeletedAccount,
+    UserCache,
+)
 
 from subhub.log import get_logger
+from subhub.plan_catalog import configure_plan_catalog
+from subhub.stripe_session import StripeSession, record_stripe_calls
 
 logger = get_logger()
 
@@ -54,6 +64,12 @@ def server_stripe_card_error(e):
     return jsonify({"message": f"{e.user_message}", "code": f"{e.code}"}), 402
 
 
+def _user_cache():
+    if not CFG.USER_CACHE_ENABLED:
+        return None
+    return UserCache(maxsize=CFG.USER_CACHE_MAXSIZE, ttl=CFG.USER_CACHE_TTL)
+
+
 def create_app(config=None):
     logger.info("creating flask app", config=config)
     region = "localhost"
@@ -68,11 +84,26 @@ def create_app(config=None):
     app.add_api("swagger.yaml", pass_context_arg_name="request", strict_validation=True)
 
     app.app.subhub_account = SubHubAccount(
-        table_name=CFG.USER_TABLE, region=region, host=host
+        table_name=CFG.USER_TABLE,
+        region=region,
+        host=host,
+        cache=_user_cache(),
     )
     app.app.hub_table = HubEvent(table_name=CFG.EVENT_TABLE, region=region, host=host)
+    app.app.hub_checkpoints = HubCheckpoint(
+        table_name=CFG.HUB_STATE_TABLE, region=region, host=host
+    )
+    app.app.plan_catalog_store = HubPlanCatalog(
+        table_name=CFG.HUB_STATE_TABLE, region=region, host=host
+    )
+    app.app.hub_outbox = HubOutbox(
+        table_name=CFG.OUTBOX_TABLE, region=region, host=host
+    )
     app.app.subhub_deleted_users = SubHubDeletedAccount(
-        table_name=CFG.DELETED_USER_TABLE, region=region, host=host
+        table_name=CFG.DELETED_USER_TABLE,
+        region=region,
+        host=host,
+        cache=_user_cache(),
     )
     if not app.app.subhub_account.model.exists():
         app.app.subhub_account.model.create_table(
@@ -82,11 +113,22 @@ def create_app(config=None):
         app.app.hub_table.model.create_table(
             read_capacity_units=1, write_capacity_units=1, wait=True
         )
+    if not app.app.hub_outbox.model.exists():
+        app.app.hub_outbox.model.create_table(
+            read_capacity_units=1, write_capacity_units=1, wait=True
+        )
+    # the checkpoints and the plan catalogs share the hub state table
+    if not app.app.hub_checkpoints.model.exists():
+        app.app.hub_checkpoints.model.create_table(
+            read_capacity_units=1, write_capacity_units=1, wait=True
+        )
     if not app.app.subhub_deleted_users.model.exists():
         app.app.subhub_deleted_users.model.create_table(
             read_capacity_units=1, write_capacity_units=1, wait=True
         )
 
+    configure_plan_catalog(app.app.plan_catalog_store)
+
     # Setup error handlers
     @app.app.errorhandler(SubHubError)
     def display_subhub_errors(e: SubHubError):
@@ -120,8 +162,11 @@ def create_app(config=None):
     def before_request():
         g.subhub_account = current_app.subhub_account
         g.hub_table = current_app.hub_table
+        g.hub_checkpoints = current_app.hub_checkpoints
+        g.hub_outbox = current_app.hub_outbox
         g.subhub_deleted_users = current_app.subhub_deleted_users
         g.app_system_id = None
+        g.stripe_session = StripeSession()
         if CFG.PROFILING_ENABLED:
             if "profile" in request.args and not hasattr(sys, "_called_from_test"):
                 from pyinstrument import Profiler
@@ -131,6 +176,7 @@ def create_app(config=None):
 
     @app.app.after_request
     def after_request(response):
+        record_stripe_calls(request.endpoint)
         if not hasattr(g, "profiler") or hasattr(sys, "_called_from_test"):
             return response
         if CFG.PROFILING_ENABLED:
@@ -147,4 +193,8 @@ if __name__ == "__main__":
     app = create_app()
     app.debug = True
     app.use_reloader = True
+    if CFG.HUB_ASYNC_ENABLED and CFG.HUB_QUEUE_URL == "local":
+        from subhub.hub.worker import start_local_worker
+
+        start_local_worker(app.app)
     app.run(host="0.0.0.0", port=CFG.LOCAL_FLASK_PORT)
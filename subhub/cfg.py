@@ -254,6 +254,62 @@ class AutoConfigPlus(AutoConfig):  # pylint: disable=too-many-public-methods
         """
         return self("EVENT_TABLE", "events-testing")
 
+    @property
+    def OUTBOX_TABLE(self):
+        """
+        default value for OUTBOX_TABLE
+        """
+        return self("OUTBOX_TABLE", "outbox-testing")
+
+    @property
+    def HUB_STATE_TABLE(self):
+        """
+        default value for HUB_STATE_TABLE
+        """
+        return self("HUB_STATE_TABLE", "hub-state-testing")
+
+    @property
+    def USER_CACHE_ENABLED(self):
+        """
+        USER_CACHE_ENABLED
+        """
+        return ast.literal_eval(self("USER_CACHE_ENABLED", "False"))
+
+    @property
+    def USER_CACHE_MAXSIZE(self):
+        """
+        max number of user records held in the read-through cache
+        """
+        return self("USER_CACHE_MAXSIZE", 1024, cast=int)
+
+    @property
+    def USER_CACHE_TTL(self):
+        """
+        seconds a cached user record is served before it is re-read
+        """
+        return self("USER_CACHE_TTL", 60, cast=int)
+
+    @property
+    def STRIPE_FETCH_WORKERS(self):
+        """
+        Stripe lookups of one request run in parallel
+        """
+        return self("STRIPE_FETCH_WORKERS", 4, cast=int)
+
+    @property
+    def STRIPE_CONSISTENCY_CHECK(self):
+        """
+        compare subscriptions returned by mutations with the customer refetched from Stripe
+        """
+        return ast.literal_eval(self("STRIPE_CONSISTENCY_CHECK", "False"))
+
+    @property
+    def PLAN_CATALOG_TTL(self):
+        """
+        seconds the plan catalog is served before it is refreshed in the background
+        """
+        return self("PLAN_CATALOG_TTL", 600, cast=int)
+
     @property
     def LOCAL_FLASK_PORT(self):
         """
@@ -290,6 +346,62 @@ class AutoConfigPlus(AutoConfig):  # pylint: disable=too-many-public-methods
         """
         return self("BASKET_API_KEY", "fake_basket_api_key")
 
+    @property
+    def BASKET_POOL_SIZE(self):
+        """
+        connections kept open by the shared basket session
+        """
+        return self("BASKET_POOL_SIZE", 10, cast=int)
+
+    @property
+    def BASKET_CONNECT_TIMEOUT(self):
+        """
+        seconds to wait for a connection to basket
+        """
+        return self("BASKET_CONNECT_TIMEOUT", 3.05, cast=float)
+
+    @property
+    def BASKET_READ_TIMEOUT(self):
+        """
+        seconds to wait for a basket response
+        """
+        return self("BASKET_READ_TIMEOUT", 5, cast=float)
+
+    @property
+    def BASKET_RETRIES(self):
+        """
+        retries of a basket delivery after a 5xx response or connection error
+        """
+        return self("BASKET_RETRIES", 2, cast=int)
+
+    @property
+    def BASKET_BACKOFF(self):
+        """
+        base seconds of the jittered exponential backoff between basket retries
+        """
+        return self("BASKET_BACKOFF", 0.25, cast=float)
+
+    @property
+    def BASKET_BATCH_ENABLED(self):
+        """
+        BASKET_BATCH_ENABLED
+        """
+        return ast.literal_eval(self("BASKET_BATCH_ENABLED", "False"))
+
+    @property
+    def BASKET_BATCH_SIZE(self):
+        """
+        max number of Salesforce payloads sent in one bulk basket request
+        """
+        return self("BASKET_BATCH_SIZE", 50, cast=int)
+
+    @property
+    def BASKET_BATCH_MILLIS(self):
+        """
+        max milliseconds a Salesforce payload waits for its batch to fill
+        """
+        return self("BASKET_BATCH_MILLIS", 200, cast=int)
+
     @property
     def FXA_SQS_URI(self):
         """
@@ -319,6 +431,27 @@ class AutoConfigPlus(AutoConfig):  # pylint: disable=too-many-public-methods
         """
         return self("TOPIC_ARN_KEY", "fake_topic_arn_key")
 
+    @property
+    def SNS_MAX_POOL_CONNECTIONS(self):
+        """
+        connections kept open by the shared SNS client
+        """
+        return self("SNS_MAX_POOL_CONNECTIONS", 10, cast=int)
+
+    @property
+    def SNS_CONNECT_TIMEOUT(self):
+        """
+        seconds the SNS client waits to connect
+        """
+        return self("SNS_CONNECT_TIMEOUT", 2, cast=int)
+
+    @property
+    def SNS_READ_TIMEOUT(self):
+        """
+        seconds the SNS client waits for a response
+        """
+        return self("SNS_READ_TIMEOUT", 2, cast=int)
+
     @property
     def SUPPORT_API_KEY(self):
         """
@@ -398,6 +531,139 @@ class AutoConfigPlus(AutoConfig):  # pylint: disable=too-many-public-methods
         """
         return self("ALLOWED_ORIGIN_SYSTEMS", "fake_origin1, fake_origin2").split(",")
 
+    @property
+    def HUB_ASYNC_ENABLED(self):
+        """
+        enqueue verified webhook events and process them in the hub worker
+        """
+        return ast.literal_eval(self("HUB_ASYNC_ENABLED", "False"))
+
+    @property
+    def HUB_QUEUE_URL(self):
+        """
+        url of the SQS queue for hub events, "local" for an in-process queue
+        """
+        return self("HUB_QUEUE_URL", "local")
+
+    @property
+    def HUB_QUEUE_BATCH_SIZE(self):
+        """
+        number of hub events the worker receives per batch
+        """
+        return self("HUB_QUEUE_BATCH_SIZE", 10, cast=int)
+
+    @property
+    def HUB_QUEUE_WAIT_SECONDS(self):
+        """
+        seconds the worker waits for hub events before it stops draining
+        """
+        return self("HUB_QUEUE_WAIT_SECONDS", 1, cast=int)
+
+    @property
+    def HUB_ROUTES_CONCURRENT(self):
+        """
+        deliver an event to its routes in parallel
+        """
+        return ast.literal_eval(self("HUB_ROUTES_CONCURRENT", "True"))
+
+    @property
+    def HUB_ROUTES_WORKERS(self):
+        """
+        size of the thread pool shared by concurrent route deliveries
+        """
+        return self("HUB_ROUTES_WORKERS", 8, cast=int)
+
+    @property
+    def HUB_ROUTE_TIMEOUT_SECONDS(self):
+        """
+        seconds a concurrent route delivery may take before it is reported as timed out
+        """
+        return self("HUB_ROUTE_TIMEOUT_SECONDS", 10, cast=int)
+
+    @property
+    def HUB_OUTBOX_ENABLED(self):
+        """
+        HUB_OUTBOX_ENABLED
+        """
+        return ast.literal_eval(self("HUB_OUTBOX_ENABLED", "False"))
+
+    @property
+    def OUTBOX_MAX_ATTEMPTS(self):
+        """
+        delivery attempts of a route before its outbox entry is dead-lettered
+        """
+        return self("OUTBOX_MAX_ATTEMPTS", 8, cast=int)
+
+    @property
+    def OUTBOX_BACKOFF_SECONDS(self):
+        """
+        seconds before the first outbox retry, doubled on every further attempt
+        """
+        return self("OUTBOX_BACKOFF_SECONDS", 2, cast=int)
+
+    @property
+    def OUTBOX_DRAIN_LIMIT(self):
+        """
+        max outbox deliveries retried by one drain
+        """
+        return self("OUTBOX_DRAIN_LIMIT", 25, cast=int)
+
+    @property
+    def HUB_IDEMPOTENCY_ENABLED(self):
+        """
+        HUB_IDEMPOTENCY_ENABLED
+        """
+        return ast.literal_eval(self("HUB_IDEMPOTENCY_ENABLED", "True"))
+
+    @property
+    def HUB_ROUTED_EVENTS_MAXSIZE(self):
+        """
+        number of fully routed event ids remembered by the process
+        """
+        return self("HUB_ROUTED_EVENTS_MAXSIZE", 4096, cast=int)
+
+    @property
+    def HUB_ROUTED_EVENTS_TTL(self):
+        """
+        seconds a fully routed event id is remembered by the process
+        """
+        return self("HUB_ROUTED_EVENTS_TTL", 3600, cast=int)
+
+    @property
+    def HUB_COALESCE_SECONDS(self):
+        """
+        seconds within which only the latest update of a customer in a worker batch is delivered
+        """
+        return self("HUB_COALESCE_SECONDS", 0, cast=int)
+
+    @property
+    def HUB_ARCHIVE_URL(self):
+        """
+        directory or s3://bucket/prefix to archive verified hub events to, unset to disable
+        """
+        return self("HUB_ARCHIVE_URL", "")
+
+    @property
+    def HUB_ARCHIVE_SEGMENT_EVENTS(self):
+        """
+        events per archive segment
+        """
+        return self("HUB_ARCHIVE_SEGMENT_EVENTS", 1000, cast=int)
+
+    @property
+    def HUB_ARCHIVE_SEGMENT_SECONDS(self):
+        """
+        seconds after which an archive segment is rotated
+        """
+        return self("HUB_ARCHIVE_SEGMENT_SECONDS", 300, cast=int)
+
+    @property
+    def HUB_REPLAY_WORKERS(self):
+        """
+        customers whose events /hub/replay processes in parallel
+        """
+        return self("HUB_REPLAY_WORKERS", 4, cast=int)
+
     @property
     def PAYMENT_EVENT_LIST(self):
         """"
@@ -405,6 +671,27 @@ class AutoConfigPlus(AutoConfig):  # pylint: disable=too-many-public-methods
         """
         return self("PAYMENT_EVENT_LIST", "test.system, test.event").split(",")
 
+    @property
+    def EVENT_CHECK_OVERLAP_SECONDS(self):
+        """
+        seconds before the missing events watermark that a run re-checks
+        """
+        return self("EVENT_CHECK_OVERLAP_SECONDS", 600, cast=int)
+
+    @property
+    def EVENT_CHECK_PIPELINED(self):
+        """
+        prefetch Stripe event pages and replay missing events in parallel
+        """
+        return ast.literal_eval(self("EVENT_CHECK_PIPELINED", "True"))
+
+    @property
+    def EVENT_CHECK_WORKERS(self):
+        """
+        number of workers replaying missing events in the pipelined mode
+        """
+        return self("EVENT_CHECK_WORKERS", 4, cast=int)
+
     @property
     def PROFILING_ENABLED(self):
         """
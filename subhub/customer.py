@@ -11,9 +11,13 @@ from subhub.cfg import CFG
 from subhub.exceptions import IntermittentError, ServerError
 from subhub.db import SubHubAccount
 from subhub.log import get_logger
+from subhub.stripe_session import stripe_session
 
 logger = get_logger()
 
+# failure details of incomplete subscriptions come back with the customer
+CUSTOMER_EXPAND = ["subscriptions.data.latest_invoice.charge"]
+
 
 def create_customer(
     subhub_account: SubHubAccount,
@@ -26,8 +30,9 @@ def create_customer(
     _validate_origin_system(origin_system)
     # First search Stripe to ensure we don't have an unlinked Stripe record
     # already in Stripe
+    session = stripe_session()
     customer = None
-    customers = Customer.list(email=email)
+    customers = session.call(Customer.list, email=email)
     for possible_customer in customers.data:
         if possible_customer.email == email:
             # If the userid doesn't match, the system is damaged.
@@ -38,13 +43,14 @@ def create_customer(
             # If we have a mis-match on the source_token, overwrite with the
             # new one.
             if customer.default_source != source_token:
-                Customer.modify(customer.id, source=source_token)
+                session.mutate(Customer.modify, customer.id, source=source_token)
             break
 
     # No existing Stripe customer, create one.
     if not customer:
         try:
-            customer = Customer.create(
+            customer = session.mutate(
+                Customer.create,
                 source=source_token,
                 email=email,
                 description=user_id,
@@ -64,7 +70,7 @@ def create_customer(
 
     if not subhub_account.save_user(db_account):
         # Clean-up the Stripe customer record since we can't link it
-        Customer.delete(customer.id)
+        session.mutate(Customer.delete, customer.id)
         e = IntermittentError("error saving db record")
         logger.error("unable to save user or link it", error=e)
         raise e
@@ -92,15 +98,20 @@ def fetch_customer(subhub_account: SubHubAccount, user_id: str) -> Customer:
     customer = None
     db_account = subhub_account.get_user(user_id)
     if db_account:
-        customer = Customer.retrieve(db_account.cust_id)
+        customer = stripe_session().retrieve(
+            Customer, db_account.cust_id, expand=CUSTOMER_EXPAND
+        )
     return customer
 
 
 def existing_payment_source(existing_customer: Customer, source_token: str) -> Customer:
     if not existing_customer.get("sources"):
         if not existing_customer.get("deleted"):
-            existing_customer = Customer.modify(
-                existing_customer["id"], source=source_token
+            existing_customer = stripe_session().mutate(
+                Customer.modify,
+                existing_customer["id"],
+                source=source_token,
+                expand=CUSTOMER_EXPAND,
             )
             logger.info("add source", existing_customer=existing_customer)
         else:
@@ -116,7 +127,9 @@ def subscribe_customer(customer: Customer, plan_id: str) -> Subscription:
     :return: Subscription Object
     """
     try:
-        sub = Subscription.create(customer=customer, items=[{"plan": plan_id}])
+        sub = stripe_session().mutate(
+            Subscription.create, customer=customer, items=[{"plan": plan_id}]
+        )
         return sub
     except Exception as e:
         logger.error("sub error", error=e)
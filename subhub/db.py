@@ -2,16 +2,72 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-from typing import Optional
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
 
-from pynamodb.attributes import UnicodeAttribute, ListAttribute
+import cachetools
+from pynamodb.attributes import UnicodeAttribute, ListAttribute, NumberAttribute
+from pynamodb.indexes import GlobalSecondaryIndex, AllProjection
 from pynamodb.models import Model, DoesNotExist
-from pynamodb.exceptions import PutError
+from pynamodb.exceptions import DeleteError, PutError, UpdateError
 
 from subhub.log import get_logger
 
 logger = get_logger()
 
+CUST_ID_INDEX = "cust_id-index"
+
+
+def _is_conditional_check_failure(error: UpdateError) -> bool:
+    response = getattr(error.cause, "response", None) or {}
+    return response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+class UserCache:
+    """
+    Bounded LRU cache with a per-entry TTL used as a read-through layer in
+    front of the user tables.  Entries hold the raw attribute values of an
+    item so every hit hands back a fresh model instance.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 60):
+        self._cache = cachetools.TTLCache(maxsize, ttl)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._cache[key] = value
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                size=len(self._cache),
+                maxsize=self._cache.maxsize,
+                ttl=self._cache.ttl,
+            )
+
 
 def _create_account_model(table_name_, region_, host_):
     class SubHubAccountModel(Model):
@@ -38,11 +94,27 @@ class SubHubAccountModel(Model):
 
 
 class SubHubAccount:
-    def __init__(self, table_name: str, region: str, host: Optional[str] = None):
+    def __init__(
+        self,
+        table_name: str,
+        region: str,
+        host: Optional[str] = None,
+        cache: Optional[UserCache] = None,
+    ):
+        self.cache = cache
         _table = table_name
         _region = region
         _host = host
 
+        class CustIdIndex(GlobalSecondaryIndex):
+            class Meta:
+                index_name = CUST_ID_INDEX
+                read_capacity_units = 1
+                write_capacity_units = 1
+                projection = AllProjection()
+
+            cust_id = UnicodeAttribute(hash_key=True)
+
         class SubHubAccountModel(Model):
             class Meta:
                 table_name = _table
@@ -54,6 +126,7 @@ class SubHubAccount:
             cust_id = UnicodeAttribute(null=True)
             origin_system = UnicodeAttribute()
             customer_status = UnicodeAttribute()
+            cust_id_index = CustIdIndex()
 
         self.model = SubHubAccountModel
 
@@ -68,31 +141,52 @@ class SubHubAccount:
         )
 
     def get_user(self, uid: str) -> Optional[SubHubAccountModel]:
+        if self.cache is not None:
+            cached = self.cache.get(uid)
+            if cached is not None:
+                return self.model(**cached)
         try:
             subscription_user = self.model.get(uid, consistent_read=True)
-            return subscription_user
         except DoesNotExist:
             logger.error("get user", uid=uid)
             return None
+        if self.cache is not None:
+            self.cache.set(uid, dict(subscription_user.attribute_values))
+        return subscription_user
+
+    def get_user_by_cust_id(self, cust_id: str) -> Optional[SubHubAccountModel]:
+        cust_key = f"{CUST_ID_INDEX}:{cust_id}"
+        if self.cache is not None:
+            uid = self.cache.get(cust_key)
+            if uid is not None:
+                user = self.get_user(uid)
+                if user and user.cust_id == cust_id:
+                    return user
+                self.cache.invalidate(cust_key)
+        user = next(iter(self.model.cust_id_index.query(cust_id, limit=1)), None)
+        if not user:
+            logger.info("get user by cust id miss", cust_id=cust_id)
+            return None
+        if self.cache is not None:
+            self.cache.set(cust_key, user.user_id)
+            self.cache.set(user.user_id, dict(user.attribute_values))
+        return user
 
-    @staticmethod
-    def save_user(user: SubHubAccountModel) -> bool:
+    def save_user(self, user: SubHubAccountModel) -> bool:
         try:
             user.save()
             return True
         except PutError:
             logger.error("save user", user=user)
             return False
+        finally:
+            self._invalidate(user.user_id)
 
-    def append_custid(self, uid: str, cust_id: str) -> bool:
-        try:
-            update_user = self.model.get(uid, consistent_read=True)
-            update_user.cust_id = cust_id
-            update_user.save()
-            return True
-        except DoesNotExist:
+    def append_custid(self, uid: str, cust_id: str) -> Optional[SubHubAccountModel]:
+        update_user = self._update_user(uid, self.model.cust_id.set(cust_id))
+        if not update_user:
             logger.error("append custid", uid=uid, cust_id=cust_id)
-            return False
+        return update_user
 
     def remove_from_db(self, uid: str) -> bool:
         try:
@@ -101,16 +195,35 @@ class SubHubAccount:
         except DoesNotExist:
             logger.error("remove from db", uid=uid)
             return False
+        finally:
+            self._invalidate(uid)
 
-    def mark_deleted(self, uid: str) -> bool:
-        try:
-            delete_user = self.model.get(uid, consistent_read=True)
-            delete_user.customer_status = "deleted"
-            delete_user.save()
-            return True
-        except DoesNotExist:
+    def mark_deleted(self, uid: str) -> Optional[SubHubAccountModel]:
+        delete_user = self._update_user(uid, self.model.customer_status.set("deleted"))
+        if not delete_user:
             logger.error("mark deleted", uid=uid)
-            return False
+        return delete_user
+
+    def _update_user(self, uid: str, *actions) -> Optional[SubHubAccountModel]:
+        # A single conditional UpdateItem: the condition keeps it from
+        # creating a partial item and ALL_NEW hands back the updated record.
+        update_user = self.model(uid)
+        try:
+            update_user.update(
+                actions=list(actions), condition=self.model.user_id.exists()
+            )
+        except UpdateError as e:
+            self._invalidate(uid)
+            if not _is_conditional_check_failure(e):
+                logger.error("update user", uid=uid, error=e)
+            return None
+        if self.cache is not None:
+            self.cache.set(uid, dict(update_user.attribute_values))
+        return update_user
+
+    def _invalidate(self, uid: str) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(uid)
 
 
 def _create_hub_model(table_name_, region_, host_):
@@ -144,9 +257,21 @@ class HubEvent:
             hub_event = self.model.get(event_id, consistent_read=True)
             return hub_event
         except DoesNotExist:
-            logger.error("get event", event_id=event_id)
+            # the common case for a first delivery, not an error
+            logger.info("get event", event_id=event_id)
             return None
 
+    def batch_get_events(self, event_ids: Iterable[str]) -> Dict[str, HubEventModel]:
+        # BatchGetItem through pynamodb, which pages the keys 100 at a time and
+        # re-requests any UnprocessedKeys until every page has been answered.
+        keys = list(dict.fromkeys(event_ids))
+        if not keys:
+            return {}
+        return {
+            hub_event.event_id: hub_event
+            for hub_event in self.model.batch_get(keys, consistent_read=True)
+        }
+
     @staticmethod
     def save_event(hub_event: HubEventModel) -> bool:
         try:
@@ -156,16 +281,28 @@ class HubEvent:
             logger.error("save event", hub_event=hub_event)
             return False
 
-    def append_event(self, event_id: str, sent_system: str) -> bool:
+    def append_event(self, event_id: str, sent_system: str) -> Optional[HubEventModel]:
+        # Upsert in one UpdateItem: list_append onto the (possibly missing)
+        # sent_system list, guarded so concurrent deliveries never record a
+        # system twice.  Returns the new item, or None if nothing changed.
+        sent_systems = self.model.sent_system
+        update_event = self.model(event_id)
         try:
-            update_event = self.model.get(event_id, consistent_read=True)
-            if not sent_system in update_event.sent_system:
-                update_event.sent_system.append(sent_system)
-                update_event.save()
-                return True
-        except DoesNotExist:
-            logger.error("append event", event_id=event_id, sent_system=sent_system)
-            return False
+            update_event.update(
+                actions=[sent_systems.set((sent_systems | []).append([sent_system]))],
+                condition=~sent_systems.contains(sent_system),
+            )
+            return update_event
+        except UpdateError as e:
+            if _is_conditional_check_failure(e):
+                logger.info(
+                    "event already sent", event_id=event_id, sent_system=sent_system
+                )
+            else:
+                logger.error(
+                    "append event", event_id=event_id, sent_system=sent_system, error=e
+                )
+            return None
 
     def remove_from_db(self, event_id: str) -> bool:
         try:
@@ -176,6 +313,280 @@ class HubEvent:
             return False
 
 
+OUTBOX_STATUS_INDEX = "status-index"
+OUTBOX_PENDING = "pending"
+OUTBOX_DEAD = "dead"
+
+
+def _create_outbox_model(table_name_, region_, host_):
+    class OutboxStatusIndex(GlobalSecondaryIndex):
+        class Meta:
+            index_name = OUTBOX_STATUS_INDEX
+            read_capacity_units = 1
+            write_capacity_units = 1
+            projection = AllProjection()
+
+        status = UnicodeAttribute(hash_key=True)
+        next_attempt_at = NumberAttribute(range_key=True)
+
+    class HubOutboxModel(Model):
+        class Meta:
+            table_name = table_name_
+            region = region_
+            if host_:
+                host = host_
+
+        # one delivery per event and route, keyed "<event_id>:<route>"
+        delivery_id = UnicodeAttribute(hash_key=True)
+        event_id = UnicodeAttribute()
+        route = UnicodeAttribute()
+        payload = UnicodeAttribute()
+        status = UnicodeAttribute()
+        attempts = NumberAttribute()
+        next_attempt_at = NumberAttribute()
+        last_error = UnicodeAttribute(null=True)
+        updated_at = NumberAttribute()
+        status_index = OutboxStatusIndex()
+
+    return HubOutboxModel
+
+
+class HubOutboxModel(Model):
+    delivery_id = UnicodeAttribute(hash_key=True)
+    event_id = UnicodeAttribute()
+    route = UnicodeAttribute()
+    payload = UnicodeAttribute()
+    status = UnicodeAttribute()
+    attempts = NumberAttribute()
+    next_attempt_at = NumberAttribute()
+    last_error = UnicodeAttribute(null=True)
+    updated_at = NumberAttribute()
+
+
+class HubOutbox:
+    """
+    Route deliveries that failed and are retried on their own, without
+    re-running the event's pipeline.
+    """
+
+    def __init__(self, table_name: str, region: str, host: Optional[str] = None):
+        self.model = _create_outbox_model(table_name, region, host)
+
+    def add(
+        self, event_id: str, route: str, payload: str, error: str, next_attempt_at: int
+    ) -> bool:
+        # The first attempt was the pipeline's own delivery.  An event that
+        # fails again while its delivery is pending keeps the pending one.
+        # Returns whether the delivery is now in the outbox.
+        delivery = self.model(
+            f"{event_id}:{route}",
+            event_id=event_id,
+            route=route,
+            payload=payload,
+            status=OUTBOX_PENDING,
+            attempts=1,
+            next_attempt_at=next_attempt_at,
+            last_error=error,
+            updated_at=int(time.time()),
+        )
+        try:
+            delivery.save(condition=self.model.delivery_id.does_not_exist())
+            return True
+        except PutError as e:
+            if _is_conditional_check_failure(e):
+                logger.info("delivery already queued", event_id=event_id, route=route)
+                return True
+            logger.error("add delivery", event_id=event_id, route=route, error=e)
+            return False
+
+    def get_delivery(self, delivery_id: str) -> Optional[HubOutboxModel]:
+        try:
+            return self.model.get(delivery_id, consistent_read=True)
+        except DoesNotExist:
+            logger.info("get delivery", delivery_id=delivery_id)
+            return None
+
+    def due_deliveries(self, now: int, limit: int) -> List[HubOutboxModel]:
+        return list(
+            self.model.status_index.query(
+                OUTBOX_PENDING,
+                range_key_condition=self.model.next_attempt_at <= now,
+                limit=limit,
+            )
+        )
+
+    def claim(self, delivery: HubOutboxModel, lease_until: int) -> bool:
+        # Counts the attempt and hides the delivery from other drains until
+        # lease_until; fails if another drain claimed it first.
+        return self._update(
+            delivery,
+            self.model.attempts.set(delivery.attempts + 1),
+            self.model.next_attempt_at.set(lease_until),
+            condition=(self.model.attempts == delivery.attempts)
+            & (self.model.status == OUTBOX_PENDING),
+        )
+
+    def reschedule(
+        self, delivery: HubOutboxModel, next_attempt_at: int, error: str
+    ) -> bool:
+        return self._update(
+            delivery,
+            self.model.next_attempt_at.set(next_attempt_at),
+            self.model.last_error.set(error),
+        )
+
+    def mark_dead(self, delivery: HubOutboxModel, error: str) -> bool:
+        return self._update(
+            delivery,
+            self.model.status.set(OUTBOX_DEAD),
+            self.model.last_error.set(error),
+        )
+
+    def remove(self, delivery: HubOutboxModel) -> bool:
+        try:
+            delivery.delete()
+            return True
+        except DeleteError as e:
+            logger.error("remove delivery", delivery_id=delivery.delivery_id, error=e)
+            return False
+
+    def _update(self, delivery: HubOutboxModel, *actions, condition=None) -> bool:
+        try:
+            delivery.update(
+                actions=list(actions) + [self.model.updated_at.set(int(time.time()))],
+                condition=condition,
+            )
+            return True
+        except UpdateError as e:
+            if not _is_conditional_check_failure(e):
+                logger.error(
+                    "update delivery", delivery_id=delivery.delivery_id, error=e
+                )
+            return False
+
+
+def _create_checkpoint_model(table_name_, region_, host_):
+    class HubCheckpointModel(Model):
+        class Meta:
+            table_name = table_name_
+            region = region_
+            if host_:
+                host = host_
+
+        # Checkpoints live in the hub state table, keyed by their name.
+        name = UnicodeAttribute(hash_key=True)
+        last_event_id = UnicodeAttribute()
+        last_created = NumberAttribute()
+        updated_at = NumberAttribute()
+
+    return HubCheckpointModel
+
+
+class HubCheckpointModel(Model):
+    name = UnicodeAttribute(hash_key=True)
+    last_event_id = UnicodeAttribute()
+    last_created = NumberAttribute()
+    updated_at = NumberAttribute()
+
+
+class HubCheckpoint:
+    def __init__(self, table_name: str, region: str, host: Optional[str] = None):
+        self.model = _create_checkpoint_model(table_name, region, host)
+
+    def get_checkpoint(self, name: str) -> Optional[HubCheckpointModel]:
+        try:
+            return self.model.get(name, consistent_read=True)
+        except DoesNotExist:
+            logger.info("get checkpoint", name=name)
+            return None
+
+    def save_checkpoint(
+        self, name: str, last_event_id: str, last_created: int
+    ) -> Optional[HubCheckpointModel]:
+        # Only ever move a checkpoint forward, so an older run finishing late
+        # cannot rewind it.
+        checkpoint = self.model(name)
+        last_created_attr = self.model.last_created
+        try:
+            checkpoint.update(
+                actions=[
+                    self.model.last_event_id.set(last_event_id),
+                    last_created_attr.set(last_created),
+                    self.model.updated_at.set(int(time.time())),
+                ],
+                condition=last_created_attr.does_not_exist()
+                | (last_created_attr <= last_created),
+            )
+        except UpdateError as e:
+            if not _is_conditional_check_failure(e):
+                logger.error("save checkpoint", name=name, error=e)
+            return None
+        return checkpoint
+
+
+def _create_plan_catalog_model(table_name_, region_, host_):
+    class PlanCatalogModel(Model):
+        class Meta:
+            table_name = table_name_
+            region = region_
+            if host_:
+                host = host_
+
+        # Plan catalogs live in the hub state table, keyed by their name.
+        name = UnicodeAttribute(hash_key=True)
+        content_hash = UnicodeAttribute()
+        plans = UnicodeAttribute()
+        loaded_at = NumberAttribute()
+
+    return PlanCatalogModel
+
+
+class PlanCatalogModel(Model):
+    name = UnicodeAttribute(hash_key=True)
+    content_hash = UnicodeAttribute()
+    plans = UnicodeAttribute()
+    loaded_at = NumberAttribute()
+
+
+class HubPlanCatalog:
+    def __init__(self, table_name: str, region: str, host: Optional[str] = None):
+        self.model = _create_plan_catalog_model(table_name, region, host)
+
+    def get_catalog(self, name: str) -> Optional[PlanCatalogModel]:
+        try:
+            return self.model.get(name)
+        except DoesNotExist:
+            logger.info("get plan catalog", name=name)
+            return None
+
+    def save_catalog(
+        self, name: str, content_hash: str, plans: str, loaded_at: float
+    ) -> bool:
+        """
+        Store a catalog unless one listed later is already stored.
+        :param plans: json of the plans
+        :param loaded_at: time the plans were listed from Stripe
+        :return: True when stored
+        """
+        catalog = self.model(name)
+        loaded_at_attr = self.model.loaded_at
+        try:
+            catalog.update(
+                actions=[
+                    self.model.content_hash.set(content_hash),
+                    self.model.plans.set(plans),
+                    loaded_at_attr.set(loaded_at),
+                ],
+                condition=loaded_at_attr.does_not_exist()
+                | (loaded_at_attr < loaded_at),
+            )
+        except UpdateError as e:
+            if not _is_conditional_check_failure(e):
+                logger.error("save plan catalog", name=name, error=e)
+            return False
+        return True
+
+
 def _create_deleted_account_model(table_name_, region_, host_):
     class SubHubDeletedAccountModel(Model):
         class Meta:
@@ -201,7 +612,14 @@ class SubHubDeletedAccountModel(Model):
 
 
 class SubHubDeletedAccount:
-    def __init__(self, table_name: str, region: str, host: Optional[str] = None):
+    def __init__(
+        self,
+        table_name: str,
+        region: str,
+        host: Optional[str] = None,
+        cache: Optional[UserCache] = None,
+    ):
+        self.cache = cache
         _table = table_name
         _region = region
         _host = host
@@ -231,31 +649,36 @@ class SubHubDeletedAccount:
         )
 
     def get_user(self, uid: str) -> Optional[SubHubDeletedAccountModel]:
+        if self.cache is not None:
+            cached = self.cache.get(uid)
+            if cached is not None:
+                return self.model(**cached)
         try:
             subscription_user = self.model.get(uid, consistent_read=True)
-            return subscription_user
         except DoesNotExist:
             logger.error("get user", uid=uid)
             return None
+        if self.cache is not None:
+            self.cache.set(uid, dict(subscription_user.attribute_values))
+        return subscription_user
 
-    @staticmethod
-    def save_user(user: SubHubDeletedAccountModel) -> bool:
+    def save_user(self, user: SubHubDeletedAccountModel) -> bool:
         try:
             user.save()
             return True
         except PutError:
             logger.error("save user", user=user)
             return False
-
-    def append_custid(self, uid: str, cust_id: str) -> bool:
-        try:
-            update_user = self.model.get(uid, consistent_read=True)
-            update_user.cust_id = cust_id
-            update_user.save()
-            return True
-        except DoesNotExist:
+        finally:
+            self._invalidate(user.user_id)
+
+    def append_custid(
+        self, uid: str, cust_id: str
+    ) -> Optional[SubHubDeletedAccountModel]:
+        update_user = self._update_user(uid, self.model.cust_id.set(cust_id))
+        if not update_user:
             logger.error("append custid", uid=uid, cust_id=cust_id)
-            return False
+        return update_user
 
     def remove_from_db(self, uid: str) -> bool:
         try:
@@ -264,13 +687,32 @@ class SubHubDeletedAccount:
         except DoesNotExist:
             logger.error("remove from db", uid=uid)
             return False
+        finally:
+            self._invalidate(uid)
 
-    def mark_deleted(self, uid: str) -> bool:
-        try:
-            delete_user = self.model.get(uid, consistent_read=True)
-            delete_user.customer_status = "deleted"
-            delete_user.save()
-            return True
-        except DoesNotExist:
+    def mark_deleted(self, uid: str) -> Optional[SubHubDeletedAccountModel]:
+        delete_user = self._update_user(uid, self.model.customer_status.set("deleted"))
+        if not delete_user:
             logger.error("mark deleted", uid=uid)
-            return False
+        return delete_user
+
+    def _update_user(self, uid: str, *actions) -> Optional[SubHubDeletedAccountModel]:
+        # A single conditional UpdateItem: the condition keeps it from
+        # creating a partial item and ALL_NEW hands back the updated record.
+        update_user = self.model(uid)
+        try:
+            update_user.update(
+                actions=list(actions), condition=self.model.user_id.exists()
+            )
+        except UpdateError as e:
+            self._invalidate(uid)
+            if not _is_conditional_check_failure(e):
+                logger.error("update user", uid=uid, error=e)
+            return None
+        if self.cache is not None:
+            self.cache.set(uid, dict(update_user.attribute_values))
+        return update_user
+
+    def _invalidate(self, uid: str) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(uid)
@@ -0,0 +1,252 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Archive of the verified webhook events received at /hub, for replaying them
+when diagnosing the hub or load testing it.  Events are appended, one json
+document per line, to gzip compressed segments that rotate after
+HUB_ARCHIVE_SEGMENT_EVENTS events or HUB_ARCHIVE_SEGMENT_SECONDS seconds.
+Segments are kept in a local directory or in an S3 bucket.  In Lambda the
+handler flushes the archive at the end of every invocation, as the container
+may be frozen or reclaimed before the next one.
+"""
+
+import atexit
+import gzip
+import io
+import os
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from itertools import count
+from typing import BinaryIO, Dict, Iterator, List, Optional, Union
+
+import boto3
+
+from subhub.cfg import CFG
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+S3_URL_PREFIX = "s3://"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+class SegmentStore(ABC):
+    @abstractmethod
+    def create(self, name: str) -> BinaryIO:
+        """
+        Writable file of a new segment, stored once it is closed.
+        """
+
+    @abstractmethod
+    def list(self) -> List[str]:
+        """
+        Names of the stored segments, oldest first.
+        """
+
+    @abstractmethod
+    def open(self, name: str) -> BinaryIO:
+        """
+        Readable file of a stored segment.
+        """
+
+
+class LocalSegmentStore(SegmentStore):
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, name: str) -> BinaryIO:
+        return open(os.path.join(self.directory, name), "xb")
+
+    def list(self) -> List[str]:
+        return sorted(
+            n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX)
+        )
+
+    def open(self, name: str) -> BinaryIO:
+        return open(os.path.join(self.directory, name), "rb")
+
+
+class _S3Upload(io.BytesIO):
+    def __init__(self, store: "S3SegmentStore", key: str):
+        super().__init__()
+        self.store = store
+        self.key = key
+
+    def close(self):
+        if not self.closed:
+            self.store.client.put_object(
+                Bucket=self.store.bucket, Key=self.key, Body=self.getvalue()
+            )
+        super().close()
+
+
+class S3SegmentStore(SegmentStore):
+    """
+    Segments as objects under a prefix of a bucket.  A segment is uploaded
+    when it rotates, so the events of the open segment are lost when the
+    process ends without flushing the archive.
+    """
+
+    def __init__(self, bucket: str, prefix: str, region: str, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = client or boto3.client("s3", region_name=region)
+
+    def create(self, name: str) -> BinaryIO:
+        return _S3Upload(self, self.prefix + name)
+
+    def list(self) -> List[str]:
+        names = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                name = item["Key"][len(self.prefix) :]
+                if name.endswith(SEGMENT_SUFFIX):
+                    names.append(name)
+        return sorted(names)
+
+    def open(self, name: str) -> BinaryIO:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + name)
+        return io.BytesIO(response["Body"].read())
+
+
+class EventArchive:
+    def __init__(self, store: SegmentStore, max_events: int, max_seconds: int):
+        self.store = store
+        self.max_events = max(1, max_events)
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self._sequence = count(1)
+        self._file: Optional[BinaryIO] = None
+        self._gzip: Optional[gzip.GzipFile] = None
+        self._events = 0
+        self._opened = 0.0
+
+    def append(self, payload: Union[str, bytes]) -> None:
+        """
+        Append a webhook body to the open segment, rotating it when full.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        # json strings cannot hold raw line breaks, so only whitespace goes
+        line = payload.replace(b"\r", b"").replace(b"\n", b"") + b"\n"
+        with self._lock:
+            if self._gzip and time.monotonic() - self._opened >= self.max_seconds:
+                self._close()
+            if self._gzip is None:
+                self._open()
+            self._gzip.write(line)
+            # readable up to this event even if the process dies
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+            self._events += 1
+            if self._events >= self.max_events:
+                self._close()
+        METRICS.incr("hub.archive.events")
+
+    def flush(self) -> None:
+        """
+        Close the open segment, if any.
+        """
+        with self._lock:
+            if self._gzip:
+                self._close()
+
+    def _open(self) -> None:
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        name = f"events-{stamp}-{os.getpid()}-{next(self._sequence)}{SEGMENT_SUFFIX}"
+        self._file = self.store.create(name)
+        self._gzip = gzip.GzipFile(filename=name, mode="wb", fileobj=self._file)
+        self._events = 0
+        self._opened = time.monotonic()
+        logger.info("archive segment opened", segment=name)
+
+    def _close(self) -> None:
+        try:
+            self._gzip.close()
+            self._file.close()
+            METRICS.incr("hub.archive.segments")
+        finally:
+            self._gzip, self._file = None, None
+
+
+def read_segment(segment: BinaryIO) -> Iterator[str]:
+    """
+    Webhook bodies of a segment.  A segment still being written, or left by
+    a process that died, ends after its last complete event.
+    """
+    with gzip.GzipFile(fileobj=segment, mode="rb") as lines:
+        try:
+            for line in lines:
+                if line.strip():
+                    yield line.decode("utf-8")
+        except EOFError:
+            return
+
+
+def segment_store(url: str) -> SegmentStore:
+    """
+    Store for an s3://bucket/prefix url, or a local directory.
+    """
+    if url.startswith(S3_URL_PREFIX):
+        bucket, _, prefix = url[len(S3_URL_PREFIX) :].partition("/")
+        return S3SegmentStore(bucket, prefix, CFG.AWS_REGION)
+    return LocalSegmentStore(url)
+
+
+_archives: Dict[str, EventArchive] = dict()
+_archives_lock = threading.Lock()
+
+
+def get_event_archive() -> Optional[EventArchive]:
+    """
+    Archive configured by HUB_ARCHIVE_URL, None when it is unset.  Archives are
+    created once per process and flushed when it exits.
+    """
+    url = CFG.HUB_ARCHIVE_URL
+    if not url:
+        return None
+    with _archives_lock:
+        if url not in _archives:
+            archive = EventArchive(
+                segment_store(url),
+                CFG.HUB_ARCHIVE_SEGMENT_EVENTS,
+                CFG.HUB_ARCHIVE_SEGMENT_SECONDS,
+            )
+            atexit.register(archive.flush)
+            _archives[url] = archive
+        return _archives[url]
+
+
+def flush_event_archives() -> None:
+    """
+    Close the open segments of the archives of the process, storing them.
+    """
+    with _archives_lock:
+        archives = list(_archives.values())
+    for archive in archives:
+        try:
+            archive.flush()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("event archive flush failed", error=e)
+            METRICS.incr("hub.archive.failed")
+
+
+def archive_event(payload: Union[str, bytes]) -> None:
+    """
+    Archive a verified webhook body when HUB_ARCHIVE_URL is set.  Archive
+    errors are logged and never fail the webhook.
+    """
+    try:
+        archive = get_event_archive()
+        if archive:
+            archive.append(payload)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("event archive failed", error=e)
+        METRICS.incr("hub.archive.failed")
@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Coalescing of the customer.updated events of a hub worker batch.  Each of
+them carries the whole customer, so of the updates of one customer created
+within HUB_COALESCE_SECONDS of each other only the latest is delivered and
+the others are recorded as handled once all its routes were sent.  The SQS
+event source waits up to HUB_COALESCE_SECONDS to fill a batch, so that close
+updates of a customer reach the same batch.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from flask import g
+
+from subhub.hub.routes.pipeline import ROUTES, missing_routes
+from subhub.hub.stripe.controller import mark_routed, required_routes
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+COALESCED_EVENT_TYPES = frozenset(["customer.updated"])
+
+
+def coalesce_key(event: Optional[dict]) -> Optional[str]:
+    """
+    Customer id of an event that may be coalesced, None for other events.
+    """
+    if not event or event.get("type") not in COALESCED_EVENT_TYPES:
+        return None
+    return ((event.get("data") or {}).get("object") or {}).get("id")
+
+
+def superseded_events(events: List[Optional[dict]], window: int) -> Dict[int, int]:
+    """
+    :param events: events of a batch in the order received, None for bodies
+    that could not be decoded
+    :param window: max seconds between the creation of an update and of the
+    next update of the same customer for the first to be superseded
+    :return: index of each superseded event to the index of the event
+    delivered in its place
+    """
+    customers = defaultdict(list)
+    for i, event in enumerate(events):
+        key = coalesce_key(event)
+        if key:
+            customers[key].append(i)
+    superseded = dict()
+    for indices in customers.values():
+        indices.sort(key=lambda i: (events[i].get("created") or 0, i))
+        delivered = indices[-1]
+        for earlier, later in zip(reversed(indices[:-1]), reversed(indices[1:])):
+            gap = (events[later].get("created") or 0) - (
+                events[earlier].get("created") or 0
+            )
+            if gap > window:
+                delivered = earlier
+            else:
+                superseded[earlier] = delivered
+    return superseded
+
+
+def routes_sent(event: dict) -> bool:
+    """
+    Whether the event table records every route of a delivered event as
+    sent, rather than e.g. left in the outbox.
+    """
+    hub_event = g.hub_table.get_event(event["id"])
+    if hub_event is None:
+        return False
+    return not missing_routes(
+        required_routes(event["type"]), hub_event.sent_system or []
+    )
+
+
+def record_superseded(event: dict, delivered: dict) -> None:
+    """
+    Record the routes of a superseded event as sent, its state having been
+    delivered with a later event.
+    """
+    for route in required_routes(event["type"]):
+        g.hub_table.append_event(event["id"], ROUTES[route].sent_system)
+    mark_routed(event["id"])
+    logger.info("event coalesced", event_id=event["id"], delivered_id=delivered["id"])
+    METRICS.incr("hub.event.coalesced", event_type=event["type"])
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Helpers for processing Stripe events on a bounded worker pool while keeping
+the events of any one customer in the order Stripe created them.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import flask
+
+from subhub.log import get_logger
+
+logger = get_logger()
+
+
+def event_customer(event: dict) -> Optional[str]:
+    """
+    Stripe customer id an event belongs to, if any.
+    :param event: Stripe event dict, possibly malformed
+    :return: customer id or None
+    """
+    data = event.get("data")
+    data_object = data.get("object") if isinstance(data, dict) else None
+    if not isinstance(data_object, dict):
+        return None
+    if data_object.get("object") == "customer":
+        customer = data_object.get("id")
+    else:
+        customer = data_object.get("customer")
+    if isinstance(customer, dict):
+        # an expanded customer
+        customer = customer.get("id")
+    return customer if isinstance(customer, str) else None
+
+
+def group_by_customer(events: List[dict]) -> List[List[dict]]:
+    """
+    Split events into per-customer groups, each sorted by created time.
+    Events without a customer form groups of their own.
+    :param events:
+    :return: list of event groups
+    """
+    groups: Dict[tuple, List[dict]] = OrderedDict()
+    for i, event in enumerate(events):
+        customer = event_customer(event)
+        key = ("customer", customer) if customer else ("event", i)
+        groups.setdefault(key, []).append(event)
+    return [
+        sorted(group, key=lambda event: event.get("created") or 0)
+        for group in groups.values()
+    ]
+
+
+def app_context_factory() -> Optional[Callable]:
+    """
+    Capture the current Flask app and the values set on flask.g so that worker
+    threads can run route and pipeline code with the same context.
+    :return: callable returning a context manager, None outside an app context
+    """
+    if not flask.has_app_context():
+        return None
+    app = flask.current_app._get_current_object()
+    current_g = flask.g._get_current_object()
+    # tests may replace flask.g with a mock, only copy a real globals object
+    values = (
+        dict(vars(current_g))
+        if isinstance(current_g, app.app_ctx_globals_class)
+        else dict()
+    )
+
+    @contextmanager
+    def context():
+        with app.app_context():
+            for name, value in values.items():
+                setattr(flask.g, name, value)
+            yield
+
+    return context
+
+
+def process_by_customer(
+    events: List[dict],
+    process: Callable[[dict], object],
+    max_workers: int,
+    context: Optional[Callable] = None,
+) -> Dict[str, object]:
+    """
+    Run process(event) for every event on at most max_workers threads.  The
+    events of one customer run sequentially in created order, different
+    customers run in parallel.
+    :param events: Stripe event dicts
+    :param process: callable invoked once per event
+    :param max_workers: size of the worker pool
+    :param context: optional context manager factory entered by each worker
+    :return: dict of event id to the value returned by process
+    """
+
+    def process_group(group):
+        results = OrderedDict()
+        with context() if context else _no_context():
+            for event in group:
+                try:
+                    results[event["id"]] = process(event)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.error("process event", event_id=event["id"], error=e)
+                    results[event["id"]] = e
+        return results
+
+    groups = group_by_customer(events)
+    results: Dict[str, object] = OrderedDict()
+    if not groups:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as pool:
+        for group_results in pool.map(process_group, groups):
+            results.update(group_results)
+    return results
+
+
+@contextmanager
+def _no_context():
+    yield
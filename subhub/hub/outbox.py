@@ -0,0 +1,91 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Retries of the route deliveries that RoutesPipeline left in the outbox when
+HUB_OUTBOX_ENABLED is set.  Each retry sends only the route that failed.
+"""
+
+import time
+from typing import Optional
+
+from flask import g
+
+from subhub.cfg import CFG
+from subhub.db import HubOutboxModel
+from subhub.hub.routes.pipeline import ROUTES
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+# upper bound of the wait between two attempts of a delivery, in seconds
+MAX_BACKOFF_SECONDS = 300
+
+
+def retry_delay(attempts: int) -> int:
+    """
+    Seconds to wait before the next attempt of a delivery that has been
+    attempted attempts times.
+    """
+    return min(MAX_BACKOFF_SECONDS, CFG.OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+
+
+def drain(limit: Optional[int] = None) -> dict:
+    """
+    Retry the outbox deliveries that are due.  A delivery that succeeds, or
+    whose route was recorded as sent in the meantime, is removed; one that
+    fails is rescheduled with exponential backoff, and dead-lettered after
+    OUTBOX_MAX_ATTEMPTS attempts.
+    :param limit: max deliveries to retry, OUTBOX_DRAIN_LIMIT by default
+    :return: counts of the deliveries by result
+    """
+    limit = limit or CFG.OUTBOX_DRAIN_LIMIT
+    now = int(time.time())
+    stats = dict(due=0, sent=0, already_sent=0, retry=0, dead=0, claimed_elsewhere=0)
+    for delivery in g.hub_outbox.due_deliveries(now, limit):
+        stats["due"] += 1
+        # hide the delivery from other drains while it is being retried
+        lease_until = int(time.time()) + 2 * CFG.HUB_ROUTE_TIMEOUT_SECONDS
+        if not g.hub_outbox.claim(delivery, lease_until):
+            stats["claimed_elsewhere"] += 1
+            continue
+        stats[retry(delivery)] += 1
+    logger.info("hub outbox drained", **stats)
+    return stats
+
+
+def retry(delivery: HubOutboxModel) -> str:
+    """
+    Attempt a claimed delivery once.
+    :return: sent, already_sent, retry or dead
+    """
+    route = ROUTES[delivery.route]
+    hub_event = g.hub_table.get_event(delivery.event_id)
+    if hub_event and route.sent_system in (hub_event.sent_system or []):
+        # a late delivery or a replay got there first
+        g.hub_outbox.remove(delivery)
+        return "already_sent"
+    try:
+        result, error = route(delivery.payload).route(), "route failed"
+    except Exception as e:  # pylint: disable=broad-except
+        result, error = None, str(e)
+    if result is not None:
+        g.hub_outbox.remove(delivery)
+        METRICS.incr("hub.outbox.sent", route=delivery.route)
+        return "sent"
+    attempts = delivery.attempts
+    if attempts >= CFG.OUTBOX_MAX_ATTEMPTS:
+        logger.error(
+            "hub outbox dead letter",
+            delivery_id=delivery.delivery_id,
+            attempts=attempts,
+            error=error,
+        )
+        g.hub_outbox.mark_dead(delivery, error)
+        METRICS.incr("hub.outbox.dead", route=delivery.route)
+        return "dead"
+    g.hub_outbox.reschedule(delivery, int(time.time()) + retry_delay(attempts), error)
+    METRICS.incr("hub.outbox.retry", route=delivery.route)
+    return "retry"
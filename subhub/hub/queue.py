@@ -0,0 +1,166 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Queue of verified Stripe webhook bodies waiting to be processed by the hub
+worker.  SQS is used when deployed, LocalEventQueue stands in for it when
+running locally and in tests.
+"""
+
+import itertools
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from typing import Dict, List
+
+import boto3
+
+from subhub.cfg import CFG
+from subhub.log import get_logger
+
+logger = get_logger()
+
+LOCAL_QUEUE_URL = "local"
+
+QueueMessage = namedtuple("QueueMessage", ["message_id", "receipt_handle", "body"])
+
+
+class EventQueue(ABC):
+    @abstractmethod
+    def send(self, body: str) -> str:
+        """
+        Enqueue a message body.
+        :return: message id
+        """
+
+    @abstractmethod
+    def receive(self, max_messages: int, wait_seconds: int = 0) -> List[QueueMessage]:
+        """
+        Receive up to max_messages messages.  Received messages stay invisible
+        to other receivers until they are deleted or the visibility timeout
+        expires.
+        """
+
+    @abstractmethod
+    def delete(self, messages: List[QueueMessage]) -> None:
+        """
+        Delete processed messages.
+        """
+
+
+class SqsEventQueue(EventQueue):
+    # SQS receives and deletes at most 10 messages per call
+    MAX_BATCH = 10
+
+    def __init__(self, queue_url: str, region: str, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client("sqs", region_name=region)
+
+    def send(self, body: str) -> str:
+        response = self.client.send_message(QueueUrl=self.queue_url, MessageBody=body)
+        return response["MessageId"]
+
+    def receive(self, max_messages: int, wait_seconds: int = 0) -> List[QueueMessage]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=max(1, min(max_messages, self.MAX_BATCH)),
+            WaitTimeSeconds=wait_seconds,
+        )
+        return [
+            QueueMessage(m["MessageId"], m["ReceiptHandle"], m["Body"])
+            for m in response.get("Messages", [])
+        ]
+
+    def delete(self, messages: List[QueueMessage]) -> None:
+        for start in range(0, len(messages), self.MAX_BATCH):
+            batch = messages[start : start + self.MAX_BATCH]
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    dict(Id=str(i), ReceiptHandle=m.receipt_handle)
+                    for i, m in enumerate(batch)
+                ],
+            )
+            if response.get("Failed"):
+                logger.error("queue delete failed", failed=response["Failed"])
+
+
+class LocalEventQueue(EventQueue):
+    """
+    In-process queue with the SQS semantics the worker relies on.
+    """
+
+    def __init__(self, visibility_timeout: int = 30):
+        self.visibility_timeout = visibility_timeout
+        self._ids = itertools.count(1)
+        self._messages: deque = deque()
+        self._in_flight: Dict[str, tuple] = dict()
+        self._condition = threading.Condition()
+
+    def send(self, body: str) -> str:
+        with self._condition:
+            message_id = str(next(self._ids))
+            self._messages.append((message_id, body))
+            self._condition.notify()
+        return message_id
+
+    def receive(self, max_messages: int, wait_seconds: int = 0) -> List[QueueMessage]:
+        deadline = time.monotonic() + wait_seconds
+        with self._condition:
+            self._requeue_expired()
+            while not self._messages:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+                self._requeue_expired()
+            messages = []
+            while self._messages and len(messages) < max_messages:
+                message_id, body = self._messages.popleft()
+                receipt_handle = f"{message_id}-{next(self._ids)}"
+                self._in_flight[receipt_handle] = (
+                    message_id,
+                    body,
+                    time.monotonic() + self.visibility_timeout,
+                )
+                messages.append(QueueMessage(message_id, receipt_handle, body))
+            return messages
+
+    def delete(self, messages: List[QueueMessage]) -> None:
+        with self._condition:
+            for message in messages:
+                self._in_flight.pop(message.receipt_handle, None)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._messages) + len(self._in_flight)
+
+    def _requeue_expired(self):
+        now = time.monotonic()
+        for receipt_handle, (message_id, body, visible_at) in list(
+            self._in_flight.items()
+        ):
+            if visible_at <= now:
+                del self._in_flight[receipt_handle]
+                self._messages.append((message_id, body))
+
+
+_queues: Dict[str, EventQueue] = dict()
+_queues_lock = threading.Lock()
+
+
+def get_event_queue() -> EventQueue:
+    """
+    Queue configured by HUB_QUEUE_URL, a process wide LocalEventQueue when it
+    is unset or "local".  Queues are created once per process.
+    """
+    queue_url = CFG.HUB_QUEUE_URL or LOCAL_QUEUE_URL
+    with _queues_lock:
+        if queue_url not in _queues:
+            if queue_url == LOCAL_QUEUE_URL:
+                _queues[queue_url] = LocalEventQueue()
+            else:
+                _queues[queue_url] = SqsEventQueue(queue_url, CFG.AWS_REGION)
+        return _queues[queue_url]
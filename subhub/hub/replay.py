@@ -0,0 +1,164 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Replay the events of an archive segment through the hub.
+
+    python -m subhub.hub.replay --list
+    python -m subhub.hub.replay SEGMENT [--rate N] [--mode pipeline|process]
+        [--only-routes ROUTES] [--limit N]
+
+SEGMENT is the name of a segment of HUB_ARCHIVE_URL or the path of a segment
+file.  Events are delivered to their routes unless --only-routes restricts
+them; --only-routes "" runs the handlers without delivering anything.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+from subhub.app import create_app
+from subhub.hub.archive import get_event_archive, read_segment
+from subhub.hub.stripe.controller import StripeHubEventPipeline, event_process
+from subhub.hub.worker import app_context
+from subhub.log import get_logger
+
+logger = get_logger()
+
+PIPELINE = "pipeline"
+PROCESS = "process"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replay_event(event: dict, mode: str, only_routes: Optional[List[str]]) -> bool:
+    """
+    :return: True when the event was processed
+    """
+    if mode == PROCESS:
+        return event_process(event, only_routes=only_routes).status_code == 200
+    try:
+        StripeHubEventPipeline(event, only_routes=only_routes).run()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("replayed event failed", event_id=event.get("id"), error=e)
+        return False
+    return True
+
+
+def replay(
+    bodies: Iterable[str],
+    rate: float = 0,
+    mode: str = PIPELINE,
+    only_routes: Optional[List[str]] = None,
+) -> dict:
+    """
+    Run webhook bodies through the hub, one after the other.
+    :param rate: events started per second, 0 for as fast as possible
+    :return: throughput, and count, failures and latency per event type
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    failed: Dict[str, int] = defaultdict(int)
+    started = time.perf_counter()
+    replayed = 0
+    for body in bodies:
+        if rate:
+            delay = started + replayed / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        event = json.loads(body)
+        event_started = time.perf_counter()
+        if not replay_event(event, mode, only_routes):
+            failed[event["type"]] += 1
+        latencies[event["type"]].append(time.perf_counter() - event_started)
+        replayed += 1
+    elapsed = time.perf_counter() - started
+    return dict(
+        events=replayed,
+        failed=sum(failed.values()),
+        elapsed=elapsed,
+        throughput=replayed / elapsed if elapsed else 0.0,
+        event_types={
+            event_type: dict(
+                count=len(values),
+                failed=failed[event_type],
+                mean=sum(values) / len(values),
+                p50=percentile(values, 0.5),
+                p95=percentile(values, 0.95),
+                max=max(values),
+            )
+            for event_type, values in sorted(latencies.items())
+        },
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m subhub.hub.replay",
+        description="Replay the events of an archive segment through the hub.",
+    )
+    parser.add_argument("segment", nargs="?", help="segment name or file path")
+    parser.add_argument(
+        "--list", action="store_true", help="list the segments of HUB_ARCHIVE_URL"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0, help="events per second, 0 for no limit"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=[PIPELINE, PROCESS],
+        default=PIPELINE,
+        help="run StripeHubEventPipeline, or event_process like the reconciler",
+    )
+    parser.add_argument(
+        "--only-routes",
+        help="comma separated routes to deliver to, all when not given",
+    )
+    parser.add_argument("--limit", type=int, help="max events to replay")
+    args = parser.parse_args(argv)
+    if not args.list and not args.segment:
+        parser.error("a segment is required unless --list is given")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    archive = get_event_archive()
+    if args.list:
+        if archive is None:
+            print("HUB_ARCHIVE_URL is not set", file=sys.stderr)
+            return 1
+        print("\n".join(archive.store.list()))
+        return 0
+    if os.path.isfile(args.segment):
+        segment = open(args.segment, "rb")
+    elif archive is not None:
+        segment = archive.store.open(args.segment)
+    else:
+        print(f"no segment {args.segment}", file=sys.stderr)
+        return 1
+    only_routes = None
+    if args.only_routes is not None:
+        only_routes = [r for r in args.only_routes.split(",") if r]
+    app = create_app()
+    with segment, app_context(app.app):
+        report = replay(
+            islice(read_segment(segment), args.limit),
+            rate=args.rate,
+            mode=args.mode,
+            only_routes=only_routes,
+        )
+    print(json.dumps(report, indent=2))
+    return 0 if not report["failed"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
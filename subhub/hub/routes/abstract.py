@@ -6,29 +6,27 @@ from abc import ABC
 
 import flask
 
+from subhub.hub.routes.message import RouteMessage
 from subhub.log import get_logger
 
 logger = get_logger()
 
 
 class AbstractRoute(ABC):
+    # value recorded in the HubEvent sent_system list once the route succeeded
+    sent_system: str
+
     def __init__(self, payload):
-        self.payload = payload
+        # RouteMessage, dict or its JSON encoding
+        self.message = RouteMessage.coerce(payload)
+        self.payload = self.message.data
 
     def report_route(self, payload: dict, sent_system: str):
         logger.info("report route", payload=payload, sent_system=sent_system)
-        existing = flask.g.hub_table.get_event(payload["event_id"])
-        if not existing:
-            created = flask.g.hub_table.new_event(
-                event_id=payload["event_id"], sent_system=sent_system
-            )
-            saved = flask.g.hub_table.save_event(created)
-            logger.info("new event", created=created, saved=saved)
-        else:
-            updated = flask.g.hub_table.append_event(
-                event_id=payload["event_id"], sent_system=sent_system
-            )
-            logger.info("updated event", existing=existing, updated=updated)
+        updated = flask.g.hub_table.append_event(
+            event_id=payload["event_id"], sent_system=sent_system
+        )
+        logger.info("updated event", updated=updated)
 
     def report_route_error(self, payload):
         logger.error("report route error", payload=payload)
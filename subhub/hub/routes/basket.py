@@ -0,0 +1,205 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+HTTP delivery to the Salesforce basket endpoint over a keep-alive session
+shared by the process, one payload per request or many in a bulk request.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from subhub.cfg import CFG
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+# upper bound of a single backoff sleep, in seconds
+MAX_BACKOFF = 5.0
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Session shared by the process so deliveries reuse pooled connections
+    instead of paying DNS, TCP and TLS setup per request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=CFG.BASKET_POOL_SIZE,
+                    pool_maxsize=CFG.BASKET_POOL_SIZE,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def backoff(attempt: int) -> float:
+    """
+    Full jitter exponential backoff for the given retry attempt.
+    """
+    return random.uniform(0, min(MAX_BACKOFF, CFG.BASKET_BACKOFF * 2**attempt))
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """
+    POST to basket with connect and read timeouts, retrying 5xx responses and
+    connection errors as long as the retry can finish within
+    HUB_ROUTE_TIMEOUT_SECONDS of the first attempt.  Read timeouts are not
+    retried as basket may already have accepted the request.
+    :return: the last response
+    :raises requests.exceptions.RequestException: when no response was received
+    """
+    retries = CFG.BASKET_RETRIES
+    timeout = (CFG.BASKET_CONNECT_TIMEOUT, CFG.BASKET_READ_TIMEOUT)
+    deadline = time.perf_counter() + CFG.HUB_ROUTE_TIMEOUT_SECONDS
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = get_session().post(url, timeout=timeout, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            METRICS.observe(
+                "hub.basket.duration", time.perf_counter() - started, status="error"
+            )
+            response, error = None, e
+        else:
+            METRICS.observe(
+                "hub.basket.duration",
+                time.perf_counter() - started,
+                status=response.status_code,
+            )
+            if response.status_code < 500:
+                return response
+            error = None
+        delay = backoff(attempt)
+        if attempt == retries or time.perf_counter() + delay + sum(timeout) > deadline:
+            if error:
+                raise error
+            return response
+        logger.error(
+            "basket delivery failed",
+            error=error,
+            status_code=response.status_code if response is not None else None,
+            attempt=attempt,
+        )
+        METRICS.incr("hub.basket.retry")
+        time.sleep(delay)
+        attempt += 1
+
+
+class BasketBatcher:
+    """
+    Buffers payloads and posts them to basket as one JSON array once
+    max_items are waiting or the oldest has waited max_wait seconds.  Every
+    payload of a batch is answered with the batch response.
+    """
+
+    def __init__(self, url: str, max_items: int, max_wait: float):
+        self.url = url
+        self.max_items = max(1, max_items)
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[dict, Future]] = []
+        self._oldest: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, payload: dict) -> Future:
+        """
+        Queue a payload for the next batch.
+        :return: future resolved with the basket response of the batch, or
+        the error that prevented one
+        """
+        future = Future()
+        with self._cond:
+            if not self._pending:
+                self._oldest = time.perf_counter()
+            self._pending.append((payload, future))
+            # restarted should the batch thread ever have died
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="basket-batcher", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _next_batch(self) -> List[Tuple[dict, Future]]:
+        with self._cond:
+            while True:
+                if len(self._pending) >= self.max_items:
+                    break
+                if self._pending:
+                    remaining = self._oldest + self.max_wait - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            batch = self._pending[: self.max_items]
+            del self._pending[: self.max_items]
+            self._oldest = time.perf_counter() if self._pending else None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.send(batch)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("basket batch failed", error=e, size=len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def send(self, batch: List[Tuple[dict, Future]]) -> None:
+        METRICS.incr("hub.basket.batch")
+        METRICS.incr("hub.basket.batch.items", len(batch))
+        try:
+            response = post(self.url, json=[payload for payload, _ in batch])
+        except requests.exceptions.RequestException as e:
+            logger.error("basket batch error", error=e, size=len(batch))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        logger.info(
+            "basket batch sent", size=len(batch), status_code=response.status_code
+        )
+        for _, future in batch:
+            future.set_result(response)
+
+
+_batcher: Optional[BasketBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> BasketBatcher:
+    """
+    Batcher shared by the process for the Salesforce basket endpoint, sized by
+    BASKET_BATCH_SIZE and BASKET_BATCH_MILLIS.
+    """
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = BasketBatcher(
+                    CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY,
+                    CFG.BASKET_BATCH_SIZE,
+                    CFG.BASKET_BATCH_MILLIS / 1000,
+                )
+    return _batcher
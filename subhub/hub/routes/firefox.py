@@ -3,10 +3,10 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import boto3
-import json
+import threading
 
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from stripe.error import APIConnectionError
 
 from subhub.hub.routes.abstract import AbstractRoute
 from subhub.cfg import CFG
@@ -14,20 +14,47 @@ from subhub.log import get_logger
 
 logger = get_logger()
 
+_sns_client = None
+_sns_client_lock = threading.Lock()
+
+
+def get_sns_client():
+    """
+    SNS client shared by the process so warm invocations reuse its connection
+    pool instead of building a client and a TLS connection per message.
+    """
+    global _sns_client
+    if _sns_client is None:
+        with _sns_client_lock:
+            if _sns_client is None:
+                _sns_client = boto3.client(
+                    "sns",
+                    region_name=CFG.AWS_REGION,
+                    config=Config(
+                        max_pool_connections=CFG.SNS_MAX_POOL_CONNECTIONS,
+                        connect_timeout=CFG.SNS_CONNECT_TIMEOUT,
+                        read_timeout=CFG.SNS_READ_TIMEOUT,
+                        # one retry keeps a publish within HUB_ROUTE_TIMEOUT_SECONDS
+                        retries={"max_attempts": 1},
+                    ),
+                )
+    return _sns_client
+
 
 class FirefoxRoute(AbstractRoute):
+    sent_system = "firefox"
+
     def route(self):
         try:
-            sns_client = boto3.client("sns", region_name=CFG.AWS_REGION)
+            sns_client = get_sns_client()
             response = sns_client.publish(
                 TopicArn=CFG.TOPIC_ARN_KEY,
-                Message=json.dumps({"default": json.dumps(self.payload)}),
+                Message=self.message.sns_message,
                 MessageStructure="json",
             )
             if response["ResponseMetadata"]["HTTPStatusCode"] == 200:
                 logger.info("message sent to Firefox queue", response=response)
-                route_payload = json.loads(self.payload)
-                self.report_route(route_payload, "firefox")
+                self.report_route(self.payload, self.sent_system)
                 return response
         except ClientError as e:
             logger.error("Firefox error", error=e)
@@ -0,0 +1,60 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+from typing import Optional, Union
+
+
+class RouteMessage:
+    """
+    Data a handler sends to its routes.  The encodings the routes need are
+    computed on first use and shared by every route of the event.
+    """
+
+    __slots__ = ("data", "_json", "_sns_message")
+
+    def __init__(self, data: dict, serialized: Optional[str] = None):
+        self.data = data
+        self._json = serialized
+        self._sns_message: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, serialized: Union[str, bytes]) -> "RouteMessage":
+        if isinstance(serialized, bytes):
+            serialized = serialized.decode("utf-8")
+        return cls(json.loads(serialized), serialized)
+
+    @classmethod
+    def coerce(cls, message: Union["RouteMessage", dict, str, bytes]) -> "RouteMessage":
+        """
+        The message itself, or one wrapping a dict or its JSON encoding.
+        """
+        if isinstance(message, RouteMessage):
+            return message
+        if isinstance(message, dict):
+            return cls(message)
+        return cls.from_json(message)
+
+    @property
+    def event_id(self) -> str:
+        return self.data["event_id"]
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.data)
+        return self._json
+
+    @property
+    def sns_message(self) -> str:
+        """
+        SNS message for MessageStructure json, whose default message is the
+        JSON encoded string of the payload JSON.
+        """
+        if self._sns_message is None:
+            self._sns_message = json.dumps({"default": json.dumps(self.json)})
+        return self._sns_message
+
+    def __repr__(self):
+        return f"RouteMessage({self.data!r})"
@@ -2,21 +2,196 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+from typing import Dict, List, Optional
+
+import flask
+
+from subhub.cfg import CFG
+from subhub.hub.concurrency import app_context_factory
 from subhub.hub.routes.firefox import FirefoxRoute
+from subhub.hub.routes.message import RouteMessage
 from subhub.hub.routes.salesforce import SalesforceRoute
 from subhub.hub.routes.static import StaticRoutes
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+ROUTES = {
+    StaticRoutes.SALESFORCE_ROUTE: SalesforceRoute,
+    StaticRoutes.FIREFOX_ROUTE: FirefoxRoute,
+}
+
+SENT = "sent"
+FAILED = "failed"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+# failed or timed out, and left in the outbox for a retry
+DEFERRED = "deferred"
+
+# sent_system recorded for an event its handler ran without routing it
+NOT_ROUTED = "not_routed"
+
+# status is one of SENT, FAILED, TIMEOUT, SKIPPED or DEFERRED, error the
+# exception if any
+RouteOutcome = namedtuple("RouteOutcome", ["route", "status", "duration", "error"])
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by all pipelines of the process, bounded by
+    HUB_ROUTES_WORKERS.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=CFG.HUB_ROUTES_WORKERS, thread_name_prefix="hub-route"
+            )
+        return _executor
+
+
+def missing_routes(report_routes: List[str], sent_systems: List[str]) -> List[str]:
+    """
+    Routes of report_routes whose destination is not yet in sent_systems.
+    :param report_routes: StaticRoutes values an event is sent to
+    :param sent_systems: HubEvent sent_system of the event
+    :return: the routes still to be sent, none for an event its handler
+    chose not to route
+    """
+    if NOT_ROUTED in sent_systems:
+        return []
+    return [r for r in report_routes if ROUTES[r].sent_system not in sent_systems]
+
+
+def undelivered_routes(outcomes: Optional[Dict[str, RouteOutcome]]) -> List[str]:
+    """
+    Routes of a pipeline run that were due but not sent.
+    :param outcomes: RoutesPipeline.run result, None when nothing was routed
+    :return: the routes that failed or timed out, deferred routes are left to
+    the outbox
+    """
+    if not outcomes:
+        return []
+    return [r for r, o in outcomes.items() if o.status not in (SENT, SKIPPED, DEFERRED)]
 
 
 class RoutesPipeline:
-    def __init__(self, report_routes, data):
+    def __init__(self, report_routes, data, only_routes: Optional[List[str]] = None):
         self.report_routes = report_routes
-        self.data = data
+        # shared by the routes so each encoding of data is computed once
+        self.message = RouteMessage.coerce(data)
+        self.only_routes = only_routes
 
-    def run(self):
+    def run(self) -> Dict[str, RouteOutcome]:
+        """
+        Deliver data to the routes, concurrently when HUB_ROUTES_CONCURRENT is
+        set and more than one route is due.  A failing route does not stop
+        the others; its error is raised once all of them have finished.
+        :return: outcome per route
+        """
+        outcomes: Dict[str, RouteOutcome] = OrderedDict()
+        due = []
         for r in self.report_routes:
-            if r == StaticRoutes.SALESFORCE_ROUTE:
-                SalesforceRoute(self.data).route()
-            elif r == StaticRoutes.FIREFOX_ROUTE:
-                FirefoxRoute(self.data).route()
-            else:
+            if r not in ROUTES:
                 raise Exception("We do no support " + str(r))
+            if self.only_routes is not None and r not in self.only_routes:
+                outcomes[r] = RouteOutcome(r, SKIPPED, 0.0, None)
+            else:
+                due.append(r)
+        if CFG.HUB_ROUTES_CONCURRENT and len(due) > 1:
+            outcomes.update(self.run_concurrent(due))
+        else:
+            for r in due:
+                outcomes[r] = self.deliver(r)
+        if CFG.HUB_OUTBOX_ENABLED:
+            outcomes = self.defer(outcomes)
+        logger.info("routes delivered", outcomes=outcomes)
+        for outcome in outcomes.values():
+            if outcome.error:
+                raise outcome.error
+        return outcomes
+
+    def defer(self, outcomes: Dict[str, RouteOutcome]) -> Dict[str, RouteOutcome]:
+        """
+        Put the failed and timed out routes in the outbox, to be retried on
+        their own by the outbox drain.
+        :return: outcomes with the routes the outbox accepted as DEFERRED
+        """
+        hub_outbox = getattr(flask.g, "hub_outbox", None)
+        if hub_outbox is None:
+            return outcomes
+        next_attempt_at = int(time.time()) + CFG.OUTBOX_BACKOFF_SECONDS
+        deferred = OrderedDict(outcomes)
+        for r, outcome in outcomes.items():
+            if outcome.status not in (FAILED, TIMEOUT):
+                continue
+            error = str(outcome.error or outcome.status)
+            if hub_outbox.add(
+                self.message.event_id, r, self.message.json, error, next_attempt_at
+            ):
+                METRICS.incr("hub.outbox.added", route=r)
+                deferred[r] = RouteOutcome(r, DEFERRED, outcome.duration, None)
+        return deferred
+
+    def run_concurrent(self, routes: List[str]) -> Dict[str, RouteOutcome]:
+        context = app_context_factory()
+        timeout = CFG.HUB_ROUTE_TIMEOUT_SECONDS
+        started = time.perf_counter()
+        futures = OrderedDict(
+            (r, get_executor().submit(self.deliver, r, context)) for r in routes
+        )
+        wait(futures.values(), timeout=timeout)
+        outcomes = OrderedDict()
+        for r, future in futures.items():
+            if future.done():
+                outcomes[r] = future.result()
+            else:
+                logger.error("route timed out", route=r, timeout=timeout)
+                METRICS.incr("hub.route.timeout", route=r)
+                future.add_done_callback(self.finished_late)
+                outcomes[r] = RouteOutcome(
+                    r,
+                    TIMEOUT,
+                    time.perf_counter() - started,
+                    TimeoutError(f"{r} did not finish within {timeout} seconds"),
+                )
+        return outcomes
+
+    @staticmethod
+    def finished_late(future):
+        """
+        A timed out delivery cannot be cancelled and keeps its pool thread until
+        the route's own I/O timeouts end it.  If it still succeeds it records
+        its sent_system as usual, and the retry of the failed event may then
+        deliver that route a second time.
+        """
+        outcome = future.result()
+        logger.info("route finished after timeout", outcome=outcome)
+        METRICS.incr("hub.route.late", route=outcome.route, status=outcome.status)
+
+    def deliver(self, route: str, context=None) -> RouteOutcome:
+        started = time.perf_counter()
+        try:
+            if context:
+                with context():
+                    result = ROUTES[route](self.message).route()
+            else:
+                result = ROUTES[route](self.message).route()
+            # routes report their own delivery errors and return None
+            status, error = SENT if result is not None else FAILED, None
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("route failed", route=route, error=e)
+            status, error = FAILED, e
+        if status == FAILED:
+            METRICS.incr("hub.route.failed", route=route)
+        duration = time.perf_counter() - started
+        METRICS.observe("hub.route.duration", duration, route=route)
+        return RouteOutcome(route, status, duration, error)
@@ -2,9 +2,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import json
+from concurrent.futures import TimeoutError
+
 import requests
 
+from subhub.hub.routes import basket
 from subhub.hub.routes.abstract import AbstractRoute
 from subhub.cfg import CFG
 
@@ -14,11 +16,33 @@ logger = get_logger()
 
 
 class SalesforceRoute(AbstractRoute):
+    sent_system = "salesforce"
+
     def route(self):
-        route_payload = json.loads(self.payload)
-        basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
-        request_post = requests.post(basket_url, json=route_payload)
-        self.report_route(route_payload, "salesforce")
+        try:
+            request_post = self.post(self.payload)
+        except (requests.exceptions.RequestException, TimeoutError) as e:
+            logger.error("Salesforce error", error=e)
+            self.report_route_error(self.payload)
+            return None
         logger.info(
             "sending to salesforce", payload=self.payload, request_post=request_post
         )
+        if request_post.status_code >= 400:
+            logger.error("Salesforce error", status_code=request_post.status_code)
+            self.report_route_error(self.payload)
+            return None
+        self.report_route(self.payload, self.sent_system)
+        return request_post
+
+    @staticmethod
+    def post(route_payload: dict) -> requests.Response:
+        """
+        Post the payload on its own, or with BASKET_BATCH_ENABLED as part of a
+        bulk request, waiting at most HUB_ROUTE_TIMEOUT_SECONDS for the batch.
+        """
+        if CFG.BASKET_BATCH_ENABLED:
+            future = basket.get_batcher().submit(route_payload)
+            return future.result(timeout=CFG.HUB_ROUTE_TIMEOUT_SECONDS)
+        basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
+        return basket.post(basket_url, json=route_payload)
@@ -3,53 +3,113 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 from abc import ABC, abstractmethod
-import requests
-from attrdict import AttrDict
+from typing import Dict, List, Optional, Type
+
+import flask
+import stripe
+from pynamodb.exceptions import PynamoDBException
+from subhub.hub.routes import basket
 from subhub.hub.routes.pipeline import RoutesPipeline
+from subhub.hub.stripe.views import EventView, ObjectView
 from subhub.cfg import CFG
 
 from subhub.log import get_logger
 
 logger = get_logger()
 
+# Stripe event type to the AbstractStripeHubEvent subclass handling it
+EVENT_HANDLERS: Dict[str, Type["AbstractStripeHubEvent"]] = dict()
+
+
+def handles(*event_types: str):
+    """
+    Register the decorated handler class for the given Stripe event types.
+    Calling syntax:
+        @handles("customer.created")
+        class StripeCustomerCreated(AbstractStripeHubEvent):
+            pass
+    """
+
+    def register(handler):
+        for event_type in event_types:
+            registered = EVENT_HANDLERS.get(event_type)
+            if registered and registered is not handler:
+                raise ValueError(
+                    f"{event_type} is already handled by {registered.__name__}"
+                )
+            EVENT_HANDLERS[event_type] = handler
+        return handler
+
+    return register
+
 
 class AbstractStripeHubEvent(ABC):
-    def __init__(self, payload):
-        self.payload = AttrDict(payload)
+    # StaticRoutes an event of this type is reported to
+    routes: List[str] = []
+    # ObjectView subclass with the data.object fields the handler uses
+    object_view: Type[ObjectView] = ObjectView
+
+    def __init__(self, payload, only_routes: Optional[List[str]] = None):
+        self.payload = payload
+        self.event = EventView(payload)
+        self.object = self.object_view(self.event.data.get("object") or {})
+        self.only_routes = only_routes
+        # RouteOutcome per route once send_to_routes has run
+        self.route_outcomes = None
 
     @property
     def is_active_or_trialing(self):
-        return self.payload.data.object.status in ("active", "trialing")
+        return self.object.status in ("active", "trialing")
 
     @staticmethod
-    def send_to_routes(report_routes, message_to_route):
+    def get_user_id(customer_id: str) -> Optional[str]:
+        """
+        Resolve the userid for a Stripe customer, first from the user table's
+        cust_id index and only on a miss from the Stripe customer metadata.
+        Index errors, e.g. while the index is still backfilling, also fall
+        back to Stripe.
+        :param customer_id:
+        :return: userid or None
+        """
+        subhub_account = getattr(flask.g, "subhub_account", None)
+        if subhub_account:
+            try:
+                user = subhub_account.get_user_by_cust_id(customer_id)
+            except PynamoDBException as e:
+                logger.error("get user by cust id", cust_id=customer_id, error=e)
+                user = None
+            if user:
+                return user.user_id
+        customer = stripe.Customer.retrieve(id=customer_id)
+        return customer.metadata.get("userid")
+
+    def send_to_routes(self, report_routes, message_to_route):
         logger.info(
             "send to routes",
             report_routes=report_routes,
+            only_routes=self.only_routes,
             message_to_route=message_to_route,
         )
-        RoutesPipeline(report_routes, message_to_route).run()
+        self.route_outcomes = RoutesPipeline(
+            report_routes, message_to_route, self.only_routes
+        ).run()
+        return self.route_outcomes
 
     @staticmethod
-    def send_to_salesforce(self, payload):
+    def send_to_salesforce(payload):
         logger.info("sending to salesforce", payload=payload)
         uri = CFG.SALESFORCE_BASKET_URI
-        requests.post(uri, data=payload)
+        return basket.post(uri, data=payload)
 
     @staticmethod
     def unhandled_event(payload):
-        logger.info("Event not handled", payload=payload)
-
-    def unhandled_event(self, payload):
-        logger.info("Event not handled", payload=payload)
-
-    @staticmethod
-    def unhandled_event(payload):
-        logger.info("Event not handled", payload=payload)
+        logger.info(
+            "Event not handled", event_id=payload.get("id"), event_type=payload["type"]
+        )
 
     @abstractmethod
     def run(self):
         raise NotImplementedError
 
     def create_data(self, **kwargs):
-        return dict(event_id=self.payload.id, event_type=self.payload.type, **kwargs)
+        return dict(event_id=self.event.id, event_type=self.event.type, **kwargs)
@@ -0,0 +1,25 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from subhub.hub.stripe.abstract import AbstractStripeHubEvent, handles
+from subhub.log import get_logger
+from subhub.plan_catalog import get_plan_catalog
+
+logger = get_logger()
+
+
+@handles(
+    "plan.created",
+    "plan.updated",
+    "plan.deleted",
+    "product.created",
+    "product.updated",
+    "product.deleted",
+)
+class StripeCatalogChanged(AbstractStripeHubEvent):
+    def run(self):
+        logger.info(
+            "plan catalog changed", event_id=self.event.id, event_type=self.event.type
+        )
+        get_plan_catalog().invalidate()
@@ -2,57 +2,176 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-from flask import request, Response
+import threading
+import time
+from typing import List, Optional
+
+import cachetools
+from flask import g, request, Response
+from pynamodb.exceptions import PynamoDBException
 
 import stripe
 from subhub.cfg import CFG
-from subhub.hub.stripe.customer import StripeCustomerCreated
-from subhub.hub.stripe.customer import StripeCustomerDeleted
-from subhub.hub.stripe.customer import StripeCustomerSubscriptionCreated
-from subhub.hub.stripe.customer import StripeCustomerUpdated
-from subhub.hub.stripe.subscription import StripeSubscriptionCreated
-from subhub.hub.stripe.customer import StripeCustomerSubscriptionUpdated
-from subhub.hub.stripe.customer import StripeCustomerSubscriptionDeleted
-from subhub.hub.stripe.customer import StripeCustomerSourceExpiring
-from subhub.hub.stripe.invoices import StripeInvoiceFinalized
-from subhub.hub.stripe.invoices import StripeInvoicePaymentFailed
-from subhub.hub.stripe.intents import StripePaymentIntentSucceeded
+from subhub.hub.stripe.abstract import AbstractStripeHubEvent, EVENT_HANDLERS
+
+# handler modules register their event types with @handles on import
+from subhub.hub.stripe import (  # noqa: F401
+    catalog,
+    customer,
+    intents,
+    invoices,
+    subscription,
+)
+from subhub.hub.archive import archive_event
+from subhub.hub.concurrency import app_context_factory, process_by_customer
+from subhub.hub.queue import get_event_queue
+from subhub.hub.routes.pipeline import (
+    NOT_ROUTED,
+    SENT,
+    SKIPPED,
+    missing_routes,
+    undelivered_routes,
+)
 from subhub.log import get_logger
+from subhub.metrics import METRICS
 
 logger = get_logger()
 
 
+def required_routes(event_type: str) -> List[str]:
+    """
+    Routes an event of event_type is reported to, empty for unhandled types.
+    """
+    handler = EVENT_HANDLERS.get(event_type)
+    return list(handler.routes) if handler else []
+
+
 class StripeHubEventPipeline:
-    def __init__(self, payload):
+    def __init__(self, payload, only_routes: Optional[List[str]] = None):
         assert isinstance(payload, object)
         self.payload = payload
+        self.only_routes = only_routes
 
     def run(self):
+        """
+        Run the handler registered for the event type.
+        :return: RouteOutcome per route, None when nothing was routed
+        """
         event_type = self.payload["type"]
-        if event_type == "customer.subscription.created":
-            StripeCustomerSubscriptionCreated(self.payload).run()
-        elif event_type == "customer.subscription.updated":
-            StripeCustomerSubscriptionUpdated(self.payload).run()
-        elif event_type == "customer.subscription.deleted":
-            StripeCustomerSubscriptionDeleted(self.payload).run()
-        elif event_type == "customer.created":
-            StripeCustomerCreated(self.payload).run()
-        elif event_type == "customer.updated":
-            StripeCustomerUpdated(self.payload).run()
-        elif event_type == "customer.deleted":
-            StripeCustomerDeleted(self.payload).run()
-        elif event_type == "customer.source.expiring":
-            StripeCustomerSourceExpiring(self.payload).run()
-        elif event_type == "subscription.created":
-            StripeSubscriptionCreated(self.payload).run()
-        elif event_type == "invoice.finalized":
-            StripeInvoiceFinalized(self.payload).run()
-        elif event_type == "payment_intent.succeeded":
-            StripePaymentIntentSucceeded(self.payload).run()
-        elif event_type == "invoice.payment_failed":
-            StripeInvoicePaymentFailed(self.payload).run()
-        else:
-            pass
+        METRICS.incr("hub.event.received", event_type=event_type)
+        handler = EVENT_HANDLERS.get(event_type)
+        if not handler:
+            METRICS.incr("hub.event.unhandled", event_type=event_type)
+            AbstractStripeHubEvent.unhandled_event(self.payload)
+            return
+        started = time.perf_counter()
+        event = handler(self.payload, only_routes=self.only_routes)
+        try:
+            event.run()
+        except Exception:
+            METRICS.incr("hub.event.failed", event_type=event_type)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            METRICS.observe("hub.event.duration", duration, event_type=event_type)
+            logger.info("event duration", event_type=event_type, duration=duration)
+        METRICS.incr("hub.event.handled", event_type=event_type)
+        if event.route_outcomes is None and handler.routes:
+            # e.g. a subscription update nobody is told about, recorded so
+            # that it is not replayed as missing its routes
+            logger.info("event not routed", event_id=self.payload["id"])
+            g.hub_table.append_event(self.payload["id"], NOT_ROUTED)
+        return event.route_outcomes
+
+
+_routed_events: Optional[cachetools.TTLCache] = None
+_routed_events_lock = threading.Lock()
+
+
+def routed_events() -> cachetools.TTLCache:
+    """
+    Ids of the recent events this process saw delivered to all their routes,
+    so redeliveries of them are answered without reading the event table.
+    """
+    global _routed_events
+    with _routed_events_lock:
+        if _routed_events is None:
+            _routed_events = cachetools.TTLCache(
+                CFG.HUB_ROUTED_EVENTS_MAXSIZE, CFG.HUB_ROUTED_EVENTS_TTL
+            )
+        return _routed_events
+
+
+def mark_routed(event_id: str) -> None:
+    cache = routed_events()
+    with _routed_events_lock:
+        cache[event_id] = True
+
+
+def pending_routes(event) -> Optional[List[str]]:
+    """
+    Routes of the event not yet recorded as sent in the event table.
+    :param event: Stripe event
+    :return: the routes still to be sent, empty once all of them were, None
+    when HUB_IDEMPOTENCY_ENABLED is off or the event is not routed
+    """
+    routes = required_routes(event["type"])
+    if not CFG.HUB_IDEMPOTENCY_ENABLED or not routes:
+        return None
+    cache = routed_events()
+    with _routed_events_lock:
+        if event["id"] in cache:
+            return []
+    try:
+        hub_event = g.hub_table.get_event(event["id"])
+    except PynamoDBException as e:
+        logger.error("pending routes", event_id=event["id"], error=e)
+        return routes
+    if hub_event is None:
+        return routes
+    pending = missing_routes(routes, hub_event.sent_system or [])
+    if not pending:
+        mark_routed(event["id"])
+    return pending
+
+
+def skip_routed_event(event) -> None:
+    logger.info("event already routed", event_id=event["id"])
+    METRICS.incr("hub.event.duplicate", event_type=event["type"])
+
+
+def process_event(event) -> List[str]:
+    """
+    Run the pipeline for a webhook event.  With HUB_IDEMPOTENCY_ENABLED only
+    the routes not yet recorded as sent are delivered, so a Stripe retry of
+    an event whose first delivery timed out does not send it again, and the
+    handler is not run at all once every route was sent.
+    :param event: Stripe event
+    :return: the routes that were due but failed or timed out
+    """
+    only_routes = pending_routes(event)
+    if only_routes == []:
+        skip_routed_event(event)
+        return []
+    outcomes = StripeHubEventPipeline(event, only_routes=only_routes).run()
+    if outcomes and all(o.status in (SENT, SKIPPED) for o in outcomes.values()):
+        mark_routed(event["id"])
+    return undelivered_routes(outcomes)
+
+
+def enqueue_event(event, payload) -> str:
+    """
+    Queue a verified webhook event for the hub worker.
+    :param event: verified Stripe event
+    :param payload: raw request body the signature was verified against
+    :return: message id
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8")
+    message_id = get_event_queue().send(payload)
+    METRICS.incr("hub.event.enqueued", event_type=event["type"])
+    logger.info("event enqueued", event_id=event["id"], message_id=message_id)
+    return message_id
 
 
 def view() -> tuple:
@@ -62,8 +181,18 @@ def view() -> tuple:
         logger.info("payload type", type=type(payload))
         sig_header = request.headers["Stripe-Signature"]
         event = stripe.Webhook.construct_event(payload, sig_header, CFG.HUB_API_KEY)
-        pipeline = StripeHubEventPipeline(event)
-        pipeline.run()
+        archive_event(payload)
+        if not CFG.HUB_ASYNC_ENABLED:
+            undelivered = process_event(event)
+            if undelivered:
+                logger.error(
+                    "routes not delivered", event_id=event["id"], routes=undelivered
+                )
+                return Response(f"routes not delivered: {undelivered}", status=500)
+        elif pending_routes(event) == []:
+            skip_routed_event(event)
+        else:
+            enqueue_event(event, payload)
     except ValueError as e:
         # Invalid payload
         logger.error("ValueError", error=e)
@@ -79,17 +208,99 @@ def view() -> tuple:
     return Response("Success", status=200)
 
 
-def event_process(missing_event):
-    logger.info("event process", missing_event=missing_event)
+def event_process(missing_event, only_routes: Optional[List[str]] = None):
+    """
+    Run the pipeline for an event that was not received through the webhook.
+    :param missing_event: Stripe event dict
+    :param only_routes: restrict delivery to these routes, all when None
+    :return: 200 response unless the event failed or a due route was not sent
+    """
+    logger.info("event process", missing_event=missing_event, only_routes=only_routes)
     try:
         payload = missing_event
         if not isinstance(payload, dict):
             raise Exception
         logger.info("check payload", payload=payload)
-        pipeline = StripeHubEventPipeline(payload)
-        pipeline.run()
+        pipeline = StripeHubEventPipeline(payload, only_routes=only_routes)
+        undelivered = undelivered_routes(pipeline.run())
     except Exception as e:
         logger.error("General Exception", error=e)
         return Response(e, status=500)
+    if undelivered:
+        logger.error(
+            "routes not delivered", event_id=payload.get("id"), routes=undelivered
+        )
+        return Response(f"routes not delivered: {undelivered}", status=500)
 
     return Response("Success", status=200)
+
+
+def process_trusted_event(event: dict, only_routes: Optional[List[str]]) -> dict:
+    """
+    Run the pipeline for an event that needs no signature check, delivering
+    only the routes not yet recorded as sent.
+    :param only_routes: restrict delivery to these routes, all when None
+    :return: outcome of the event for the replay response
+    """
+    routes = pending_routes(event)
+    if routes is None:
+        routes = only_routes
+    elif only_routes is not None:
+        routes = [r for r in routes if r in only_routes]
+    if routes == []:
+        return dict(event_id=event["id"], status="skipped")
+    try:
+        outcomes = StripeHubEventPipeline(event, only_routes=routes).run()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("replayed event failed", event_id=event["id"], error=e)
+        return dict(event_id=event["id"], status="failed", error=str(e))
+    undelivered = undelivered_routes(outcomes)
+    if undelivered:
+        error = f"routes not delivered: {undelivered}"
+        return dict(event_id=event["id"], status="failed", error=error)
+    return dict(event_id=event["id"], status="processed")
+
+
+def malformed_event(event: dict) -> Optional[str]:
+    """
+    Why a replayed event cannot be processed, None when it can.
+    """
+    if not event.get("id") or not isinstance(event["id"], str):
+        return "event has no id"
+    if not event.get("type") or not isinstance(event["type"], str):
+        return "event has no type"
+    return None
+
+
+def replay(data: dict) -> tuple:
+    """
+    Process a batch of already trusted Stripe events, e.g. to backfill the
+    routes.  The events of one customer run in the order Stripe created
+    them, up to HUB_REPLAY_WORKERS customers in parallel.
+    :param data: events and optional only_routes
+    :return: counts and the outcome of every event, in the request order
+    """
+    events = data["events"]
+    only_routes = data.get("only_routes")
+    # validated per event, so a malformed event only fails itself
+    errors = [malformed_event(event) for event in events]
+    results = process_by_customer(
+        [event for event, error in zip(events, errors) if not error],
+        lambda event: process_trusted_event(event, only_routes),
+        CFG.HUB_REPLAY_WORKERS,
+        context=app_context_factory(),
+    )
+    outcomes = []
+    for event, error in zip(events, errors):
+        if error:
+            outcome = dict(event_id=event.get("id"), status="failed", error=error)
+        else:
+            outcome = results[event["id"]]
+        if isinstance(outcome, Exception):
+            outcome = dict(event_id=event["id"], status="failed", error=str(outcome))
+        outcomes.append(outcome)
+    counts = dict(processed=0, skipped=0, failed=0)
+    for outcome in outcomes:
+        counts[outcome["status"]] += 1
+    logger.info("events replayed", events=len(events), **counts)
+    return dict(events=len(events), results=outcomes, **counts), 200
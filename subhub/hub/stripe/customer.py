@@ -2,14 +2,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import json
 import time
 from datetime import datetime
 
 import stripe
 from stripe.error import InvalidRequestError
 
-from subhub.hub.stripe.abstract import AbstractStripeHubEvent
+from subhub.hub.stripe.abstract import AbstractStripeHubEvent, handles
+from subhub.hub.stripe.views import CustomerView, SourceView, SubscriptionView
 from subhub.hub.routes.static import StaticRoutes
 from subhub.exceptions import ClientError
 
@@ -18,61 +18,74 @@ from subhub.log import get_logger
 logger = get_logger()
 
 
+@handles("customer.created")
 class StripeCustomerCreated(AbstractStripeHubEvent):
+    routes = [StaticRoutes.SALESFORCE_ROUTE]
+    object_view = CustomerView
+
     def run(self):
         logger.info("customer created", payload=self.payload)
-        cust_name = self.payload.data.object.name
+        cust_name = self.object.name
         if not cust_name:
             cust_name = ""
         data = self.create_data(
-            email=self.payload.data.object.email,
-            customer_id=self.payload.data.object.id,
+            email=self.object.email,
+            customer_id=self.object.id,
             name=cust_name,
-            user_id=self.payload.data.object.metadata.get("userid", None),
+            user_id=(self.object.metadata or {}).get("userid", None),
         )
         logger.info("customer created", data=data)
-        routes = [StaticRoutes.SALESFORCE_ROUTE]
-        self.send_to_routes(routes, json.dumps(data))
+        self.send_to_routes(self.routes, data)
 
 
+@handles("customer.deleted")
 class StripeCustomerDeleted(AbstractStripeHubEvent):
+    routes = [StaticRoutes.SALESFORCE_ROUTE]
+    object_view = CustomerView
+
     def run(self):
         logger.info("customer deleted", payload=self.payload)
-        cust_name = self.payload.data.object.name
+        cust_name = self.object.name
         if not cust_name:
             cust_name = ""
         data = self.create_data(
-            email=self.payload.data.object.email,
-            customer_id=self.payload.data.object.id,
+            email=self.object.email,
+            customer_id=self.object.id,
             name=cust_name,
-            user_id=self.payload.data.object.metadata.get("userid", None),
+            user_id=(self.object.metadata or {}).get("userid", None),
         )
         logger.info("customer deleted", data=data)
-        routes = [StaticRoutes.SALESFORCE_ROUTE]
-        self.send_to_routes(routes, json.dumps(data))
+        self.send_to_routes(self.routes, data)
 
 
+@handles("customer.updated")
 class StripeCustomerUpdated(AbstractStripeHubEvent):
+    routes = [StaticRoutes.SALESFORCE_ROUTE]
+    object_view = CustomerView
+
     def run(self):
         logger.info("customer updated", payload=self.payload)
-        cust_name = self.payload.data.object.name
+        cust_name = self.object.name
         if not cust_name:
             cust_name = ""
         data = self.create_data(
-            email=self.payload.data.object.email,
-            customer_id=self.payload.data.object.id,
+            email=self.object.email,
+            customer_id=self.object.id,
             name=cust_name,
         )
         logger.info("customer updated", data=data)
-        routes = [StaticRoutes.SALESFORCE_ROUTE]
-        self.send_to_routes(routes, json.dumps(data))
+        self.send_to_routes(self.routes, data)
 
 
+@handles("customer.source.expiring")
 class StripeCustomerSourceExpiring(AbstractStripeHubEvent):
+    routes = [StaticRoutes.SALESFORCE_ROUTE]
+    object_view = SourceView
+
     def run(self):
         try:
             logger.info("customer source expiring")
-            customer_id = self.payload.data.object.customer
+            customer_id = self.object.customer
             updated_customer = stripe.Customer.retrieve(id=customer_id)
             email = updated_customer.email
             nicknames = list()
@@ -82,26 +95,28 @@ class StripeCustomerSourceExpiring(AbstractStripeHubEvent):
             data = self.create_data(
                 email=email,
                 nickname=nicknames[0],
-                customer_id=self.payload.data.object.customer,
-                last4=self.payload.data.object.last4,
-                brand=self.payload.data.object.brand,
-                exp_month=self.payload.data.object.exp_month,
-                exp_year=self.payload.data.object.exp_year,
+                customer_id=self.object.customer,
+                last4=self.object.last4,
+                brand=self.object.brand,
+                exp_month=self.object.exp_month,
+                exp_year=self.object.exp_year,
             )
-            routes = [StaticRoutes.SALESFORCE_ROUTE]
-            self.send_to_routes(routes, json.dumps(data))
+            self.send_to_routes(self.routes, data)
         except InvalidRequestError as e:
             logger.error("Unable to find customer", error=e)
             raise InvalidRequestError(message="Unable to find customer", param=str(e))
 
 
+@handles("customer.subscription.created")
 class StripeCustomerSubscriptionCreated(AbstractStripeHubEvent):
+    routes = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
+    object_view = SubscriptionView
+
     def run(self):
         logger.info("customer subscription created", payload=self.payload)
         try:
-            customer_id = self.payload.data.object.customer
-            updated_customer = stripe.Customer.retrieve(id=customer_id)
-            user_id = updated_customer.metadata.get("userid")
+            customer_id = self.object.customer
+            user_id = self.get_user_id(customer_id)
         except InvalidRequestError as e:
             logger.error("Unable to find customer", error=e)
             raise InvalidRequestError(message="Unable to find customer", param=str(e))
@@ -109,148 +124,143 @@ class StripeCustomerSubscriptionCreated(AbstractStripeHubEvent):
             data = self.create_data(
                 uid=user_id,
                 active=self.is_active_or_trialing,
-                subscriptionId=self.payload.data.object.id,
-                subscription_id=self.payload.data.object.id,
-                productName=self.payload.data.object.plan.nickname,
-                eventId=self.payload.id,  # required by FxA
-                eventCreatedAt=self.payload.created,  # required by FxA
+                subscriptionId=self.object.id,
+                subscription_id=self.object.id,
+                productName=self.object.plan["nickname"],
+                eventId=self.event.id,  # required by FxA
+                eventCreatedAt=self.event.created,  # required by FxA
                 messageCreatedAt=int(time.time()),  # required by FxA
-                invoice_id=self.payload.data.object.latest_invoice,
-                plan_amount=self.payload.data.object.plan.amount,
-                customer_id=self.payload.data.object.customer,
-                nickname=self.payload.data.object.plan.nickname,
-                created=self.payload.data.object.plan.created,
-                canceled_at=self.payload.data.object.canceled_at,
-                cancel_at=self.payload.data.object.cancel_at,
-                cancel_at_period_end=self.payload.data.object.cancel_at_period_end,
+                invoice_id=self.object.latest_invoice,
+                plan_amount=self.object.plan["amount"],
+                customer_id=self.object.customer,
+                nickname=self.object.plan["nickname"],
+                created=self.object.plan["created"],
+                canceled_at=self.object.canceled_at,
+                cancel_at=self.object.cancel_at,
+                cancel_at_period_end=self.object.cancel_at_period_end,
             )
             logger.info("customer subscription created", data=data)
-            routes = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
-            self.send_to_routes(routes, json.dumps(data))
+            self.send_to_routes(self.routes, data)
         else:
             logger.error(
                 "customer subscription created no userid",
-                error=self.payload.object.customer,
+                error=self.object.customer,
                 user_id=user_id,
             )
-            raise ClientError(
-                f"userid is None for customer {self.payload.object.customer}"
-            )
+            raise ClientError(f"userid is None for customer {self.object.customer}")
 
 
+@handles("customer.subscription.deleted")
 class StripeCustomerSubscriptionDeleted(AbstractStripeHubEvent):
+    routes = [StaticRoutes.FIREFOX_ROUTE]
+    object_view = SubscriptionView
+
     def run(self):
         logger.info("customer subscription deleted", payload=self.payload)
         try:
-            customer_id = self.payload.data.object.customer
-            updated_customer = stripe.Customer.retrieve(id=customer_id)
-            user_id = updated_customer.metadata.get("userid")
+            customer_id = self.object.customer
+            user_id = self.get_user_id(customer_id)
         except InvalidRequestError as e:
             logger.error("Unable to find customer", error=e)
             raise InvalidRequestError(message="Unable to find customer", param=str(e))
         if user_id:
             data = dict(
                 active=self.is_active_or_trialing,
-                subscriptionId=self.payload.data.object.id,
-                productName=self.payload.data.object.plan.nickname,
-                eventId=self.payload.id,  # required by FxA
-                event_id=self.payload.id,  # required by SubHub
-                eventCreatedAt=self.payload.created,
+                subscriptionId=self.object.id,
+                productName=self.object.plan["nickname"],
+                eventId=self.event.id,  # required by FxA
+                event_id=self.event.id,  # required by SubHub
+                eventCreatedAt=self.event.created,
                 messageCreatedAt=int(time.time()),
             )
             logger.info("customer subscription deleted", data=data)
-            routes = [StaticRoutes.FIREFOX_ROUTE]
-            self.send_to_routes(routes, json.dumps(data))
+            self.send_to_routes(self.routes, data)
         else:
             logger.error(
                 "customer subscription deleted no userid",
-                error=self.payload.object.customer,
+                error=self.object.customer,
                 user_id=user_id,
             )
-            raise ClientError(
-                f"userid is None for customer {self.payload.object.customer}"
-            )
+            raise ClientError(f"userid is None for customer {self.object.customer}")
 
 
+@handles("customer.subscription.updated")
 class StripeCustomerSubscriptionUpdated(AbstractStripeHubEvent):
+    routes = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
+    object_view = SubscriptionView
+
     def run(self):
         logger.info("customer subscription updated", payload=self.payload)
         try:
-            customer_id = self.payload.data.object.customer
-            updated_customer = stripe.Customer.retrieve(id=customer_id)
-            user_id = updated_customer.metadata.get("userid")
+            customer_id = self.object.customer
+            user_id = self.get_user_id(customer_id)
         except InvalidRequestError as e:
             logger.error("Unable to find customer", error=e)
             raise InvalidRequestError(message="Unable to find customer", param=str(e))
         if user_id:
-            previous_attributes = dict()
-            try:
-                previous_attributes = self.payload.data.previous_attributes
-            except AttributeError:
-                logger.error("no previous attributes", data=self.payload.data)
+            previous_attributes = self.event.data.get("previous_attributes")
+            if previous_attributes is None:
+                logger.error("no previous attributes", data=self.event.data)
+                previous_attributes = dict()
             logger.info("previous attributes", previous_attributes=previous_attributes)
             logger.info(
                 "previous cancel",
                 previous_cancel=previous_attributes.get("cancel_at_period_end"),
             )
-            if self.payload.data.object.cancel_at_period_end:
+            if self.object.cancel_at_period_end:
                 logger.info(
                     "cancel at period end",
-                    end=self.payload.data.object.cancel_at_period_end,
+                    end=self.object.cancel_at_period_end,
                 )
                 data = self.create_data(
                     uid=user_id,
-                    customer_id=self.payload.data.object.customer,
-                    subscriptionId=self.payload.data.object.id,  # required by FxA
-                    subscription_id=self.payload.data.object.id,
-                    plan_amount=self.payload.data.object.plan.amount,
-                    canceled_at=self.payload.data.object.canceled_at,
-                    cancel_at=self.payload.data.object.cancel_at,
-                    cancel_at_period_end=self.payload.data.object.cancel_at_period_end,
-                    nickname=self.payload.data.object.plan.nickname,
+                    customer_id=self.object.customer,
+                    subscriptionId=self.object.id,  # required by FxA
+                    subscription_id=self.object.id,
+                    plan_amount=self.object.plan["amount"],
+                    canceled_at=self.object.canceled_at,
+                    cancel_at=self.object.cancel_at,
+                    cancel_at_period_end=self.object.cancel_at_period_end,
+                    nickname=self.object.plan["nickname"],
                     messageCreatedAt=int(time.time()),  # required by FxA
-                    invoice_id=self.payload.data.object.latest_invoice,
-                    eventId=self.payload.id,  # required by FxA
+                    invoice_id=self.object.latest_invoice,
+                    eventId=self.event.id,  # required by FxA
                 )
                 logger.info("customer subscription cancel at period end", data=data)
-                routes = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
-                self.send_to_routes(routes, json.dumps(data))
+                self.send_to_routes(self.routes, data)
             elif (
-                not self.payload.data.object.cancel_at_period_end
-                and self.payload.data.object.status == "active"
+                not self.object.cancel_at_period_end
+                and self.object.status == "active"
                 and not previous_attributes.get("cancel_at_period_end")
             ):
                 data = self.create_data(
                     uid=user_id,
                     active=self.is_active_or_trialing,
-                    subscriptionId=self.payload.data.object.id,  # required by FxA
-                    subscription_id=self.payload.data.object.id,
-                    productName=self.payload.data.object.plan.nickname,
-                    nickname=self.payload.data.object.plan.nickname,
-                    eventCreatedAt=self.payload.created,  # required by FxA
+                    subscriptionId=self.object.id,  # required by FxA
+                    subscription_id=self.object.id,
+                    productName=self.object.plan["nickname"],
+                    nickname=self.object.plan["nickname"],
+                    eventCreatedAt=self.event.created,  # required by FxA
                     messageCreatedAt=int(time.time()),  # required by FxA
-                    invoice_id=self.payload.data.object.latest_invoice,
-                    customer_id=self.payload.data.object.customer,
-                    created=self.payload.data.object.plan.created,
-                    plan_amount=self.payload.data.object.plan.amount,
-                    eventId=self.payload.id,  # required by FxA
-                    canceled_at=self.payload.data.object.canceled_at,
-                    cancel_at=self.payload.data.object.cancel_at,
-                    cancel_at_period_end=self.payload.data.object.cancel_at_period_end,
+                    invoice_id=self.object.latest_invoice,
+                    customer_id=self.object.customer,
+                    created=self.object.plan["created"],
+                    plan_amount=self.object.plan["amount"],
+                    eventId=self.event.id,  # required by FxA
+                    canceled_at=self.object.canceled_at,
+                    cancel_at=self.object.cancel_at,
+                    cancel_at_period_end=self.object.cancel_at_period_end,
                 )
                 logger.info("customer subscription new recurring", data=data)
-                routes = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
-                self.send_to_routes(routes, json.dumps(data))
+                self.send_to_routes(self.routes, data)
             else:
                 logger.info(
                     "cancel_at_period_end false",
-                    data=self.payload.data.object.cancel_at_period_end,
+                    data=self.object.cancel_at_period_end,
                 )
         else:
             logger.error(
                 "customer subscription updated - no userid",
-                error=self.payload.object.customer,
-            )
-            raise ClientError(
-                f"userid is None for customer {self.payload.object.customer}"
+                error=self.object.customer,
             )
+            raise ClientError(f"userid is None for customer {self.object.customer}")
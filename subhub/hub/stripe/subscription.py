@@ -2,9 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import json
-
-from subhub.hub.stripe.abstract import AbstractStripeHubEvent
+from subhub.hub.stripe.abstract import AbstractStripeHubEvent, handles
+from subhub.hub.stripe.views import first_item
 from subhub.hub.routes.static import StaticRoutes
 
 from subhub.log import get_logger
@@ -12,18 +11,21 @@ from subhub.log import get_logger
 logger = get_logger()
 
 
+@handles("subscription.created")
 class StripeSubscriptionCreated(AbstractStripeHubEvent):
+    routes = [StaticRoutes.SALESFORCE_ROUTE]
+
     def run(self):
+        event_data = self.event.data
         data = self.create_data(
-            customer_id=self.payload.data.object.id,
-            subscription_created=self.payload.data.items.data[0].created,
-            current_period_start=self.payload.data.current_period_start,
-            current_period_end=self.payload.data.current_period_end,
-            plan_amount=self.payload.data.plan.amount,
-            plan_currency=self.payload.data.plan.currency,
-            plan_name=self.payload.data.plan.nickname,
-            created=self.payload.data.object.created,
+            customer_id=event_data["object"]["id"],
+            subscription_created=first_item(event_data["items"])["created"],
+            current_period_start=event_data["current_period_start"],
+            current_period_end=event_data["current_period_end"],
+            plan_amount=event_data["plan"]["amount"],
+            plan_currency=event_data["plan"]["currency"],
+            plan_name=event_data["plan"]["nickname"],
+            created=event_data["object"]["created"],
         )
         logger.info("subscription created", data=data)
-        routes = [StaticRoutes.SALESFORCE_ROUTE]
-        self.send_to_routes(routes, json.dumps(data))
+        self.send_to_routes(self.routes, data)
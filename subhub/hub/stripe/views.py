@@ -0,0 +1,134 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Read-only views of the decoded Stripe event dict.  Each view copies the
+fields its handlers use once, instead of wrapping the whole event and
+re-walking it on every access.  Nested values (plan, lines, charges, ...)
+are left as the plain dicts and lists of the event.
+"""
+
+from typing import Any, Optional
+
+
+class EventView:
+    """
+    The fields of a Stripe event shared by all handlers.
+    """
+
+    __slots__ = ("id", "type", "created", "data")
+
+    def __init__(self, event: dict):
+        self.id: str = event["id"]
+        self.type: str = event["type"]
+        self.created: Optional[int] = event.get("created")
+        self.data: dict = event.get("data") or {}
+
+
+class ObjectView:
+    """
+    Base of the views of an event's data.object: each field named in the
+    subclass __slots__ is read from the object, None when it is missing.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, obj: dict):
+        for field in type(self).__slots__:
+            setattr(self, field, obj.get(field))
+
+    def __repr__(self):
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in type(self).__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class CustomerView(ObjectView):
+    __slots__ = ("id", "email", "name", "metadata")
+
+    id: str
+    email: Optional[str]
+    name: Optional[str]
+    metadata: Optional[dict]
+
+
+class SourceView(ObjectView):
+    __slots__ = ("customer", "last4", "brand", "exp_month", "exp_year")
+
+    customer: str
+    last4: Optional[str]
+    brand: Optional[str]
+    exp_month: Optional[int]
+    exp_year: Optional[int]
+
+
+class SubscriptionView(ObjectView):
+    __slots__ = (
+        "id",
+        "customer",
+        "status",
+        "plan",
+        "latest_invoice",
+        "canceled_at",
+        "cancel_at",
+        "cancel_at_period_end",
+    )
+
+    id: str
+    customer: str
+    status: Optional[str]
+    plan: Optional[dict]
+    latest_invoice: Optional[str]
+    canceled_at: Optional[int]
+    cancel_at: Optional[int]
+    cancel_at_period_end: Optional[bool]
+
+
+class InvoiceView(ObjectView):
+    __slots__ = (
+        "id",
+        "customer",
+        "subscription",
+        "created",
+        "period_start",
+        "period_end",
+        "amount_due",
+        "amount_paid",
+        "application_fee_amount",
+        "currency",
+        "charge",
+        "number",
+        "lines",
+    )
+
+    id: str
+    customer: str
+    subscription: Optional[str]
+    created: Optional[int]
+    period_start: Optional[int]
+    period_end: Optional[int]
+    amount_due: Optional[int]
+    amount_paid: Optional[int]
+    application_fee_amount: Optional[int]
+    currency: Optional[str]
+    charge: Optional[str]
+    number: Optional[str]
+    lines: Optional[dict]
+
+
+class PaymentIntentView(ObjectView):
+    __slots__ = ("invoice", "customer", "created", "currency", "charges")
+
+    invoice: Optional[str]
+    customer: Optional[str]
+    created: Optional[int]
+    currency: Optional[str]
+    charges: Optional[dict]
+
+
+def first_item(stripe_list: Optional[dict]) -> Any:
+    """
+    First element of a Stripe list object such as invoice lines.
+    :raises IndexError: when the list is empty
+    """
+    return (stripe_list or {}).get("data", [])[0]
@@ -3,14 +3,20 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 from abc import ABC
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from typing import List
 
 from aws_xray_sdk.core import xray_recorder
 from aws_xray_sdk.ext.flask.middleware import XRayMiddleware
 
 from subhub.app import create_app, g
-from subhub.hub.stripe.controller import event_process
+from subhub.hub.concurrency import app_context_factory, process_by_customer
+from subhub.hub.routes.pipeline import missing_routes
+from subhub.hub.stripe.controller import event_process, required_routes
 from flask import current_app
 import stripe
 
@@ -29,62 +35,224 @@ except Exception:  # pylint: disable=broad-except
     raise
 
 
+WATERMARK_CHECKPOINT = "missing-events-watermark"
+
+
 class EventCheck(ABC):
-    def __init__(self, hours_back):
+    def __init__(self, hours_back, use_watermark=False, pipelined=False, workers=1):
         self.hours_back = hours_back
+        self.use_watermark = use_watermark
+        self.pipelined = pipelined
+        self.workers = workers
+        self.created_after = None
+        self.newest_event = None
+        self.failed_events = 0
+        self.oldest_failed_event = None
+        self.missing_routes = dict()
+        self.failed_lock = threading.Lock()
+        self.stats = dict(
+            pages=0,
+            events=0,
+            missing=0,
+            list_seconds=0.0,
+            check_seconds=0.0,
+            replay_seconds=0.0,
+        )
 
     def retrieve_events(self, last_event=str()):
-        retrieved_events = 0
+        started = time.perf_counter()
+        if self.pipelined:
+            self.retrieve_events_pipelined(last_event)
+        else:
+            self.retrieve_events_serial(last_event)
+        elapsed = time.perf_counter() - started
+        self.stats["total_seconds"] = elapsed
+        self.stats["failed"] = self.failed_events
+        self.stats["events_per_second"] = (
+            self.stats["events"] / elapsed if elapsed else 0.0
+        )
+        logger.info("number events", number_of_events=self.stats["events"])
+        logger.info("event check stats", pipelined=self.pipelined, **self.stats)
+        self.save_watermark()
+        return self.stats
+
+    def retrieve_events_serial(self, last_event):
         has_more = True
         while has_more:
-            if not last_event:
-                events = self.get_events()
-            else:
-                events = self.get_events_with_last_event(last_event)
-            logger.info("events", events=events)
-            logger.info("has more", has_more=events.has_more)
-            for e in events.data:
-                existing_event = g.hub_table.get_event(e["id"])
-                logger.info("existing event", existing_event=existing_event)
-
-                if not existing_event:
-                    logger.info("is existing event", is_event=existing_event)
+            with self.timed("list_seconds"):
+                events = self.get_page(last_event)
+            for e in self.check_page(events):
+                with self.timed("replay_seconds"):
                     self.process_missing_event(e)
-            retrieved_events += len(events.data)
 
             has_more = events.has_more
             if has_more:
                 last_event = events.data[-1]["id"]
             logger.info("last_event", last_event=last_event)
-        logger.info("number events", number_of_events=retrieved_events)
+
+    def retrieve_events_pipelined(self, last_event):
+        """
+        Fetch the next page from Stripe while the current one is checked, then
+        replay the missing events on a bounded pool keeping per customer order.
+        """
+        self.get_created_after()
+        missing_events = []
+        with ThreadPoolExecutor(max_workers=1) as fetcher:
+            next_page = fetcher.submit(self.get_page, last_event)
+            while next_page:
+                with self.timed("list_seconds"):
+                    events = next_page.result()
+                next_page = None
+                if events.has_more:
+                    last_event = events.data[-1]["id"]
+                    next_page = fetcher.submit(self.get_page, last_event)
+                    logger.info("last_event", last_event=last_event)
+                missing_events.extend(self.check_page(events))
+        with self.timed("replay_seconds"):
+            process_by_customer(
+                missing_events,
+                self.process_missing_event,
+                self.workers,
+                context=app_context_factory(),
+            )
+
+    def get_page(self, last_event):
+        if not last_event:
+            return self.get_events()
+        return self.get_events_with_last_event(last_event)
+
+    def check_page(self, events) -> List[dict]:
+        """
+        Look the events of a page up in the hub table and work out which of
+        the routes each event type is reported to have not been sent yet.
+        :return: the events with at least one missing route
+        """
+        logger.info("events", events=events)
+        logger.info("has more", has_more=events.has_more)
+        if events.data and not self.newest_event:
+            # Stripe lists newest first, so this is the run's high-water mark
+            self.newest_event = events.data[0]
+        with self.timed("check_seconds"):
+            existing_events = g.hub_table.batch_get_events(
+                [e["id"] for e in events.data]
+            )
+        logger.info("existing events", count=len(existing_events))
+        missing_events = []
+        for e in events.data:
+            sent_systems = []
+            if e["id"] in existing_events:
+                sent_systems = existing_events[e["id"]].sent_system or []
+            routes = missing_routes(required_routes(e["type"]), sent_systems)
+            if routes:
+                logger.info("missing event", event_id=e["id"], missing_routes=routes)
+                self.missing_routes[e["id"]] = routes
+                missing_events.append(e)
+        self.stats["pages"] += 1
+        self.stats["events"] += len(events.data)
+        self.stats["missing"] += len(missing_events)
+        return missing_events
+
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats[stage] += time.perf_counter() - started
 
     def get_events(self):
         return stripe.Event.list(
             limit=100,
             types=CFG.PAYMENT_EVENT_LIST,
-            created={"gt": self.get_time_h_hours_ago(self.hours_back)},
+            created={"gt": self.get_created_after()},
         )
 
     def get_events_with_last_event(self, last_event):
         return stripe.Event.list(
             limit=100,
             types=CFG.PAYMENT_EVENT_LIST,
-            created={"gt": self.get_time_h_hours_ago(self.hours_back)},
+            created={"gt": self.get_created_after()},
             starting_after=last_event,
         )
 
+    def get_created_after(self) -> int:
+        """
+        Lower bound for the events to check: the stored watermark less the
+        configured overlap when resuming, otherwise hours_back from now.
+        """
+        if self.created_after is None:
+            self.created_after = self.get_time_h_hours_ago(self.hours_back)
+            if self.use_watermark:
+                watermark = g.hub_checkpoints.get_checkpoint(WATERMARK_CHECKPOINT)
+                if watermark:
+                    self.created_after = (
+                        int(watermark.last_created) - CFG.EVENT_CHECK_OVERLAP_SECONDS
+                    )
+            logger.info(
+                "created after",
+                created_after=self.created_after,
+                use_watermark=self.use_watermark,
+            )
+        return self.created_after
+
+    def save_watermark(self):
+        """
+        Move the watermark to the newest event of the run, or to just before
+        the oldest event that failed to replay so the next run checks it
+        again.  Deliveries left in the outbox do not count as failed, the
+        outbox retries and dead-letters them.
+        """
+        if not self.newest_event:
+            return
+        last_event_id = self.newest_event["id"]
+        last_created = int(self.newest_event["created"])
+        if self.oldest_failed_event:
+            last_event_id = self.oldest_failed_event["id"]
+            last_created = int(self.oldest_failed_event["created"]) - 1
+            logger.error(
+                "watermark held before failed event",
+                failed_events=self.failed_events,
+                event_id=last_event_id,
+            )
+        saved = g.hub_checkpoints.save_checkpoint(
+            WATERMARK_CHECKPOINT, last_event_id=last_event_id, last_created=last_created
+        )
+        logger.info("watermark saved", saved=saved)
+
     @staticmethod
     def get_time_h_hours_ago(hours_back: int) -> int:
         h_hours_ago = datetime.now() - timedelta(hours=hours_back)
         return int(time.mktime(h_hours_ago.timetuple()))
 
-    @staticmethod
-    def process_missing_event(missing_event):
-        event_process(missing_event)
+    def process_missing_event(self, missing_event):
+        response = event_process(
+            missing_event, only_routes=self.missing_routes.get(missing_event.get("id"))
+        )
+        if response.status_code != 200:
+            with self.failed_lock:
+                self.failed_events += 1
+                oldest = self.oldest_failed_event
+                if oldest is None or missing_event["created"] < oldest["created"]:
+                    self.oldest_failed_event = missing_event
 
 
-def process_events(hours_back: int):
+def process_events(hours_back: int, use_watermark: bool = False):
+    """
+    Check the Stripe events of the last hours_back hours against the hub table
+    and replay the missing ones.  With use_watermark the run instead resumes
+    from the last fully verified event, falling back to hours_back when no
+    watermark has been stored yet.
+    :return: throughput and per stage timings of the run
+    """
     with app.app.app_context():
         g.hub_table = current_app.hub_table
-        event_check = EventCheck(hours_back)
-        event_check.retrieve_events("")
+        g.hub_checkpoints = current_app.hub_checkpoints
+        g.hub_outbox = current_app.hub_outbox
+        g.subhub_account = current_app.subhub_account
+        event_check = EventCheck(
+            hours_back,
+            use_watermark=use_watermark,
+            pipelined=CFG.EVENT_CHECK_PIPELINED,
+            workers=CFG.EVENT_CHECK_WORKERS,
+        )
+        return event_check.retrieve_events("")
@@ -0,0 +1,192 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Hub worker: processes the webhook events that the /hub endpoint enqueued
+when HUB_ASYNC_ENABLED is set.
+"""
+
+import json
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from flask import g
+
+from subhub.cfg import CFG
+from subhub.hub import coalesce, outbox
+from subhub.hub.queue import EventQueue, QueueMessage, get_event_queue
+from subhub.hub.stripe.controller import process_event
+from subhub.log import get_logger
+
+logger = get_logger()
+
+
+@contextmanager
+def app_context(app):
+    """
+    Application context with the tables set on g as before_request does.
+    :param app: flask app
+    """
+    with app.app_context():
+        g.subhub_account = app.subhub_account
+        g.hub_table = app.hub_table
+        g.hub_checkpoints = app.hub_checkpoints
+        g.hub_outbox = app.hub_outbox
+        g.subhub_deleted_users = app.subhub_deleted_users
+        yield
+
+
+def decode_body(body: str) -> Optional[dict]:
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        logger.error("queued event failed", error=e)
+        return None
+
+
+def process_queued_event(event: Optional[dict]) -> bool:
+    """
+    Run a queued Stripe event through the pipeline.
+    :param event: decoded Stripe event, None when the body was not valid json
+    :return: True when the event was processed and all its due routes sent
+    """
+    if event is None:
+        return False
+    try:
+        logger.info("process queued event", event_id=event.get("id"))
+        undelivered = process_event(event)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("queued event failed", error=e)
+        return False
+    if undelivered:
+        # left on the queue, so SQS redelivers it for the missing routes
+        logger.error(
+            "queued event not delivered", event_id=event.get("id"), routes=undelivered
+        )
+        return False
+    return True
+
+
+def process_body(body: str) -> bool:
+    """
+    Run a queued Stripe event through the pipeline.
+    :param body: Stripe event json
+    :return: True when the event was processed
+    """
+    return process_queued_event(decode_body(body))
+
+
+def process_batch(
+    bodies: List[str], may_start: Optional[Callable[[int], bool]] = None
+) -> List[bool]:
+    """
+    Process the events of a batch in the order they were received.  With
+    HUB_COALESCE_SECONDS set, customer updates superseded by a later update
+    of the batch are not delivered, and count as processed once all the
+    routes of that update were sent.
+    :param bodies: Stripe event json per message
+    :param may_start: called with the index of an event before it is
+    processed, the event is left unprocessed when it returns False
+    :return: per event, whether it was processed
+    """
+    events = [decode_body(body) for body in bodies]
+    superseded = dict()
+    if CFG.HUB_COALESCE_SECONDS > 0:
+        superseded = coalesce.superseded_events(events, CFG.HUB_COALESCE_SECONDS)
+    processed = [False] * len(events)
+    for i, event in enumerate(events):
+        if i in superseded or (may_start and not may_start(i)):
+            continue
+        processed[i] = process_queued_event(event)
+    for i, delivered in superseded.items():
+        if processed[delivered] and coalesce.routes_sent(events[delivered]):
+            coalesce.record_superseded(events[i], events[delivered])
+            processed[i] = True
+    return processed
+
+
+def process_messages(messages: List[QueueMessage]) -> List[QueueMessage]:
+    """
+    Process a batch of messages in the order they were received.
+    :return: the messages that were processed
+    """
+    processed = process_batch([m.body for m in messages])
+    return [m for m, ok in zip(messages, processed) if ok]
+
+
+def batch_item_failures(
+    records: List[dict], remaining_millis: Optional[Callable[[], int]] = None
+) -> List[dict]:
+    """
+    Process the SQS records of a Lambda invocation in order.  Records are not
+    started once less than twice HUB_ROUTE_TIMEOUT_SECONDS of the invocation
+    remain, so they are redelivered instead of timing out with the Lambda.
+    :param records: SQS event records
+    :param remaining_millis: context.get_remaining_time_in_millis of the invocation
+    :return: batchItemFailures entries for the records that failed or were skipped
+    """
+    reserve_millis = 2 * CFG.HUB_ROUTE_TIMEOUT_SECONDS * 1000
+
+    def may_start(i: int) -> bool:
+        if remaining_millis and remaining_millis() < reserve_millis:
+            logger.info("hub worker out of time", message_id=records[i]["messageId"])
+            return False
+        return True
+
+    processed = process_batch([r["body"] for r in records], may_start)
+    return [
+        dict(itemIdentifier=r["messageId"])
+        for r, ok in zip(records, processed)
+        if not ok
+    ]
+
+
+def drain(
+    queue: Optional[EventQueue] = None,
+    batch_size: Optional[int] = None,
+    wait_seconds: Optional[int] = None,
+    max_batches: Optional[int] = None,
+) -> dict:
+    """
+    Receive and process batches until the queue is empty or max_batches have
+    been processed.  Failed messages are left on the queue and are received
+    again once their visibility timeout expires.
+    :return: batch and message counts
+    """
+    queue = queue or get_event_queue()
+    batch_size = batch_size or CFG.HUB_QUEUE_BATCH_SIZE
+    wait_seconds = CFG.HUB_QUEUE_WAIT_SECONDS if wait_seconds is None else wait_seconds
+    stats = dict(batches=0, received=0, processed=0, failed=0)
+    while max_batches is None or stats["batches"] < max_batches:
+        messages = queue.receive(batch_size, wait_seconds=wait_seconds)
+        if not messages:
+            break
+        processed = process_messages(messages)
+        queue.delete(processed)
+        stats["batches"] += 1
+        stats["received"] += len(messages)
+        stats["processed"] += len(processed)
+        stats["failed"] += len(messages) - len(processed)
+    logger.info("hub queue drained", **stats)
+    return stats
+
+
+def start_local_worker(app) -> threading.Thread:
+    """
+    Drain the in-process queue, and the outbox with HUB_OUTBOX_ENABLED, on a
+    daemon thread, for running the app locally with HUB_ASYNC_ENABLED.
+    :param app: flask app
+    """
+
+    def run():
+        while True:
+            with app_context(app):
+                drain(wait_seconds=max(1, CFG.HUB_QUEUE_WAIT_SECONDS))
+                if CFG.HUB_OUTBOX_ENABLED:
+                    outbox.drain()
+
+    worker = threading.Thread(target=run, name="hub-worker", daemon=True)
+    worker.start()
+    return worker
@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+In-process counters and latency histograms.
+
+Values are kept per process (a Lambda container or a local flask app) and are
+forwarded to New Relic as custom metrics when the agent is available.
+
+Calling syntax:
+    METRICS.incr("hub.event.received", event_type="customer.created")
+    with METRICS.timer("hub.event.duration", event_type="customer.created"):
+        pass
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+try:
+    import newrelic.agent as newrelic_agent
+except ImportError:  # pragma: no cover
+    newrelic_agent = None
+
+# upper bounds, in seconds, of the latency histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def snapshot(self) -> dict:
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            min=self.min,
+            max=self.max,
+            mean=self.sum / self.count if self.count else None,
+            buckets=dict(zip(bounds, self.counts)),
+        )
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple, int] = {}
+        self._histograms: Dict[Tuple, Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple:
+        return (name,) + tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _name(key: Tuple) -> str:
+        name, labels = key[0], key[1:]
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+    def incr(self, name: str, value: int = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._record(key, value)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+        self._record(key, value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def counter(self, name: str, **labels) -> int:
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> dict:
+        with self._lock:
+            histogram = self._histograms.get(self._key(name, labels))
+            return histogram.snapshot() if histogram else Histogram().snapshot()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(
+                counters={self._name(k): v for k, v in self._counters.items()},
+                histograms={
+                    self._name(k): h.snapshot() for k, h in self._histograms.items()
+                },
+            )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _record(self, key: Tuple, value) -> None:
+        if newrelic_agent is None:
+            return
+        name = "Custom/" + "/".join([key[0]] + [str(v) for _, v in key[1:]])
+        newrelic_agent.record_custom_metric(name, value)
+
+
+METRICS = Metrics()
@@ -0,0 +1,261 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Catalog of the Stripe plans offered to users, served from memory.  Once the
+plans are older than PLAN_CATALOG_TTL seconds, or a plan.* or product.*
+event reached the hub, they are refreshed on a background thread while the
+previous plans keep being served.  In Lambda, where a container and its
+threads are frozen between invocations, the refresh instead runs inline in
+the invocation that finds the plans expired.
+
+Every catalog listed from Stripe is also stored in the hub state table,
+under a name derived from the Stripe account, with the hash of its content.
+A new process starts from the stored catalog, and a refresh takes a stored
+catalog listed by another process within PLAN_CATALOG_TTL instead of listing
+again.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, List, Optional
+
+from stripe import Plan
+
+from subhub.cfg import CFG
+from subhub.db import HubPlanCatalog
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+
+def load_plans() -> List[dict]:
+    """
+    All the Stripe plans with their product names, listed page after page
+    with the products expanded.
+    """
+    plans = Plan.list(limit=100, expand=["data.product"])
+    catalog = []
+    for plan in plans.auto_paging_iter():
+        product = plan["product"]
+        catalog.append(
+            {
+                "plan_id": plan["id"],
+                "product_id": product["id"],
+                "interval": plan["interval"],
+                "amount": plan["amount"],
+                "currency": plan["currency"],
+                "plan_name": plan["nickname"],
+                "product_name": product.get("name"),
+            }
+        )
+    logger.info("number of plans", count=len(catalog))
+    return catalog
+
+
+def catalog_name(api_key: str) -> str:
+    """
+    Name the catalog of the Stripe account, and mode, of an api key is
+    stored under, without storing the key.
+    """
+    account = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return f"plan-catalog-{account}"
+
+
+def content_hash(plans_json: str) -> str:
+    return hashlib.sha256(plans_json.encode("utf-8")).hexdigest()
+
+
+class PlanCatalog:
+    def __init__(
+        self,
+        ttl: int,
+        load: Callable[[], List[dict]] = load_plans,
+        store: Optional[HubPlanCatalog] = None,
+        name: str = "",
+        inline: bool = False,
+    ):
+        self.ttl = ttl
+        self.load = load
+        self.store = store
+        self.name = name
+        # refresh in the calling thread rather than in the background
+        self.inline = inline
+        self.content_hash: Optional[str] = None
+        self._plans: Optional[List[dict]] = None
+        # time the served plans were listed from Stripe
+        self._loaded_at = 0.0
+        # plans listed before this time are stale
+        self._invalidated_at = 0.0
+        # held by the one load running, the others wait for it or skip
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    def plans(self) -> List[dict]:
+        """
+        The plans, loaded on the first call and refreshed once they expired.
+        """
+        if self._plans is None:
+            return self._load_first()
+        if self._expired():
+            # refreshed inline, the new plans are served right away
+            self._start_refresh()
+        return self._plans
+
+    def warm(self) -> None:
+        """
+        Serve the stored catalog, however old, and refresh it once expired.
+        """
+        with self._load_lock:
+            if self._plans is None:
+                self._take_stored(fresh_only=False)
+        if self._plans is not None and self._expired():
+            self._start_refresh()
+
+    def invalidate(self) -> None:
+        """
+        Mark the plans as stale and start refreshing them.
+        """
+        with self._lock:
+            self._invalidated_at = time.time()
+        METRICS.incr("plans.invalidated")
+        # stored, the new plans reach the other processes at their refresh
+        if self._plans is not None or self.store is not None:
+            self._start_refresh()
+
+    def refresh(self) -> None:
+        """
+        Load the plans now, unless a load is already running.
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return
+        try:
+            self._load()
+        finally:
+            self._load_lock.release()
+
+    def _load_first(self) -> List[dict]:
+        with self._load_lock:
+            if self._plans is None:
+                self._load()
+            return self._plans
+
+    def _load(self) -> None:
+        if self._take_stored(fresh_only=True):
+            return
+        loaded_at = time.time()
+        plans = self.load()
+        METRICS.observe("plans.load.duration", time.time() - loaded_at)
+        plans_json = json.dumps(plans, sort_keys=True)
+        version = content_hash(plans_json)
+        self._swap(plans, version, loaded_at)
+        if self.store is not None:
+            try:
+                self.store.save_catalog(self.name, version, plans_json, loaded_at)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("plan catalog not stored", error=e)
+
+    def _take_stored(self, fresh_only: bool) -> bool:
+        """
+        Serve the stored catalog when it was listed after the served plans
+        and after the last invalidation.
+        :param fresh_only: only when it was listed within the ttl
+        :return: True when the stored catalog is served
+        """
+        if self.store is None:
+            return False
+        try:
+            stored = self.store.get_catalog(self.name)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("plan catalog not read", error=e)
+            return False
+        if stored is None:
+            return False
+        with self._lock:
+            newer = stored.loaded_at > max(self._loaded_at, self._invalidated_at)
+        if not newer or (fresh_only and self._age(stored.loaded_at) >= self.ttl):
+            return False
+        self._swap(json.loads(stored.plans), stored.content_hash, stored.loaded_at)
+        METRICS.incr("plans.stored.taken")
+        return True
+
+    def _swap(self, plans: List[dict], version: str, loaded_at: float) -> None:
+        with self._lock:
+            if loaded_at < self._loaded_at:
+                return
+            if version != self.content_hash:
+                logger.info("plan catalog version", content_hash=version)
+            self._plans = plans
+            self.content_hash = version
+            self._loaded_at = loaded_at
+
+    @staticmethod
+    def _age(loaded_at: float) -> float:
+        return time.time() - loaded_at
+
+    def _expired(self) -> bool:
+        # a load overtaken by an invalidation is served but stays expired
+        return (
+            self._age(self._loaded_at) >= self.ttl
+            or self._loaded_at <= self._invalidated_at
+        )
+
+    def _start_refresh(self) -> Optional[threading.Thread]:
+        if self.inline:
+            self._refresh_logged()
+            return None
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return None
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_logged, name="plan-catalog", daemon=True
+            )
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _refresh_logged(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("plan catalog refresh failed", error=e)
+            METRICS.incr("plans.refresh.failed")
+
+
+_catalog: Optional[PlanCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_plan_catalog() -> PlanCatalog:
+    """
+    Plan catalog of the process.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = PlanCatalog(
+                CFG.PLAN_CATALOG_TTL, inline=bool(CFG.AWS_EXECUTION_ENV)
+            )
+        return _catalog
+
+
+def configure_plan_catalog(store: HubPlanCatalog) -> PlanCatalog:
+    """
+    Back the plan catalog of the process with a store and start serving the
+    stored catalog, called by create_app.
+    """
+    global _catalog
+    catalog = PlanCatalog(
+        CFG.PLAN_CATALOG_TTL,
+        store=store,
+        name=catalog_name(CFG.STRIPE_API_KEY),
+        inline=bool(CFG.AWS_EXECUTION_ENV),
+    )
+    catalog.warm()
+    with _catalog_lock:
+        _catalog = catalog
+    return catalog
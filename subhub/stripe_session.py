@@ -0,0 +1,113 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Unit of work of one request against Stripe.  Objects retrieved by id are
+memoized for the rest of the request, the objects returned by mutations
+replace them, and every Stripe call is counted.
+
+Calling syntax:
+    session = stripe_session()
+    customer = session.retrieve(Customer, cust_id, expand=CUSTOMER_EXPAND)
+    session.mutate(Subscription.modify, sub_id, cancel_at_period_end=True)
+"""
+
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import flask
+
+from subhub.log import get_logger
+from subhub.metrics import METRICS
+
+logger = get_logger()
+
+
+class StripeSession:
+    def __init__(self):
+        self.objects: Dict[Tuple[str, str], dict] = dict()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def call(self, method: Callable, *args, **kwargs):
+        """
+        Make a Stripe call, counting it.
+        """
+        with self._lock:
+            self.calls += 1
+        return method(*args, **kwargs)
+
+    def retrieve(self, resource, object_id: str, **params):
+        """
+        Object of a Stripe resource by id, retrieved once per session.  The
+        params of the first retrieval, e.g. its expansions, apply to the
+        later ones.
+        :param resource: Stripe resource class, e.g. stripe.Customer
+        """
+        key = (resource.OBJECT_NAME, object_id)
+        found = self.objects.get(key)
+        if found is None:
+            found = self.call(resource.retrieve, object_id, **params)
+            self.objects[key] = found
+        return found
+
+    def mutate(self, method: Callable, *args, **kwargs):
+        """
+        Make a Stripe call that changes an object and remember the object it
+        returns in place of the one known to the session.
+        """
+        result = self.call(method, *args, **kwargs)
+        self.remember(result)
+        return result
+
+    def remember(self, stripe_object) -> None:
+        """
+        Replace the session's copy of an object, and of a subscription
+        embedded in the customer it belongs to.
+        """
+        if not isinstance(stripe_object, dict):
+            return
+        object_name, object_id = stripe_object.get("object"), stripe_object.get("id")
+        if not object_name or not object_id:
+            return
+        self.objects[(object_name, object_id)] = stripe_object
+        if object_name == "subscription":
+            self._embed_subscription(stripe_object)
+
+    def _embed_subscription(self, subscription: dict) -> None:
+        customer = self.objects.get(("customer", subscription.get("customer")))
+        subscriptions = (customer or {}).get("subscriptions")
+        # an empty stripe list is falsy
+        if subscriptions is None:
+            return
+        data = subscriptions["data"]
+        for i, embedded in enumerate(data):
+            if embedded["id"] == subscription["id"]:
+                data[i] = subscription
+                return
+        # Stripe lists the newest subscription first
+        data.insert(0, subscription)
+
+
+def stripe_session() -> StripeSession:
+    """
+    Session of the current request, or a new one outside of a request.
+    """
+    if flask.has_request_context():
+        session = flask.g.get("stripe_session")
+        if isinstance(session, StripeSession):
+            return session
+    return StripeSession()
+
+
+def record_stripe_calls(endpoint: Optional[str]) -> None:
+    """
+    Count the Stripe calls of the current request.
+    """
+    session = flask.g.get("stripe_session")
+    if not isinstance(session, StripeSession):
+        return
+    logger.debug("stripe calls", endpoint=endpoint, calls=session.calls)
+    METRICS.incr("stripe.calls", session.calls, endpoint=endpoint)
+    METRICS.incr("stripe.requests", endpoint=endpoint)
@@ -2,19 +2,26 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
 
-import cachetools
-from stripe import Charge, Customer, Invoice, Plan, Product, Subscription
+from stripe import Charge, Customer, Invoice, Subscription
 from flask import g
 
+from subhub.cfg import CFG
 from subhub.sub.types import JsonDict, FlaskResponse, FlaskListResponse
 from subhub.customer import existing_or_new_customer, has_existing_plan, fetch_customer
-from subhub.exceptions import ClientError
+from subhub.exceptions import ClientError, ServerError
 from subhub.log import get_logger
+from subhub.metrics import METRICS
+from subhub.plan_catalog import get_plan_catalog
+from subhub.stripe_session import stripe_session
 
 logger = get_logger()
 
+# failure details of incomplete subscriptions come back with the listing
+SUBSCRIPTIONS_EXPAND = ["data.latest_invoice.charge"]
+
 
 def subscribe_to_plan(uid, data) -> FlaskResponse:
     """
@@ -35,69 +42,24 @@ def subscribe_to_plan(uid, data) -> FlaskResponse:
     if existing_plan:
         return {"message": "User already subscribed."}, 409
     if not customer.get("deleted"):
-        Subscription.create(customer=customer.id, items=[{"plan": data["plan_id"]}])
-        updated_customer = fetch_customer(g.subhub_account, user_id=uid)
-        newest_subscription = find_newest_subscription(
-            updated_customer["subscriptions"]
+        subscription = stripe_session().mutate(
+            Subscription.create,
+            customer=customer.id,
+            items=[{"plan": data["plan_id"]}],
+            expand=["latest_invoice.charge"],
         )
-        return create_return_data(newest_subscription), 201
+        check_consistency(customer.id, subscription)
+        return create_return_data({"data": [subscription]}), 201
     else:
         return dict(message=None), 400
 
 
-def find_newest_subscription(subscriptions):
-    result = None
-
-    if not subscriptions:
-        return result
-
-    for subscription in subscriptions["data"]:
-        if not subscription:
-            continue
-        if not result:
-            result = subscription
-            continue
-
-        if subscription["status"] == "active":
-            current_period_start = datetime.fromtimestamp(
-                int(subscription["current_period_start"])
-            )
-            result_current_period_start = datetime.fromtimestamp(
-                int(result["current_period_start"])
-            )
-            if result_current_period_start < current_period_start:
-                result = subscription
-
-    return {"data": [result]}
-
-
 def list_all_plans() -> FlaskListResponse:
     """
     List all available plans for a user to purchase.
     :return:
     """
-    return _get_all_plans(), 200
-
-
-@cachetools.cached(cachetools.TTLCache(10, 600))
-def _get_all_plans():
-    plans = Plan.list(limit=100)
-    logger.info("number of plans", count=len(plans))
-    stripe_plans = []
-    for plan in plans:
-        product = Product.retrieve(plan["product"])
-        stripe_plans.append(
-            {
-                "plan_id": plan["id"],
-                "product_id": plan["product"],
-                "interval": plan["interval"],
-                "amount": plan["amount"],
-                "currency": plan["currency"],
-                "plan_name": plan["nickname"],
-                "product_name": product["name"],
-            }
-        )
-    return stripe_plans
+    return get_plan_catalog().plans(), 200
 
 
 def retrieve_stripe_subscriptions(customer: Customer) -> list:
@@ -127,15 +89,40 @@ def cancel_subscription(uid, sub_id) -> FlaskResponse:
             "trialing",
             "incomplete",
         ]:
-            Subscription.modify(sub_id, cancel_at_period_end=True)
-            updated_customer = fetch_customer(g.subhub_account, uid)
-            subs = retrieve_stripe_subscriptions(updated_customer)
-            for sub in subs:
-                if sub["cancel_at_period_end"] and sub["id"] == sub_id:
-                    return {"message": "Subscription cancellation successful"}, 201
+            subscription = stripe_session().mutate(
+                Subscription.modify, sub_id, cancel_at_period_end=True
+            )
+            check_consistency(customer["id"], subscription)
+            if subscription["cancel_at_period_end"]:
+                return {"message": "Subscription cancellation successful"}, 201
     return {"message": "Subscription not available."}, 400
 
 
+def check_consistency(cust_id: str, subscription: dict) -> None:
+    """
+    With STRIPE_CONSISTENCY_CHECK, refetch the customer from Stripe and check
+    that the subscription returned by a mutation is the one it now has.
+    :param cust_id: Stripe customer id
+    :param subscription: subscription returned by the mutation
+    :raises ServerError: when they differ
+    """
+    if not CFG.STRIPE_CONSISTENCY_CHECK:
+        return
+    customer = stripe_session().call(Customer.retrieve, cust_id)
+    stored = [
+        item
+        for item in customer["subscriptions"]["data"]
+        if item["id"] == subscription["id"]
+    ]
+    expected = create_subscription_object_without_failure(subscription)
+    if not stored or create_subscription_object_without_failure(stored[0]) != expected:
+        logger.error(
+            "subscription inconsistent", cust_id=cust_id, subscription=expected
+        )
+        METRICS.incr("stripe.consistency.mismatch")
+        raise ServerError("subscription inconsistent with Stripe")
+
+
 def delete_customer(uid) -> FlaskResponse:
     """
     Delete an existing customer, cancel active subscriptions
@@ -146,7 +133,9 @@ def delete_customer(uid) -> FlaskResponse:
     subscription_user = g.subhub_account.get_user(uid)
     if not subscription_user:
         return dict(message="Customer does not exist."), 404
-    deleted_payment_customer = Customer.delete(subscription_user.cust_id)
+    deleted_payment_customer = stripe_session().mutate(
+        Customer.delete, subscription_user.cust_id
+    )
     if deleted_payment_customer:
         deleted_customer = delete_user_from_db(uid)
         user = g.subhub_account.get_user(uid)
@@ -193,7 +182,9 @@ def reactivate_subscription(uid, sub_id):
     for subscription in active_subscriptions:
         if subscription["id"] == sub_id:
             if subscription["cancel_at_period_end"]:
-                Subscription.modify(sub_id, cancel_at_period_end=False)
+                stripe_session().mutate(
+                    Subscription.modify, sub_id, cancel_at_period_end=False
+                )
                 return {"message": "Subscription reactivation was successful."}, 200
             return {"message": "Subscription is already active."}, 200
     return {"message": "Current subscription not found."}, 404
@@ -212,7 +203,13 @@ def subscription_status(uid) -> FlaskResponse:
     items = g.subhub_account.get_user(uid)
     if not items or not items.cust_id:
         return {"message": "Customer does not exist."}, 404
-    subscriptions = Subscription.list(customer=items.cust_id, limit=100, status="all")
+    subscriptions = stripe_session().call(
+        Subscription.list,
+        customer=items.cust_id,
+        limit=100,
+        status="all",
+        expand=SUBSCRIPTIONS_EXPAND,
+    )
     if not subscriptions:
         return {"message": "No subscriptions for this customer."}, 403
     return_data = create_return_data(subscriptions)
@@ -226,38 +223,73 @@ def create_return_data(subscriptions) -> JsonDict:
     :return: JSON data to be consumed by client.
     """
     return_data = dict()
-    return_data["subscriptions"] = []
-    for subscription in subscriptions["data"]:
-        if subscription["status"] == "incomplete":
-            invoice = Invoice.retrieve(subscription["latest_invoice"])
-            if invoice["charge"]:
-                intents = Charge.retrieve(invoice["charge"])
-                logger.debug("intents", intents=intents)
-                return_data["subscriptions"].append(
-                    {
-                        "current_period_end": subscription["current_period_end"],
-                        "current_period_start": subscription["current_period_start"],
-                        "ended_at": subscription["ended_at"],
-                        "plan_name": subscription["plan"]["nickname"],
-                        "plan_id": subscription["plan"]["id"],
-                        "status": subscription["status"],
-                        "subscription_id": subscription["id"],
-                        "cancel_at_period_end": subscription["cancel_at_period_end"],
-                        "failure_code": intents["failure_code"],
-                        "failure_message": intents["failure_message"],
-                    }
-                )
-            else:
-                return_data["subscriptions"].append(
-                    create_subscription_object_without_failure(subscription)
-                )
-        else:
-            return_data["subscriptions"].append(
-                create_subscription_object_without_failure(subscription)
-            )
+    return_data["subscriptions"] = [
+        create_subscription_object(subscription, charge)
+        for subscription, charge in with_failed_charges(subscriptions["data"])
+    ]
     return return_data
 
 
+def fetch_concurrently(fetch: Callable[[str], dict], ids: Iterable[str]) -> Dict:
+    """
+    Run fetch(id) once for every distinct id, on at most STRIPE_FETCH_WORKERS
+    threads.
+    :return: dict of id to the fetched object
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    if len(unique_ids) < 2:
+        return {id_: fetch(id_) for id_ in unique_ids}
+    workers = max(1, min(CFG.STRIPE_FETCH_WORKERS, len(unique_ids)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(unique_ids, pool.map(fetch, unique_ids)))
+
+
+def _expanded(value, fetched: Dict):
+    return value if isinstance(value, dict) else fetched[value]
+
+
+def with_failed_charges(subscriptions: List[dict]) -> List[tuple]:
+    """
+    Pair each subscription with the charge of its latest invoice when it is
+    incomplete and that invoice was charged.  Invoices and charges that were
+    not expanded by the Stripe call returning the subscriptions are fetched
+    concurrently.
+    :param subscriptions:
+    :return: list of (subscription, charge or None)
+    """
+    session = stripe_session()
+    invoices = []
+    for subscription in subscriptions:
+        incomplete = subscription["status"] == "incomplete"
+        invoices.append(subscription["latest_invoice"] if incomplete else None)
+    fetched_invoices = fetch_concurrently(
+        lambda invoice_id: session.retrieve(Invoice, invoice_id, expand=["charge"]),
+        (invoice for invoice in invoices if invoice and not isinstance(invoice, dict)),
+    )
+    charges = [
+        _expanded(invoice, fetched_invoices)["charge"] if invoice else None
+        for invoice in invoices
+    ]
+    fetched_charges = fetch_concurrently(
+        lambda charge_id: session.retrieve(Charge, charge_id),
+        (charge for charge in charges if charge and not isinstance(charge, dict)),
+    )
+    return [
+        (subscription, _expanded(charge, fetched_charges) if charge else None)
+        for subscription, charge in zip(subscriptions, charges)
+    ]
+
+
+def create_subscription_object(
+    subscription: dict, charge: Optional[dict] = None
+) -> JsonDict:
+    subscription_object = create_subscription_object_without_failure(subscription)
+    if charge:
+        subscription_object["failure_code"] = charge["failure_code"]
+        subscription_object["failure_message"] = charge["failure_message"]
+    return subscription_object
+
+
 def create_subscription_object_without_failure(subscription: object) -> object:
     return {
         "current_period_end": subscription["current_period_end"],
@@ -283,7 +315,7 @@ def update_payment_method(uid, data) -> FlaskResponse:
         return {"message": "Customer does not exist."}, 404
 
     if customer["metadata"]["userid"] == uid:
-        customer.modify(customer.id, source=data["pmt_token"])
+        stripe_session().mutate(Customer.modify, customer.id, source=data["pmt_token"])
         return {"message": "Payment method updated successfully."}, 201
     else:
         return {"message": "Customer mismatch."}, 400
@@ -331,36 +363,11 @@ def create_update_data(customer) -> dict:
         return_data["exp_month"] = ""
         return_data["exp_year"] = ""
 
-    for subscription in customer["subscriptions"]["data"]:
-        if subscription["status"] == "incomplete":
-            invoice = Invoice.retrieve(subscription["latest_invoice"])
-            if invoice["charge"]:
-                intents = Charge.retrieve(invoice["charge"])
-                return_data["subscriptions"].append(
-                    {
-                        "current_period_end": subscription["current_period_end"],
-                        "current_period_start": subscription["current_period_start"],
-                        "ended_at": subscription["ended_at"],
-                        "plan_name": subscription["plan"]["nickname"],
-                        "plan_id": subscription["plan"]["id"],
-                        "status": subscription["status"],
-                        "cancel_at_period_end": subscription["cancel_at_period_end"],
-                        "subscription_id": subscription["id"],
-                        "failure_code": intents["failure_code"],
-                        "failure_message": intents["failure_message"],
-                    }
-                )
-            else:
-                return_data["cancel_at_period_end"] = subscription[
-                    "cancel_at_period_end"
-                ]
-                return_data["subscriptions"].append(
-                    create_subscription_object_without_failure(subscription)
-                )
-        else:
+    for subscription, charge in with_failed_charges(customer["subscriptions"]["data"]):
+        if not charge:
             return_data["cancel_at_period_end"] = subscription["cancel_at_period_end"]
-            return_data["subscriptions"].append(
-                create_subscription_object_without_failure(subscription)
-            )
+        return_data["subscriptions"].append(
+            create_subscription_object(subscription, charge)
+        )
 
     return return_data
@@ -75,6 +75,8 @@ def app():
     with app.app.app_context():
         g.subhub_account = app.app.subhub_account
         g.hub_table = app.app.hub_table
+        g.hub_checkpoints = app.app.hub_checkpoints
+        g.hub_outbox = app.app.hub_outbox
         g.subhub_deleted_users = app.app.subhub_deleted_users
         yield app
 
@@ -0,0 +1,100 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""
+Micro-benchmark of reading the handler fields of the Stripe hub events, with
+the former AttrDict wrapping of the whole event against the handler views.
+
+    python -m subhub.tests.performance.hub_events_bench [iterations]
+
+For each event fixture it reports the CPU time per event and the peak memory
+allocated while reading one event.
+"""
+
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from attrdict import AttrDict
+
+# importing the controller registers the event handlers
+import subhub.hub.stripe.controller  # noqa: F401
+from subhub.hub.stripe.abstract import EVENT_HANDLERS
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "unit", "stripe"
+)
+FIXTURES = [
+    "customer/customer-created.json",
+    "customer/customer-updated.json",
+    "customer/customer-source-expiring.json",
+    "customer/customer-subscription-created.json",
+    "customer/customer-subscription-updated.json",
+    "invoice/invoice-finalized.json",
+    "invoice/invoice-payment-failed.json",
+    "payment/payment-intent-succeeded.json",
+]
+
+
+def read_attrdict(event: dict, fields: Tuple[str, ...]) -> None:
+    # handlers walked self.payload.data.object again for every field
+    payload = AttrDict(event)
+    payload.id, payload.type
+    for field in fields:
+        getattr(payload.data.object, field, None)
+
+
+def read_view(event: dict, fields: Tuple[str, ...]) -> None:
+    handler = EVENT_HANDLERS[event["type"]](event)
+    handler.event.id, handler.event.type
+    for field in fields:
+        getattr(handler.object, field)
+
+
+def peak_bytes(read: Callable, event: dict, fields: Tuple[str, ...]) -> int:
+    tracemalloc.start()
+    try:
+        read(event, fields)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(iterations: int = 10000) -> List[dict]:
+    """
+    :return: per fixture, the microseconds per event and the peak bytes of
+    both ways of reading it
+    """
+    results = []
+    for fixture in FIXTURES:
+        with open(os.path.join(FIXTURES_DIR, fixture)) as f:
+            event = json.load(f)
+        fields = EVENT_HANDLERS[event["type"]].object_view.__slots__
+        result = dict(event_type=event["type"])
+        for name, read in (("attrdict", read_attrdict), ("view", read_view)):
+            seconds = timeit.timeit(lambda: read(event, fields), number=iterations)
+            result[f"{name}_us"] = seconds / iterations * 1e6
+            result[f"{name}_peak"] = peak_bytes(read, event, fields)
+        results.append(result)
+    return results
+
+
+def main(iterations: int) -> None:
+    print(
+        f"{'event type':<40}{'attrdict us':>12}{'view us':>10}{'speedup':>9}"
+        f"{'attrdict B':>12}{'view B':>9}"
+    )
+    for r in benchmark(iterations):
+        print(
+            f"{r['event_type']:<40}{r['attrdict_us']:>12.1f}{r['view_us']:>10.1f}"
+            f"{r['attrdict_us'] / r['view_us']:>8.1f}x"
+            f"{r['attrdict_peak']:>12}{r['view_peak']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -4,9 +4,18 @@
 
 import uuid
 import json
-from subhub.sub.payments import subscribe_to_plan, customer_update, create_update_data
+
+import pytest
+
+from subhub.exceptions import ServerError
+from subhub.sub.payments import (
+    subscribe_to_plan,
+    customer_update,
+    create_update_data,
+    create_return_data,
+)
 from subhub.tests.unit.stripe.utils import MockSubhubAccount
-from unittest.mock import Mock, MagicMock, PropertyMock
+from unittest.mock import Mock, MagicMock
 import os
 
 from subhub.log import get_logger
@@ -40,51 +49,63 @@ def get_file(filename, path=THIS_PATH, **overrides):
         return dict(obj, **overrides)
 
 
-def test_subscribe_to_plan_returns_newest(monkeypatch):
-    subhub_account = MagicMock()
-
-    get_user = MagicMock()
-    user_id = PropertyMock(return_value=UID)
-    cust_id = PropertyMock(return_value="cust123")
-    type(get_user).user_id = user_id
-    type(get_user).cust_id = cust_id
+SUBSCRIBE_DATA = {
+    "pmt_token": "tok_visa",
+    "plan_id": "plan_EtMcOlFMNWW4nd",
+    "origin_system": "Test_system",
+    "email": "subtest@tester.com",
+    "display_name": "John Tester",
+}
 
-    subhub_account.get_user = get_user
 
+def subscribe_with_created(monkeypatch, created, stored_subscriptions):
     customer = Mock(return_value=MockCustomer())
     none = Mock(return_value=None)
     updated_customer = Mock(
-        return_value={
-            "subscriptions": {
-                "data": [
-                    get_file("subscription1.json"),
-                    get_file("subscription2.json"),
-                    get_file("subscription3.json"),
-                ]
-            }
-        }
+        return_value={"subscriptions": {"data": stored_subscriptions}}
     )
 
-    monkeypatch.setattr("flask.g.subhub_account", subhub_account)
+    monkeypatch.setattr("flask.g.subhub_account", MagicMock())
     monkeypatch.setattr("subhub.sub.payments.existing_or_new_customer", customer)
     monkeypatch.setattr("subhub.sub.payments.has_existing_plan", none)
-    monkeypatch.setattr("stripe.Subscription.create", Mock)
+    monkeypatch.setattr("stripe.Subscription.create", Mock(return_value=created))
     monkeypatch.setattr("stripe.Customer.retrieve", updated_customer)
 
-    data = json.dumps(
-        {
-            "pmt_token": "tok_visa",
-            "plan_id": "plan_EtMcOlFMNWW4nd",
-            "origin_system": "Test_system",
-            "email": "subtest@tester.com",
-            "display_name": "John Tester",
-        }
+    return subscribe_to_plan(UID, SUBSCRIBE_DATA), updated_customer
+
+
+def test_subscribe_to_plan_returns_created(monkeypatch):
+    created = get_file("subscription2.json")
+
+    (test_customer, code), updated_customer = subscribe_with_created(
+        monkeypatch, created, [get_file("subscription1.json", id="sub_older"), created]
     )
 
-    test_customer = subscribe_to_plan(UID, json.loads(data))
+    assert code == 201
+    assert test_customer["subscriptions"][0]["subscription_id"] == created["id"]
+    assert test_customer["subscriptions"][0]["current_period_start"] == 1_516_228_999
+    updated_customer.assert_not_called()
 
-    assert test_customer[0]["subscriptions"][0]["current_period_start"] == 1_516_229_999
-    updated_customer.assert_called()
+
+def test_subscribe_to_plan_consistency_check(monkeypatch):
+    monkeypatch.setenv("STRIPE_CONSISTENCY_CHECK", "True")
+    created = get_file("subscription2.json")
+
+    (test_customer, code), updated_customer = subscribe_with_created(
+        monkeypatch, created, [get_file("subscription1.json", id="sub_older"), created]
+    )
+
+    assert code == 201
+    updated_customer.assert_called_once()
+
+
+def test_subscribe_to_plan_consistency_check_mismatch(monkeypatch):
+    monkeypatch.setenv("STRIPE_CONSISTENCY_CHECK", "True")
+    created = get_file("subscription2.json")
+    stored = get_file("subscription2.json", cancel_at_period_end=True)
+
+    with pytest.raises(ServerError):
+        subscribe_with_created(monkeypatch, created, [stored])
 
 
 def test_customer_update_subscription_active(monkeypatch):
@@ -198,3 +219,59 @@ def customer_update_subscription_incomplete(monkeypatch, charge):
     updated_customer.assert_called()
     invoice_retrieve.assert_called()
     assert result[0]["subscriptions"][0]["cancel_at_period_end"] == True
+
+
+def test_create_update_data_expanded_failure(monkeypatch):
+    invoice_retrieve = Mock()
+    charge_retrieve = Mock()
+    monkeypatch.setattr("stripe.Invoice.retrieve", invoice_retrieve)
+    monkeypatch.setattr("stripe.Charge.retrieve", charge_retrieve)
+    charge = {"failure_code": "card_declined", "failure_message": "declined"}
+    subscription = get_file(
+        "subscription_incomplete.json", latest_invoice={"charge": charge}
+    )
+
+    result = create_update_data(
+        {"sources": {"data": []}, "subscriptions": {"data": [subscription]}}
+    )
+
+    invoice_retrieve.assert_not_called()
+    charge_retrieve.assert_not_called()
+    assert result["subscriptions"][0]["failure_code"] == "card_declined"
+    assert result["subscriptions"][0]["failure_message"] == "declined"
+    assert "cancel_at_period_end" not in result
+
+
+def test_create_return_data_fetches_each_lookup_once(monkeypatch):
+    invoice_retrieve = Mock(side_effect=lambda id, **kwargs: {"charge": f"ch_{id}"})
+    charge_retrieve = Mock(
+        side_effect=lambda id: {"failure_code": id, "failure_message": "declined"}
+    )
+    monkeypatch.setattr("stripe.Invoice.retrieve", invoice_retrieve)
+    monkeypatch.setattr("stripe.Charge.retrieve", charge_retrieve)
+    subscriptions = [
+        get_file("subscription_incomplete.json", id="sub_1", latest_invoice="in_1"),
+        get_file("subscription_incomplete.json", id="sub_2", latest_invoice="in_2"),
+        get_file("subscription_incomplete.json", id="sub_3", latest_invoice="in_2"),
+        get_file("subscription_active.json", id="sub_4"),
+    ]
+
+    result = create_return_data({"data": subscriptions})
+
+    assert sorted(c[0][0] for c in invoice_retrieve.call_args_list) == ["in_1", "in_2"]
+    assert sorted(c[0][0] for c in charge_retrieve.call_args_list) == [
+        "ch_in_1",
+        "ch_in_2",
+    ]
+    assert [s["subscription_id"] for s in result["subscriptions"]] == [
+        "sub_1",
+        "sub_2",
+        "sub_3",
+        "sub_4",
+    ]
+    assert [s.get("failure_code") for s in result["subscriptions"]] == [
+        "ch_in_1",
+        "ch_in_2",
+        "ch_in_2",
+        None,
+    ]
@@ -7,6 +7,7 @@ import requests
 import boto3
 import flask
 from subhub.cfg import CFG
+from subhub.hub.routes import basket
 
 from subhub.tests.unit.stripe.utils import run_test, MockSqsClient
 
@@ -32,7 +33,7 @@ def test_stripe_hub_succeeded(mocker):
 
     # using mockito
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
-    mockito.when(requests).post(basket_url, json=data).thenReturn(response)
+    mockito.when(basket).post(basket_url, json=data).thenReturn(response)
     mockito.when(boto3).client(
         "sqs",
         region_name=CFG.AWS_REGION,
@@ -10,7 +10,10 @@ import stripe
 import requests
 
 from mockito import when, mock, unstub
+from pynamodb.exceptions import QueryError
 
+from subhub.hub.routes import basket, firefox
+from subhub.hub.stripe.abstract import AbstractStripeHubEvent
 from subhub.tests.unit.stripe.utils import run_test, MockSqsClient, MockSnsClient
 from subhub.cfg import CFG
 from subhub.log import get_logger
@@ -18,10 +21,11 @@ from subhub.log import get_logger
 logger = get_logger()
 
 
-def run_customer(mocker, data, filename):
+def run_customer(mocker, data, filename, user=None):
     # using pytest mock
     mocker.patch.object(flask, "g")
     flask.g.return_value = ""
+    flask.g.subhub_account.get_user_by_cust_id.return_value = user
 
     run_test(filename)
 
@@ -38,7 +42,7 @@ def test_stripe_hub_customer_created(mocker):
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
     when(boto3).client("sqs", region_name=CFG.AWS_REGION).thenReturn(MockSqsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-created.json"
     run_customer(mocker, data, filename)
 
@@ -60,7 +64,7 @@ def test_stripe_hub_customer_deleted(mocker):
         aws_access_key_id=CFG.AWS_ACCESS_KEY_ID,
         aws_secret_access_key=CFG.AWS_SECRET_ACCESS_KEY,
     ).thenReturn(MockSnsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-deleted.json"
     run_customer(mocker, data, filename)
 
@@ -77,7 +81,7 @@ def test_stripe_hub_customer_updated(mocker):
     logger.info("basket url", url=basket_url)
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
     when(boto3).client("sqs", region_name=CFG.AWS_REGION).thenReturn(MockSqsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-updated.json"
     run_customer(mocker, data, filename)
 
@@ -118,7 +122,7 @@ def test_stripe_hub_customer_source_expiring(mocker):
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
     # when(boto3).client("sqs", region_name=CFG.AWS_REGION).thenReturn(MockSqsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-source-expiring.json"
     run_customer(mocker, data, filename)
 
@@ -161,8 +165,8 @@ def test_stripe_hub_customer_subscription_created(mocker):
     logger.info("created payload", data=data)
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
-    when(boto3).client("sns", region_name=CFG.AWS_REGION).thenReturn(MockSnsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(firefox).get_sns_client().thenReturn(MockSnsClient)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-subscription-created.json"
     run_customer(mocker, data, filename)
     unstub()
@@ -203,8 +207,8 @@ def test_stripe_hub_customer_subscription_updated_cancel(mocker):
 
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
-    when(boto3).client("sns", region_name=CFG.AWS_REGION).thenReturn(MockSnsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(firefox).get_sns_client().thenReturn(MockSnsClient)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-subscription-updated.json"
     run_customer(mocker, data, filename)
     unstub()
@@ -249,8 +253,8 @@ def test_stripe_hub_customer_subscription_updated_no_cancel(mocker):
 
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
-    when(boto3).client("sns", region_name=CFG.AWS_REGION).thenReturn(MockSnsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(firefox).get_sns_client().thenReturn(MockSnsClient)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-subscription-updated-no-cancel.json"
     run_customer(mocker, data, filename)
     unstub()
@@ -282,8 +286,33 @@ def test_stripe_hub_customer_subscription_deleted(mocker):
     )
     basket_url = CFG.SALESFORCE_BASKET_URI + CFG.BASKET_API_KEY
     response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
-    when(boto3).client("sns", region_name=CFG.AWS_REGION).thenReturn(MockSnsClient)
-    when(requests).post(basket_url, json=data).thenReturn(response)
+    when(firefox).get_sns_client().thenReturn(MockSnsClient)
+    when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "customer/customer-subscription-deleted.json"
     run_customer(mocker, data, filename)
     unstub()
+
+
+def test_stripe_hub_customer_subscription_created_from_user_table(mocker):
+    user = mock({"user_id": "user123", "cust_id": "cus_00000000000000"})
+    when(stripe.Customer).retrieve(id="cus_00000000000000").thenRaise(
+        AssertionError("Customer.retrieve should not be called")
+    )
+    response = mock({"status_code": 200, "text": "Ok"}, spec=requests.Response)
+    when(firefox).get_sns_client().thenReturn(MockSnsClient)
+    when(basket).post(...).thenReturn(response)
+    filename = "customer/customer-subscription-created.json"
+    run_customer(mocker, {}, filename, user=user)
+    flask.g.subhub_account.get_user_by_cust_id.assert_called_with("cus_00000000000000")
+    unstub()
+
+
+def test_get_user_id_falls_back_to_stripe_on_index_error(mocker):
+    mocker.patch.object(flask, "g")
+    flask.g.subhub_account.get_user_by_cust_id.side_effect = QueryError(
+        "index not ready"
+    )
+    customer = mock({"metadata": {"userid": "user123"}})
+    when(stripe.Customer).retrieve(id="cus_00000000000000").thenReturn(customer)
+    assert AbstractStripeHubEvent.get_user_id("cus_00000000000000") == "user123"
+    unstub()
@@ -17,6 +17,12 @@ from mockito import when, mock, unstub
 
 from subhub.tests.unit.stripe.utils import run_view, run_event_process
 from subhub.cfg import CFG
+from subhub.hub.routes import pipeline
+from subhub.hub.routes.firefox import FirefoxRoute
+from subhub.hub.routes.pipeline import RouteOutcome, RoutesPipeline, missing_routes
+from subhub.hub.routes.salesforce import SalesforceRoute
+from subhub.hub.routes.static import StaticRoutes
+from subhub.hub.stripe.controller import StripeHubEventPipeline, event_process
 from subhub.hub.verifications.events_check import EventCheck, process_events
 from subhub.log import get_logger
 
@@ -94,3 +100,225 @@ def test_process_events():
         ).thenReturn(event_response)
         process_events(6)
     unstub()
+
+
+def test_watermark_resume():
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+    event_check = EventCheck(6, use_watermark=True)
+    assert (
+        abs(event_check.get_created_after() - EventCheck.get_time_h_hours_ago(6)) <= 1
+    )
+
+    flask.g.hub_checkpoints.save_checkpoint(
+        "missing-events-watermark", last_event_id="evt_001", last_created=1564069669
+    )
+    event_check = EventCheck(6, use_watermark=True)
+    assert (
+        event_check.get_created_after() == 1564069669 - CFG.EVENT_CHECK_OVERLAP_SECONDS
+    )
+    assert (
+        abs(EventCheck(6).get_created_after() - EventCheck.get_time_h_hours_ago(6)) <= 1
+    )
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+
+
+def test_watermark_saved_after_verified_run():
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+    with open(os.path.join(__location__, "event.json")) as f:
+        event_response = mock(json.load(f))
+    for e in event_response.data:
+        flask.g.hub_table.append_event(e["id"], "firefox")
+        flask.g.hub_table.append_event(e["id"], "salesforce")
+    created_after = 1564069669 - CFG.EVENT_CHECK_OVERLAP_SECONDS
+    flask.g.hub_checkpoints.save_checkpoint(
+        "missing-events-watermark", last_event_id="evt_old", last_created=1564069669
+    )
+    when(stripe.Event).list(
+        limit=100, types=CFG.PAYMENT_EVENT_LIST, created={"gt": created_after}
+    ).thenReturn(event_response)
+
+    event_check = EventCheck(6, use_watermark=True)
+    event_check.retrieve_events("")
+    watermark = flask.g.hub_checkpoints.get_checkpoint("missing-events-watermark")
+    assert watermark.last_event_id == "evt_000"
+    assert watermark.last_created == 1564069669
+
+    assert not flask.g.hub_checkpoints.save_checkpoint(
+        "missing-events-watermark", last_event_id="evt_older", last_created=1
+    )
+    for e in event_response.data:
+        flask.g.hub_table.remove_from_db(e["id"])
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+    unstub()
+
+
+def test_retrieve_events_pipelined(mocker):
+    def event(event_id, customer, created):
+        return {
+            "id": event_id,
+            "type": "invoice.finalized",
+            "created": created,
+            "data": {"object": {"object": "invoice", "customer": customer}},
+        }
+
+    first_page = mock(
+        {
+            "data": [event("evt_p3", "cus_a", 3), event("evt_p2", "cus_b", 2)],
+            "has_more": True,
+        }
+    )
+    second_page = mock({"data": [event("evt_p1", "cus_a", 1)], "has_more": False})
+    event_check = EventCheck(6, pipelined=True, workers=2)
+    when(stripe.Event).list(
+        limit=100,
+        types=CFG.PAYMENT_EVENT_LIST,
+        created={"gt": event_check.get_created_after()},
+    ).thenReturn(first_page)
+    when(stripe.Event).list(
+        limit=100,
+        types=CFG.PAYMENT_EVENT_LIST,
+        created={"gt": event_check.get_created_after()},
+        starting_after="evt_p2",
+    ).thenReturn(second_page)
+    flask.g.hub_table.append_event("evt_p2", "salesforce")
+    replayed = []
+
+    def replay(e, only_routes=None):
+        replayed.append(e["id"])
+        assert flask.g.hub_table is not None
+        return Response("", status=200)
+
+    mocker.patch(
+        "subhub.hub.verifications.events_check.event_process", side_effect=replay
+    )
+    stats = event_check.retrieve_events("")
+    assert replayed == ["evt_p1", "evt_p3"]
+    assert stats["pages"] == 2
+    assert stats["events"] == 3
+    assert stats["missing"] == 2
+    assert stats["failed"] == 0
+    for stage in ("list_seconds", "check_seconds", "replay_seconds"):
+        assert stats[stage] >= 0
+    assert event_check.newest_event["id"] == "evt_p3"
+    flask.g.hub_table.remove_from_db("evt_p2")
+    unstub()
+
+
+def test_retrieve_events_only_missing_routes(mocker):
+    with open(os.path.join(__location__, "event.json")) as f:
+        event_response = mock(json.load(f))
+    flask.g.hub_table.append_event("evt_000", "firefox")
+    flask.g.hub_table.append_event("evt_000", "salesforce")
+    flask.g.hub_table.append_event("evt_001", "firefox")
+    event_check = EventCheck(6)
+    when(stripe.Event).list(
+        limit=100,
+        types=CFG.PAYMENT_EVENT_LIST,
+        created={"gt": event_check.get_created_after()},
+    ).thenReturn(event_response)
+    replay = mocker.patch(
+        "subhub.hub.verifications.events_check.event_process",
+        return_value=Response("", status=200),
+    )
+    event_check.retrieve_events("")
+    assert replay.call_count == 1
+    args, kwargs = replay.call_args
+    assert args[0]["id"] == "evt_001"
+    assert kwargs["only_routes"] == [StaticRoutes.SALESFORCE_ROUTE]
+    for event_id in ("evt_000", "evt_001"):
+        flask.g.hub_table.remove_from_db(event_id)
+    unstub()
+
+
+def test_routes_pipeline_only_routes(mocker):
+    firefox = mocker.patch.object(FirefoxRoute, "route")
+    salesforce = mocker.patch.object(SalesforceRoute, "route")
+    routes = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
+    RoutesPipeline(routes, "{}", only_routes=[StaticRoutes.FIREFOX_ROUTE]).run()
+    assert firefox.call_count == 1
+    assert salesforce.call_count == 0
+    assert missing_routes(routes, ["salesforce"]) == [StaticRoutes.FIREFOX_ROUTE]
+
+
+def undelivered_outcomes():
+    return {
+        StaticRoutes.FIREFOX_ROUTE: RouteOutcome(
+            StaticRoutes.FIREFOX_ROUTE, pipeline.SENT, 0.0, None
+        ),
+        StaticRoutes.SALESFORCE_ROUTE: RouteOutcome(
+            StaticRoutes.SALESFORCE_ROUTE, pipeline.FAILED, 0.0, None
+        ),
+    }
+
+
+def test_event_process_fails_when_route_not_delivered(mocker):
+    with open(os.path.join(__location__, "event.json")) as f:
+        event = json.load(f)["data"][0]
+    run = mocker.patch.object(StripeHubEventPipeline, "run", return_value=None)
+    assert event_process(event).status_code == 200
+    run.return_value = undelivered_outcomes()
+    assert event_process(event).status_code == 500
+
+
+def test_watermark_held_when_route_not_delivered(mocker):
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+    with open(os.path.join(__location__, "event.json")) as f:
+        event_response = mock(json.load(f))
+    event_check = EventCheck(6, use_watermark=True)
+    when(stripe.Event).list(
+        limit=100,
+        types=CFG.PAYMENT_EVENT_LIST,
+        created={"gt": event_check.get_created_after()},
+    ).thenReturn(event_response)
+    mocker.patch.object(
+        StripeHubEventPipeline, "run", return_value=undelivered_outcomes()
+    )
+    stats = event_check.retrieve_events("")
+    assert stats["failed"] == stats["missing"] > 0
+    watermark = flask.g.hub_checkpoints.get_checkpoint("missing-events-watermark")
+    assert watermark.last_created == 1564069668
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+    unstub()
+
+
+def test_watermark_held_before_permanently_failing_event(mocker):
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
+
+    def event(event_id, created):
+        return {
+            "id": event_id,
+            "type": "invoice.finalized",
+            "created": created,
+            "data": {"object": {"object": "invoice", "customer": "cus_a"}},
+        }
+
+    def replay(e, only_routes=None):
+        return Response("", status=500 if e["id"] == "evt_failing" else 200)
+
+    mocker.patch(
+        "subhub.hub.verifications.events_check.event_process", side_effect=replay
+    )
+    pages = [
+        [event("evt_2", 1564069700), event("evt_failing", 1564069690)],
+        [
+            event("evt_3", 1564069710),
+            event("evt_2", 1564069700),
+            event("evt_failing", 1564069690),
+        ],
+    ]
+    created_after = []
+    for page in pages:
+        event_check = EventCheck(6, use_watermark=True)
+        created_after.append(event_check.get_created_after())
+        mocker.patch.object(
+            event_check, "get_page", return_value=mock(dict(data=page, has_more=False))
+        )
+        stats = event_check.retrieve_events("")
+        assert stats["failed"] == 1
+        watermark = flask.g.hub_checkpoints.get_checkpoint("missing-events-watermark")
+        assert watermark.last_event_id == "evt_failing"
+        assert watermark.last_created == 1564069689
+
+    # the second run checks the failing event again
+    assert created_after[1] == 1564069689 - CFG.EVENT_CHECK_OVERLAP_SECONDS
+    flask.g.hub_checkpoints.model("missing-events-watermark").delete()
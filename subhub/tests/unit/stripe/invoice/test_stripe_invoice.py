@@ -8,6 +8,7 @@ import boto3
 import flask
 
 from subhub.cfg import CFG
+from subhub.hub.routes import basket
 from subhub import secrets
 
 from subhub.tests.unit.stripe.utils import run_test, MockSqsClient
@@ -43,7 +44,7 @@ def test_stripe_invoice_finalized(mocker):
     mockito.when(boto3).client("sqs", region_name=CFG.AWS_REGION).thenReturn(
         MockSqsClient
     )
-    mockito.when(requests).post(basket_url, json=data).thenReturn(response)
+    mockito.when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "invoice/invoice-finalized.json"
     run_customer(mocker, data, filename)
 
@@ -67,6 +68,6 @@ def test_stripe_invoice_payment_failed(mocker):
     mockito.when(boto3).client("sqs", region_name=CFG.AWS_REGION).thenReturn(
         MockSqsClient
     )
-    mockito.when(requests).post(basket_url, json=data).thenReturn(response)
+    mockito.when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "invoice/invoice-payment-failed.json"
     run_customer(mocker, data, filename)
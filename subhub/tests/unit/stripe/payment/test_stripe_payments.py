@@ -11,6 +11,7 @@ import stripe.error
 from mockito import when, mock, unstub
 
 from subhub.cfg import CFG
+from subhub.hub.routes import basket
 from subhub import secrets
 
 from subhub.tests.unit.stripe.utils import run_test, MockSqsClient
@@ -61,7 +62,7 @@ def test_stripe_payment_intent_succeeded(mocker):
     mockito.when(boto3).client("sqs", region_name=CFG.AWS_REGION).thenReturn(
         MockSqsClient
     )
-    mockito.when(requests).post(basket_url, json=data).thenReturn(response)
+    mockito.when(basket).post(basket_url, json=data).thenReturn(response)
     filename = "payment/payment-intent-succeeded.json"
     run_customer(mocker, data, filename)
     unstub()
@@ -0,0 +1,131 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import io
+import json
+import os
+
+from subhub.hub import archive, replay
+from subhub.hub.archive import EventArchive, LocalSegmentStore, S3SegmentStore
+from subhub.hub.stripe.controller import StripeHubEventPipeline
+from subhub.tests.unit.test_hub_queue import sign
+
+
+def body(event_id: str, event_type: str = "test.unknown") -> str:
+    # webhook bodies are pretty printed
+    return json.dumps({"id": event_id, "type": event_type, "data": {}}, indent=2)
+
+
+def read_store(store) -> list:
+    return [
+        json.loads(line)["id"]
+        for name in store.list()
+        for line in archive.read_segment(store.open(name))
+    ]
+
+
+def test_archive_rotates_segments(tmp_path):
+    store = LocalSegmentStore(str(tmp_path))
+    event_archive = EventArchive(store, max_events=2, max_seconds=60)
+    for i in range(3):
+        event_archive.append(body(f"evt_{i}"))
+    assert len(store.list()) == 2
+    # the open segment is readable up to its last event
+    assert read_store(store) == ["evt_0", "evt_1", "evt_2"]
+
+    event_archive.flush()
+    assert read_store(store) == ["evt_0", "evt_1", "evt_2"]
+    event_archive.append(body("evt_3"))
+    assert len(store.list()) == 3
+
+
+def test_archive_rotates_old_segments(tmp_path):
+    store = LocalSegmentStore(str(tmp_path))
+    event_archive = EventArchive(store, max_events=10, max_seconds=0)
+    event_archive.append(body("evt_0"))
+    event_archive.append(body("evt_1"))
+    assert len(store.list()) == 2
+
+
+def test_s3_segment_store():
+    class S3Client:
+        def __init__(self):
+            self.objects = dict()
+
+        def put_object(self, Bucket, Key, Body):
+            self.objects[(Bucket, Key)] = Body
+
+        def get_paginator(self, operation):
+            client = self
+
+            class Paginator:
+                def paginate(self, Bucket, Prefix):
+                    keys = [k for b, k in client.objects if k.startswith(Prefix)]
+                    return [{"Contents": [{"Key": k} for k in keys]}]
+
+            return Paginator()
+
+        def get_object(self, Bucket, Key):
+            return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    client = S3Client()
+    store = S3SegmentStore("archive", "/hub/", "us-west-2", client=client)
+    event_archive = EventArchive(store, max_events=1, max_seconds=60)
+    event_archive.append(body("evt_s3"))
+    assert [key for _, key in client.objects][0].startswith("hub/events-")
+    assert read_store(store) == ["evt_s3"]
+
+
+def test_view_archives_events(app, tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv("HUB_ARCHIVE_URL", str(tmp_path))
+    mocker.patch.object(StripeHubEventPipeline, "run")
+    payload = body("evt_archived")
+    response = app.app.test_client().post(
+        "v1/hub",
+        data=payload,
+        headers={"Stripe-Signature": sign(payload)},
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    archive.get_event_archive().flush()
+    assert read_store(LocalSegmentStore(str(tmp_path))) == ["evt_archived"]
+
+
+def test_flush_event_archives(tmp_path, monkeypatch):
+    monkeypatch.setenv("HUB_ARCHIVE_URL", str(tmp_path))
+    archive.archive_event(body("evt_flushed"))
+    event_archive = archive.get_event_archive()
+    assert event_archive._gzip is not None
+
+    archive.flush_event_archives()
+    assert event_archive._gzip is None
+    assert read_store(LocalSegmentStore(str(tmp_path))) == ["evt_flushed"]
+
+
+def test_replay_reports_event_types(mocker):
+    run = mocker.patch.object(StripeHubEventPipeline, "run")
+    run.side_effect = [None, ValueError("failed"), None]
+    bodies = [
+        body("evt_0", "customer.created"),
+        body("evt_1", "customer.created"),
+        body("evt_2"),
+    ]
+    report = replay.replay(bodies, rate=1000, only_routes=[])
+    assert report["events"] == 3
+    assert report["failed"] == 1
+    assert report["event_types"]["customer.created"]["count"] == 2
+    assert report["event_types"]["customer.created"]["failed"] == 1
+    assert report["event_types"]["test.unknown"]["count"] == 1
+
+
+def test_replay_segment_file(tmp_path, mocker, capsys):
+    event_archive = EventArchive(LocalSegmentStore(str(tmp_path)), 10, 60)
+    event_archive.append(body("evt_0"))
+    event_archive.append(body("evt_1"))
+    event_archive.flush()
+    segment = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+
+    assert replay.main([segment, "--limit", "1", "--only-routes", ""]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["events"] == 1
@@ -0,0 +1,135 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from subhub.hub.routes import basket
+from subhub.hub.routes.salesforce import SalesforceRoute
+from subhub.metrics import METRICS
+
+
+class BasketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append(json.loads(body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def basket_server(monkeypatch):
+    monkeypatch.setenv("BASKET_BACKOFF", "0")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BasketHandler)
+    server.daemon_threads = True
+    server.received = []
+    server.statuses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}/subscriptions?api-key="
+
+
+def test_post_retries_server_errors(basket_server):
+    basket_server.statuses = [503, 502]
+    retries = METRICS.counter("hub.basket.retry")
+    response = basket.post(url(basket_server), json={"event_id": "evt_1"})
+    assert response.status_code == 200
+    assert len(basket_server.received) == 3
+    assert METRICS.counter("hub.basket.retry") == retries + 2
+
+
+def test_post_gives_up_after_retries(basket_server, monkeypatch):
+    monkeypatch.setenv("BASKET_RETRIES", "1")
+    basket_server.statuses = [500, 500, 500]
+    response = basket.post(url(basket_server), json={})
+    assert response.status_code == 500
+    assert len(basket_server.received) == 2
+
+
+def test_post_retries_within_route_timeout(basket_server, monkeypatch):
+    monkeypatch.setenv("HUB_ROUTE_TIMEOUT_SECONDS", "1")
+    basket_server.statuses = [503]
+    response = basket.post(url(basket_server), json={})
+    assert response.status_code == 503
+    assert len(basket_server.received) == 1
+
+
+def test_post_connection_error(monkeypatch):
+    monkeypatch.setenv("BASKET_BACKOFF", "0")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with pytest.raises(requests.exceptions.ConnectionError):
+        basket.post(f"http://127.0.0.1:{port}/", json={})
+
+
+def test_session_is_shared():
+    assert basket.get_session() is basket.get_session()
+
+
+def test_batcher_sends_full_batches(basket_server):
+    batcher = basket.BasketBatcher(url(basket_server), max_items=3, max_wait=5)
+    futures = [batcher.submit({"event_id": f"evt_{i}"}) for i in range(3)]
+    assert [f.result(timeout=5).status_code for f in futures] == [200] * 3
+    assert basket_server.received == [
+        [{"event_id": "evt_0"}, {"event_id": "evt_1"}, {"event_id": "evt_2"}]
+    ]
+
+
+def test_batcher_flushes_after_max_wait(basket_server):
+    batcher = basket.BasketBatcher(url(basket_server), max_items=10, max_wait=0.05)
+    assert batcher.submit({"event_id": "evt_0"}).result(timeout=5).status_code == 200
+    assert batcher.submit({"event_id": "evt_1"}).result(timeout=5).status_code == 200
+    assert basket_server.received == [[{"event_id": "evt_0"}], [{"event_id": "evt_1"}]]
+
+
+def test_batcher_survives_batch_errors(basket_server):
+    batcher = basket.BasketBatcher(url(basket_server), max_items=1, max_wait=5)
+    with pytest.raises(TypeError):
+        batcher.submit({"event_id": object()}).result(timeout=5)
+    assert batcher.submit({"event_id": "evt_1"}).result(timeout=5).status_code == 200
+    assert batcher._thread.is_alive()
+    assert basket_server.received == [[{"event_id": "evt_1"}]]
+
+
+def test_salesforce_route_reports_after_batch_ack(basket_server, monkeypatch, mocker):
+    monkeypatch.setattr(
+        basket, "_batcher", basket.BasketBatcher(url(basket_server), 2, 5)
+    )
+    monkeypatch.setenv("BASKET_BATCH_ENABLED", "True")
+    report_route = mocker.patch.object(SalesforceRoute, "report_route")
+    basket_server.statuses = [503, 500, 500]
+    monkeypatch.setenv("BASKET_RETRIES", "0")
+    payloads = [json.dumps({"event_id": f"evt_{i}"}) for i in range(4)]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        failed = list(pool.map(lambda p: SalesforceRoute(p).route(), payloads[:2]))
+    assert failed == [None, None]
+    assert report_route.call_count == 0
+
+    basket_server.statuses = []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        sent = list(pool.map(lambda p: SalesforceRoute(p).route(), payloads[2:]))
+    assert all(r.status_code == 200 for r in sent)
+    assert report_route.call_count == 2
+    assert len(basket_server.received) == 2
@@ -0,0 +1,141 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import time
+
+from flask import g
+
+from subhub.db import UserCache
+from subhub.log import get_logger
+
+logger = get_logger()
+
+
+def test_user_cache_hits_and_misses():
+    cache = UserCache(maxsize=2, ttl=60)
+    assert cache.get("uid1") is None
+    cache.set("uid1", {"user_id": "uid1"})
+    assert cache.get("uid1") == {"user_id": "uid1"}
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 1
+
+
+def test_user_cache_is_bounded():
+    cache = UserCache(maxsize=2, ttl=60)
+    cache.set("uid1", {})
+    cache.set("uid2", {})
+    cache.get("uid1")
+    cache.set("uid3", {})
+    assert cache.get("uid2") is None
+    assert cache.get("uid1") == {}
+    assert cache.stats()["size"] == 2
+
+
+def test_user_cache_expires():
+    cache = UserCache(maxsize=2, ttl=1)
+    cache.set("uid1", {})
+    time.sleep(1.1)
+    assert cache.get("uid1") is None
+
+
+def test_get_user_reads_through_cache(monkeypatch):
+    subhub_account = g.subhub_account
+    cache = UserCache(maxsize=16, ttl=60)
+    monkeypatch.setattr(subhub_account, "cache", cache)
+    user = subhub_account.new_user("cache_user", "Test_system", "cus_cache")
+    assert subhub_account.save_user(user)
+
+    first = subhub_account.get_user("cache_user")
+    hits = cache.hits
+    second = subhub_account.get_user("cache_user")
+    assert cache.hits == hits + 1
+    assert second is not first
+    assert second.cust_id == "cus_cache"
+
+    second.cust_id = "cus_mutated"
+    assert subhub_account.get_user("cache_user").cust_id == "cus_cache"
+    subhub_account.remove_from_db("cache_user")
+
+
+def test_writes_invalidate_cache(monkeypatch):
+    subhub_account = g.subhub_account
+    monkeypatch.setattr(subhub_account, "cache", UserCache(maxsize=16, ttl=60))
+    user = subhub_account.new_user("cache_user", "Test_system", "cus_cache")
+    subhub_account.save_user(user)
+    subhub_account.get_user("cache_user")
+
+    assert subhub_account.append_custid("cache_user", "cus_new")
+    assert subhub_account.get_user("cache_user").cust_id == "cus_new"
+
+    assert subhub_account.mark_deleted("cache_user")
+    assert subhub_account.get_user("cache_user").customer_status == "deleted"
+
+    assert subhub_account.remove_from_db("cache_user")
+    assert subhub_account.get_user("cache_user") is None
+
+
+def test_append_custid_returns_new_state():
+    subhub_account = g.subhub_account
+    assert subhub_account.append_custid("missing_user", "cus_none") is None
+    assert subhub_account.get_user("missing_user") is None
+
+    subhub_account.save_user(
+        subhub_account.new_user("update_user", "Test_system", "cus_old")
+    )
+    updated = subhub_account.append_custid("update_user", "cus_updated")
+    assert updated.cust_id == "cus_updated"
+    assert updated.origin_system == "Test_system"
+    subhub_account.remove_from_db("update_user")
+
+
+def test_append_event_is_atomic_upsert():
+    hub_table = g.hub_table
+    hub_table.remove_from_db("evt_append_test")
+
+    created = hub_table.append_event("evt_append_test", "firefox")
+    assert created.sent_system == ["firefox"]
+    assert hub_table.append_event("evt_append_test", "firefox") is None
+    updated = hub_table.append_event("evt_append_test", "salesforce")
+    assert updated.sent_system == ["firefox", "salesforce"]
+    assert hub_table.get_event("evt_append_test").sent_system == [
+        "firefox",
+        "salesforce",
+    ]
+    hub_table.remove_from_db("evt_append_test")
+
+
+def test_get_user_by_cust_id(monkeypatch):
+    subhub_account = g.subhub_account
+    monkeypatch.setattr(subhub_account, "cache", UserCache(maxsize=16, ttl=60))
+    subhub_account.save_user(
+        subhub_account.new_user("index_user", "Test_system", "cus_index")
+    )
+    assert subhub_account.get_user_by_cust_id("cus_missing") is None
+
+    user = subhub_account.get_user_by_cust_id("cus_index")
+    assert user.user_id == "index_user"
+    hits = subhub_account.cache.hits
+    assert subhub_account.get_user_by_cust_id("cus_index").user_id == "index_user"
+    assert subhub_account.cache.hits > hits
+
+    subhub_account.append_custid("index_user", "cus_other")
+    assert subhub_account.get_user_by_cust_id("cus_index") is None
+    subhub_account.remove_from_db("index_user")
+
+
+def test_batch_get_events():
+    hub_table = g.hub_table
+    assert hub_table.batch_get_events([]) == {}
+    stored = ["evt_batch_1", "evt_batch_75", "evt_batch_149"]
+    for event_id in stored:
+        hub_table.append_event(event_id, "salesforce")
+
+    event_ids = [f"evt_batch_{i}" for i in range(150)] + ["evt_batch_1"]
+    found = hub_table.batch_get_events(event_ids)
+    assert sorted(found) == sorted(stored)
+    assert found["evt_batch_75"].sent_system == ["salesforce"]
+    for event_id in stored:
+        hub_table.remove_from_db(event_id)
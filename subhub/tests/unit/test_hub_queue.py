@@ -0,0 +1,198 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from flask import g
+
+from subhub.cfg import CFG
+from subhub.hub import coalesce, worker
+from subhub.hub.queue import LocalEventQueue, SqsEventQueue, get_event_queue
+from subhub.hub.routes.pipeline import FAILED, SENT, RouteOutcome
+from subhub.hub.stripe import controller
+from subhub.hub.stripe.controller import StripeHubEventPipeline
+from subhub.log import get_logger
+
+logger = get_logger()
+
+
+def sign(payload: str) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        CFG.HUB_API_KEY.encode("utf-8"),
+        f"{timestamp}.{payload}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def test_local_queue_visibility():
+    queue = LocalEventQueue(visibility_timeout=0)
+    queue.send("first")
+    queue.send("second")
+    messages = queue.receive(1)
+    assert [m.body for m in messages] == ["first"]
+    queue.delete(messages)
+    assert [m.body for m in queue.receive(10)] == ["second"]
+    # not deleted, so it becomes visible again
+    assert [m.body for m in queue.receive(10)] == ["second"]
+    assert queue.receive(10, wait_seconds=0) != []
+    assert len(queue) == 1
+
+
+def test_sqs_queue_batches_deletes():
+    class SqsClient:
+        def __init__(self):
+            self.deleted = []
+
+        def delete_message_batch(self, QueueUrl, Entries):
+            self.deleted.append(len(Entries))
+            return {"Successful": Entries}
+
+    client = SqsClient()
+    queue = SqsEventQueue("https://sqs/hub", "us-west-2", client=client)
+    messages = [worker.QueueMessage(str(i), f"rh-{i}", "{}") for i in range(23)]
+    queue.delete(messages)
+    assert client.deleted == [10, 10, 3]
+
+
+def test_view_enqueues_when_async(app, monkeypatch, mocker):
+    monkeypatch.setenv("HUB_ASYNC_ENABLED", "True")
+    run = mocker.patch.object(StripeHubEventPipeline, "run")
+    queue = get_event_queue()
+    worker.drain(queue, wait_seconds=0)
+
+    payload = json.dumps(
+        {"id": "evt_async", "object": "event", "type": "test.unknown", "data": {}}
+    )
+    response = app.app.test_client().post(
+        "v1/hub",
+        data=payload,
+        headers={"Stripe-Signature": sign(payload)},
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    run.assert_not_called()
+
+    stats = worker.drain(queue, wait_seconds=0)
+    assert stats["processed"] == 1
+    assert run.call_count == 1
+
+
+def test_drain_leaves_failed_messages():
+    queue = LocalEventQueue(visibility_timeout=60)
+    queue.send(json.dumps({"id": "evt_unhandled", "type": "test.unknown"}))
+    queue.send("imalittleteapot")
+    stats = worker.drain(queue, batch_size=10, wait_seconds=0)
+    assert stats == dict(batches=1, received=2, processed=1, failed=1)
+    assert len(queue) == 1
+
+
+def test_batch_item_failures():
+    records = [
+        dict(messageId="m1", body=json.dumps({"id": "evt_1", "type": "test.unknown"})),
+        dict(messageId="m2", body="imalittleteapot"),
+        dict(messageId="m3", body=json.dumps({"id": "evt_3", "type": "test.unknown"})),
+    ]
+    assert worker.batch_item_failures(records) == [dict(itemIdentifier="m2")]
+
+    remaining = iter([60000, 60000, 1000])
+    assert worker.batch_item_failures(records, lambda: next(remaining)) == [
+        dict(itemIdentifier="m2"),
+        dict(itemIdentifier="m3"),
+    ]
+
+
+def test_batch_item_failures_keeps_undelivered_event(mocker):
+    controller.routed_events().clear()
+    mocker.patch.object(
+        StripeHubEventPipeline,
+        "run",
+        return_value={
+            "firefox_route": RouteOutcome("firefox_route", SENT, 0.1, None),
+            "salesforce_route": RouteOutcome("salesforce_route", FAILED, 0.1, "down"),
+        },
+    )
+    records = [
+        dict(messageId="m1", body=json.dumps({"id": "evt_1", "type": "test.unknown"}))
+    ]
+    assert worker.batch_item_failures(records) == [dict(itemIdentifier="m1")]
+    assert "evt_1" not in controller.routed_events()
+
+
+def customer_updated(event_id: str, customer_id: str, created: int) -> dict:
+    return {
+        "id": event_id,
+        "type": "customer.updated",
+        "created": created,
+        "data": {"object": {"id": customer_id}},
+    }
+
+
+def test_superseded_events():
+    events = [
+        customer_updated("evt_1", "cus_1", 100),
+        customer_updated("evt_2", "cus_2", 100),
+        None,
+        customer_updated("evt_3", "cus_1", 104),
+        customer_updated("evt_4", "cus_1", 102),
+        customer_updated("evt_5", "cus_1", 120),
+        {"id": "evt_6", "type": "customer.created", "created": 100},
+    ]
+    # evt_1 and evt_4 are followed by evt_3 within the window, evt_5 is not
+    assert coalesce.superseded_events(events, 5) == {0: 3, 4: 3}
+    assert coalesce.superseded_events(events, 0) == {}
+
+
+@pytest.fixture()
+def coalesced(monkeypatch):
+    monkeypatch.setenv("HUB_COALESCE_SECONDS", "5")
+    controller.routed_events().clear()
+    yield
+    controller.routed_events().clear()
+    g.hub_table.remove_from_db("evt_coalesced")
+    g.hub_table.remove_from_db("evt_latest")
+    g.hub_table.remove_from_db("evt_other")
+
+
+def test_batch_coalesces_customer_updates(coalesced, mocker):
+    def deliver(event):
+        g.hub_table.append_event(event["id"], "salesforce")
+        return []
+
+    processed = mocker.patch.object(worker, "process_event", side_effect=deliver)
+    bodies = [
+        json.dumps(customer_updated("evt_coalesced", "cus_1", 100)),
+        json.dumps(customer_updated("evt_other", "cus_2", 101)),
+        json.dumps(customer_updated("evt_latest", "cus_1", 102)),
+    ]
+    assert worker.process_batch(bodies) == [True, True, True]
+    delivered = [c[0][0]["id"] for c in processed.call_args_list]
+    assert delivered == ["evt_other", "evt_latest"]
+    assert g.hub_table.get_event("evt_coalesced").sent_system == ["salesforce"]
+
+
+def test_batch_coalesced_update_waits_for_sent_routes(coalesced, mocker):
+    # e.g. the route of the latest update was left in the outbox
+    mocker.patch.object(worker, "process_event", return_value=[])
+    bodies = [
+        json.dumps(customer_updated("evt_coalesced", "cus_1", 100)),
+        json.dumps(customer_updated("evt_latest", "cus_1", 102)),
+    ]
+    assert worker.process_batch(bodies) == [False, True]
+    assert g.hub_table.get_event("evt_coalesced") is None
+
+
+def test_batch_coalesced_update_fails_with_latest(coalesced, mocker):
+    mocker.patch.object(worker, "process_event", side_effect=ValueError("down"))
+    bodies = [
+        json.dumps(customer_updated("evt_coalesced", "cus_1", 100)),
+        json.dumps(customer_updated("evt_latest", "cus_1", 102)),
+    ]
+    assert worker.process_batch(bodies) == [False, False]
+    assert g.hub_table.get_event("evt_coalesced") is None
@@ -0,0 +1,31 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from subhub.metrics import Metrics
+
+
+def test_counters_are_labelled():
+    metrics = Metrics()
+    metrics.incr("hub.event.received", event_type="customer.created")
+    metrics.incr("hub.event.received", event_type="customer.created")
+    metrics.incr("hub.event.received", event_type="invoice.finalized")
+    assert metrics.counter("hub.event.received", event_type="customer.created") == 2
+    assert metrics.counter("hub.event.received", event_type="customer.deleted") == 0
+    counters = metrics.snapshot()["counters"]
+    assert counters["hub.event.received{event_type=invoice.finalized}"] == 1
+
+
+def test_histogram_buckets():
+    metrics = Metrics()
+    for value in (0.001, 0.02, 0.02, 30):
+        metrics.observe("hub.event.duration", value, event_type="customer.created")
+    with metrics.timer("hub.event.duration", event_type="customer.created"):
+        pass
+    histogram = metrics.histogram("hub.event.duration", event_type="customer.created")
+    assert histogram["count"] == 5
+    assert histogram["max"] == 30
+    assert histogram["buckets"]["0.025"] == 2
+    assert histogram["buckets"]["+Inf"] == 1
+    metrics.reset()
+    assert metrics.snapshot() == dict(counters={}, histograms={})
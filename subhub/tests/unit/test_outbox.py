@@ -0,0 +1,115 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import time
+
+import pytest
+from flask import g
+
+from subhub.db import OUTBOX_DEAD
+from subhub.hub import outbox
+from subhub.hub.routes import pipeline
+from subhub.hub.routes.firefox import FirefoxRoute
+from subhub.hub.routes.pipeline import RoutesPipeline
+from subhub.hub.routes.salesforce import SalesforceRoute
+from subhub.hub.routes.static import StaticRoutes
+
+ROUTES = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
+DELIVERY_ID = f"evt_outbox:{StaticRoutes.FIREFOX_ROUTE}"
+
+
+@pytest.fixture()
+def outbox_enabled(monkeypatch):
+    monkeypatch.setenv("HUB_OUTBOX_ENABLED", "True")
+    monkeypatch.setenv("OUTBOX_BACKOFF_SECONDS", "0")
+    yield
+    delivery = g.hub_outbox.get_delivery(DELIVERY_ID)
+    if delivery:
+        g.hub_outbox.remove(delivery)
+    g.hub_table.remove_from_db("evt_outbox")
+
+
+def payload():
+    return json.dumps({"event_id": "evt_outbox", "event_type": "customer.created"})
+
+
+def test_failed_route_is_deferred(outbox_enabled, mocker):
+    mocker.patch.object(FirefoxRoute, "route", return_value=None)
+    mocker.patch.object(SalesforceRoute, "route", return_value=True)
+    outcomes = RoutesPipeline(ROUTES, payload()).run()
+    assert outcomes[StaticRoutes.FIREFOX_ROUTE].status == pipeline.DEFERRED
+    assert outcomes[StaticRoutes.SALESFORCE_ROUTE].status == pipeline.SENT
+    assert pipeline.undelivered_routes(outcomes) == []
+
+    delivery = g.hub_outbox.get_delivery(DELIVERY_ID)
+    assert delivery.event_id == "evt_outbox"
+    assert delivery.route == StaticRoutes.FIREFOX_ROUTE
+    assert delivery.payload == payload()
+    assert delivery.attempts == 1
+
+    # the event failing again keeps the pending delivery
+    RoutesPipeline(ROUTES, payload()).run()
+    assert g.hub_outbox.get_delivery(DELIVERY_ID).attempts == 1
+
+
+def test_failed_route_raises_without_outbox(mocker):
+    mocker.patch.object(FirefoxRoute, "route", side_effect=ValueError("sns down"))
+    mocker.patch.object(SalesforceRoute, "route", return_value=True)
+    with pytest.raises(ValueError):
+        RoutesPipeline(ROUTES, payload()).run()
+
+
+def test_drain_retries_only_the_failed_route(outbox_enabled, mocker):
+    firefox = mocker.patch.object(FirefoxRoute, "route", return_value=None)
+    salesforce = mocker.patch.object(SalesforceRoute, "route", return_value=True)
+    RoutesPipeline(ROUTES, payload()).run()
+
+    firefox.return_value = True
+    stats = outbox.drain()
+    assert stats["sent"] == 1
+    assert firefox.call_count == 2
+    assert salesforce.call_count == 1
+    assert g.hub_outbox.get_delivery(DELIVERY_ID) is None
+
+
+def test_drain_backs_off_then_dead_letters(outbox_enabled, monkeypatch, mocker):
+    monkeypatch.setenv("OUTBOX_MAX_ATTEMPTS", "3")
+    mocker.patch.object(FirefoxRoute, "route", return_value=None)
+    RoutesPipeline([StaticRoutes.FIREFOX_ROUTE], payload()).run()
+
+    assert outbox.drain()["retry"] == 1
+    assert g.hub_outbox.get_delivery(DELIVERY_ID).attempts == 2
+    assert outbox.drain()["dead"] == 1
+    delivery = g.hub_outbox.get_delivery(DELIVERY_ID)
+    assert delivery.status == OUTBOX_DEAD
+    assert delivery.attempts == 3
+    assert outbox.drain()["due"] == 0
+
+
+def test_drain_skips_routes_sent_meanwhile(outbox_enabled, mocker):
+    firefox = mocker.patch.object(FirefoxRoute, "route", return_value=None)
+    RoutesPipeline([StaticRoutes.FIREFOX_ROUTE], payload()).run()
+    g.hub_table.append_event("evt_outbox", FirefoxRoute.sent_system)
+
+    assert outbox.drain()["already_sent"] == 1
+    assert firefox.call_count == 1
+    assert g.hub_outbox.get_delivery(DELIVERY_ID) is None
+
+
+def test_claim_is_exclusive(outbox_enabled):
+    g.hub_outbox.add(
+        "evt_outbox", StaticRoutes.FIREFOX_ROUTE, payload(), "failed", int(time.time())
+    )
+    first = g.hub_outbox.get_delivery(DELIVERY_ID)
+    second = g.hub_outbox.get_delivery(DELIVERY_ID)
+    assert g.hub_outbox.claim(first, int(time.time()) + 60)
+    assert not g.hub_outbox.claim(second, int(time.time()) + 60)
+    assert g.hub_outbox.due_deliveries(int(time.time()), 10) == []
+
+
+def test_retry_delay(monkeypatch):
+    monkeypatch.setenv("OUTBOX_BACKOFF_SECONDS", "2")
+    assert [outbox.retry_delay(n) for n in (1, 2, 3, 4)] == [2, 4, 8, 16]
+    assert outbox.retry_delay(20) == outbox.MAX_BACKOFF_SECONDS
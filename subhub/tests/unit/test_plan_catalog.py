@@ -0,0 +1,249 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from subhub import plan_catalog
+from subhub.hub.stripe.controller import StripeHubEventPipeline
+from subhub.plan_catalog import PlanCatalog, catalog_name, load_plans
+from subhub.sub import payments
+
+
+def plan(plan_id, product):
+    return {
+        "id": plan_id,
+        "interval": "month",
+        "amount": 500,
+        "currency": "usd",
+        "nickname": f"{plan_id} nickname",
+        "product": product,
+    }
+
+
+class Loads:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return [{"plan_id": f"plan_{self.count}"}]
+
+
+def test_load_plans_expands_products_across_pages(monkeypatch):
+    plans = MagicMock()
+    plans.auto_paging_iter.return_value = iter(
+        [
+            plan("plan_1", {"id": "prod_1", "name": "Product 1"}),
+            plan("plan_101", {"id": "prod_2", "name": "Product 2"}),
+        ]
+    )
+    plan_list = Mock(return_value=plans)
+    product_retrieve = Mock()
+    monkeypatch.setattr("stripe.Plan.list", plan_list)
+    monkeypatch.setattr("stripe.Product.retrieve", product_retrieve)
+
+    catalog = load_plans()
+
+    plan_list.assert_called_once_with(limit=100, expand=["data.product"])
+    product_retrieve.assert_not_called()
+    assert [p["plan_id"] for p in catalog] == ["plan_1", "plan_101"]
+    assert catalog[1]["product_id"] == "prod_2"
+    assert catalog[1]["product_name"] == "Product 2"
+
+
+def test_plans_loaded_once_while_fresh():
+    load = Loads()
+    catalog = PlanCatalog(600, load)
+
+    assert catalog.plans() == [{"plan_id": "plan_1"}]
+    assert catalog.plans() == [{"plan_id": "plan_1"}]
+    assert load.count == 1
+
+
+def test_expired_plans_served_while_refreshing():
+    load = Loads()
+    catalog = PlanCatalog(0, load)
+    catalog.plans()
+
+    assert catalog.plans() == [{"plan_id": "plan_1"}]
+    catalog._refresh_thread.join(5)
+    assert catalog.plans() == [{"plan_id": "plan_2"}]
+
+
+def test_refresh_is_single_flight():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return []
+
+    catalog = PlanCatalog(0, slow_load)
+    loader = threading.Thread(target=catalog.refresh)
+    loader.start()
+    started.wait(5)
+
+    catalog.refresh()
+    assert catalog._start_refresh() is not None
+    catalog._refresh_thread.join(0.1)
+    release.set()
+    loader.join(5)
+    catalog._refresh_thread.join(5)
+
+    assert len(calls) == 1
+
+
+def test_inline_refresh_serves_new_plans():
+    load = Loads()
+    catalog = PlanCatalog(0, load, inline=True)
+    catalog.plans()
+
+    assert catalog.plans() == [{"plan_id": "plan_2"}]
+    assert catalog._refresh_thread is None
+    assert load.count == 2
+
+
+def test_plan_catalog_refreshes_inline_in_lambda(monkeypatch):
+    monkeypatch.setenv("AWS_EXECUTION_ENV", "AWS_Lambda_python3.7")
+    monkeypatch.setattr(plan_catalog, "_catalog", None)
+
+    assert plan_catalog.get_plan_catalog().inline
+
+
+def test_first_load_failure_raises_and_refresh_failure_keeps_plans():
+    load = Mock(side_effect=[ValueError("stripe down"), [1], ValueError("down")])
+    catalog = PlanCatalog(0, load)
+
+    with pytest.raises(ValueError):
+        catalog.plans()
+    assert catalog.plans() == [1]
+    assert catalog.plans() == [1]
+    catalog._refresh_thread.join(5)
+    assert load.call_count == 3
+    assert catalog.plans() == [1]
+
+
+def test_invalidate_refreshes_plans():
+    load = Loads()
+    catalog = PlanCatalog(600, load)
+    catalog.plans()
+
+    catalog.invalidate()
+    catalog._refresh_thread.join(5)
+
+    assert catalog.plans() == [{"plan_id": "plan_2"}]
+    assert not catalog._expired()
+
+
+def test_catalog_event_invalidates_plans(monkeypatch):
+    catalog = Mock()
+    monkeypatch.setattr(plan_catalog, "_catalog", catalog)
+
+    outcomes = StripeHubEventPipeline(
+        {"id": "evt_1", "type": "product.updated", "data": {"object": {}}}
+    ).run()
+
+    catalog.invalidate.assert_called_once()
+    assert outcomes is None
+
+
+def test_list_all_plans(monkeypatch):
+    catalog = PlanCatalog(600, Loads())
+    monkeypatch.setattr(plan_catalog, "_catalog", catalog)
+
+    plans, code = payments.list_all_plans()
+
+    assert code == 200
+    assert plans == [{"plan_id": "plan_1"}]
+
+
+class MemoryStore:
+    def __init__(self, plans=None, loaded_at=0.0):
+        self.item = None
+        if plans is not None:
+            self.save_catalog("catalog", "stored", json.dumps(plans), loaded_at)
+
+    def get_catalog(self, name):
+        return self.item
+
+    def save_catalog(self, name, content_hash, plans, loaded_at):
+        self.item = SimpleNamespace(
+            content_hash=content_hash, plans=plans, loaded_at=loaded_at
+        )
+        return True
+
+
+def test_fresh_stored_catalog_is_taken():
+    load = Loads()
+    catalog = PlanCatalog(600, load, MemoryStore([{"plan_id": "stored"}], time.time()))
+
+    assert catalog.plans() == [{"plan_id": "stored"}]
+    assert catalog.content_hash == "stored"
+    assert load.count == 0
+
+
+def test_warm_serves_expired_stored_catalog_and_refreshes():
+    load = Loads()
+    store = MemoryStore([{"plan_id": "stored"}], time.time() - 3600)
+    catalog = PlanCatalog(600, load, store)
+
+    catalog.warm()
+    assert catalog.plans() == [{"plan_id": "stored"}]
+    catalog._refresh_thread.join(5)
+
+    assert catalog.plans() == [{"plan_id": "plan_1"}]
+    assert json.loads(store.item.plans) == [{"plan_id": "plan_1"}]
+    assert store.item.content_hash == catalog.content_hash != "stored"
+
+
+def test_invalidate_lists_plans_instead_of_stored_catalog():
+    load = Loads()
+    store = MemoryStore([{"plan_id": "stored"}], time.time())
+    catalog = PlanCatalog(600, load, store)
+    catalog.warm()
+
+    catalog.invalidate()
+    catalog._refresh_thread.join(5)
+
+    assert catalog.plans() == [{"plan_id": "plan_1"}]
+    assert json.loads(store.item.plans) == [{"plan_id": "plan_1"}]
+
+
+def test_store_errors_fall_back_to_stripe():
+    store = Mock()
+    store.get_catalog.side_effect = ValueError("table down")
+    store.save_catalog.side_effect = ValueError("table down")
+    catalog = PlanCatalog(600, Loads(), store)
+
+    assert catalog.plans() == [{"plan_id": "plan_1"}]
+
+
+def test_catalog_name_hides_api_key():
+    name = catalog_name("sk_test_secret")
+
+    assert name.startswith("plan-catalog-")
+    assert "secret" not in name
+    assert name != catalog_name("sk_live_secret")
+
+
+def test_stored_catalog_only_moves_forward(app):
+    store = app.app.plan_catalog_store
+    name = f"plan-catalog-{uuid.uuid4()}"
+
+    assert store.get_catalog(name) is None
+    assert store.save_catalog(name, "v2", "[2]", 200.5)
+    assert not store.save_catalog(name, "v1", "[1]", 100.5)
+
+    stored = store.get_catalog(name)
+    assert (stored.content_hash, stored.plans, stored.loaded_at) == ("v2", "[2]", 200.5)
+    assert app.app.hub_table.get_event(name) is None
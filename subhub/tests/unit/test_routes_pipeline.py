@@ -0,0 +1,109 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import threading
+
+import flask
+import pytest
+
+from subhub.hub.routes import firefox, pipeline
+from subhub.hub.routes.firefox import FirefoxRoute
+from subhub.hub.routes.message import RouteMessage
+from subhub.hub.routes.pipeline import RoutesPipeline
+from subhub.hub.routes.salesforce import SalesforceRoute
+from subhub.hub.routes.static import StaticRoutes
+
+ROUTES = [StaticRoutes.FIREFOX_ROUTE, StaticRoutes.SALESFORCE_ROUTE]
+
+
+def test_routes_run_concurrently(mocker):
+    # each route waits for the other, which only returns if they overlap
+    barrier = threading.Barrier(len(ROUTES), timeout=5)
+
+    def overlapping_route(self):
+        barrier.wait()
+        assert flask.g.hub_table is not None
+        return True
+
+    mocker.patch.object(FirefoxRoute, "route", overlapping_route)
+    mocker.patch.object(SalesforceRoute, "route", overlapping_route)
+    outcomes = RoutesPipeline(ROUTES, "{}").run()
+    assert [o.status for o in outcomes.values()] == [pipeline.SENT, pipeline.SENT]
+
+
+@pytest.mark.parametrize("concurrent", ["True", "False"])
+def test_failing_route_does_not_block_others(mocker, monkeypatch, concurrent):
+    monkeypatch.setenv("HUB_ROUTES_CONCURRENT", concurrent)
+    mocker.patch.object(FirefoxRoute, "route", side_effect=ValueError("sns down"))
+    salesforce = mocker.patch.object(SalesforceRoute, "route")
+    with pytest.raises(ValueError):
+        RoutesPipeline(ROUTES, "{}").run()
+    assert salesforce.call_count == 1
+
+
+def test_route_timeout(mocker, monkeypatch):
+    monkeypatch.setenv("HUB_ROUTE_TIMEOUT_SECONDS", "1")
+    release = threading.Event()
+    finished = threading.Event()
+    mocker.patch.object(FirefoxRoute, "route", lambda self: release.wait(5))
+    mocker.patch.object(SalesforceRoute, "route")
+    late = mocker.patch.object(
+        RoutesPipeline, "finished_late", side_effect=lambda f: finished.set()
+    )
+    outcomes = RoutesPipeline(ROUTES, "{}").run_concurrent(ROUTES)
+    assert outcomes[StaticRoutes.FIREFOX_ROUTE].status == pipeline.TIMEOUT
+    assert outcomes[StaticRoutes.SALESFORCE_ROUTE].status == pipeline.SENT
+
+    release.set()
+    assert finished.wait(5)
+    assert late.call_args[0][0].result().status == pipeline.SENT
+
+
+def test_routes_run_serially(mocker, monkeypatch):
+    monkeypatch.setenv("HUB_ROUTES_CONCURRENT", "False")
+    mocker.patch.object(FirefoxRoute, "route")
+    mocker.patch.object(SalesforceRoute, "route")
+    outcomes = RoutesPipeline(
+        ROUTES, "{}", only_routes=[StaticRoutes.SALESFORCE_ROUTE]
+    ).run()
+    assert outcomes[StaticRoutes.FIREFOX_ROUTE].status == pipeline.SKIPPED
+    assert outcomes[StaticRoutes.SALESFORCE_ROUTE].status == pipeline.SENT
+
+
+def test_sns_client_is_shared():
+    assert firefox.get_sns_client() is firefox.get_sns_client()
+
+
+def test_routes_share_one_message(mocker):
+    messages = []
+
+    def route(self):
+        messages.append(self.message)
+        return True
+
+    mocker.patch.object(FirefoxRoute, "route", route)
+    mocker.patch.object(SalesforceRoute, "route", route)
+    data = {"event_id": "evt_message", "event_type": "customer.created"}
+    RoutesPipeline(ROUTES, data).run()
+    assert messages[0] is messages[1]
+    assert messages[0].data is data
+
+
+def test_route_message_encodes_once(mocker):
+    message = RouteMessage({"event_id": "evt_message"})
+    dumps = mocker.spy(json, "dumps")
+    assert message.sns_message is message.sns_message
+    assert message.json is message.json
+    assert dumps.call_count == 3
+    # SNS default message stays the JSON encoded string of the payload JSON
+    default = json.loads(json.loads(message.sns_message)["default"])
+    assert json.loads(default) == {"event_id": "evt_message"}
+
+
+def test_route_message_coerce():
+    message = RouteMessage.coerce(b'{"event_id": "evt_message"}')
+    assert message.event_id == "evt_message"
+    assert message.json == '{"event_id": "evt_message"}'
+    assert RouteMessage.coerce(message) is message
@@ -3,10 +3,25 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import flask
-from flask import Response
+import pytest
+from flask import Response, g
 
 from mockito import when, mock, unstub
 
+from subhub.cfg import CFG
+from subhub.exceptions import ClientError
+from subhub.hub.routes.pipeline import NOT_ROUTED, SENT, RouteOutcome
+from subhub.hub.routes.static import StaticRoutes
+from subhub.hub.stripe import controller
+from subhub.hub.stripe.abstract import EVENT_HANDLERS, handles
+from subhub.hub.stripe.controller import StripeHubEventPipeline
+from subhub.hub.stripe.customer import (
+    StripeCustomerCreated,
+    StripeCustomerSubscriptionUpdated,
+    StripeCustomerUpdated,
+)
+from subhub.hub.stripe.intents import StripePaymentIntentSucceeded
+from subhub.metrics import METRICS
 from subhub.tests.unit.stripe.utils import run_event_process
 from subhub.log import get_logger
 
@@ -47,3 +62,196 @@ def test_controller_view_bad_data(mocker):
     webhook = run_webhook(mocker, data)
     assert isinstance(webhook, Response)
     unstub()
+
+
+def test_controller_registry():
+    assert EVENT_HANDLERS["customer.created"] is StripeCustomerCreated
+    assert len(EVENT_HANDLERS) == 17
+    with pytest.raises(ValueError):
+        handles("customer.created")(StripeCustomerUpdated)
+
+
+def test_controller_unhandled_event_metrics(mocker):
+    received = METRICS.counter("hub.event.received", event_type="test.unknown")
+    unhandled = METRICS.counter("hub.event.unhandled", event_type="test.unknown")
+    webhook = run_webhook(mocker, {"id": "evt_unknown", "type": "test.unknown"})
+    assert webhook.status_code == 200
+    assert METRICS.counter("hub.event.received", event_type="test.unknown") == (
+        received + 1
+    )
+    assert METRICS.counter("hub.event.unhandled", event_type="test.unknown") == (
+        unhandled + 1
+    )
+
+
+def test_controller_failed_event_metrics(mocker):
+    event_type = "payment_intent.succeeded"
+    failed = METRICS.counter("hub.event.failed", event_type=event_type)
+    count = METRICS.histogram("hub.event.duration", event_type=event_type)["count"]
+    mocker.patch.object(
+        StripePaymentIntentSucceeded, "run", side_effect=ClientError("failed")
+    )
+    webhook = run_webhook(mocker, {"id": "evt_failed", "type": event_type})
+    assert webhook.status_code == 500
+    assert METRICS.counter("hub.event.failed", event_type=event_type) == failed + 1
+    histogram = METRICS.histogram("hub.event.duration", event_type=event_type)
+    assert histogram["count"] == count + 1
+
+
+@pytest.fixture()
+def routed_event():
+    controller.routed_events().clear()
+    yield {"id": "evt_routed", "type": "customer.subscription.created"}
+    controller.routed_events().clear()
+    g.hub_table.remove_from_db("evt_routed")
+
+
+def mock_pipeline(mocker):
+    only_routes = []
+
+    def run(self):
+        only_routes.append(self.only_routes)
+        routes = self.only_routes or []
+        return {r: RouteOutcome(r, SENT, 0.0, None) for r in routes}
+
+    mocker.patch.object(StripeHubEventPipeline, "run", run)
+    return only_routes
+
+
+def test_process_event_skips_sent_routes(routed_event, mocker):
+    only_routes = mock_pipeline(mocker)
+    g.hub_table.append_event("evt_routed", "firefox")
+    controller.process_event(routed_event)
+    assert only_routes == [[StaticRoutes.SALESFORCE_ROUTE]]
+
+
+def test_process_event_skips_routed_event(routed_event, mocker):
+    only_routes = mock_pipeline(mocker)
+    duplicates = METRICS.counter(
+        "hub.event.duplicate", event_type="customer.subscription.created"
+    )
+    g.hub_table.append_event("evt_routed", "firefox")
+    g.hub_table.append_event("evt_routed", "salesforce")
+    controller.process_event(routed_event)
+    assert only_routes == []
+
+    # the next redelivery is answered from the recent routed events
+    get_event = mocker.spy(g.hub_table, "get_event")
+    controller.process_event(routed_event)
+    get_event.assert_not_called()
+    assert METRICS.counter(
+        "hub.event.duplicate", event_type="customer.subscription.created"
+    ) == (duplicates + 2)
+
+
+def test_process_event_without_idempotency(routed_event, monkeypatch, mocker):
+    monkeypatch.setenv("HUB_IDEMPOTENCY_ENABLED", "False")
+    only_routes = mock_pipeline(mocker)
+    g.hub_table.append_event("evt_routed", "firefox")
+    controller.process_event(routed_event)
+    assert only_routes == [None]
+
+
+def test_not_routed_event_is_complete(routed_event, mocker):
+    mocker.patch.object(StripeCustomerSubscriptionUpdated, "run")
+    event = dict(routed_event, type="customer.subscription.updated")
+    assert StripeHubEventPipeline(event).run() is None
+    assert g.hub_table.get_event("evt_routed").sent_system == [NOT_ROUTED]
+    assert controller.pending_routes(event) == []
+    assert "evt_routed" in controller.routed_events()
+
+
+def replay_event(event_id: str, customer_id: str, created: int) -> dict:
+    return {
+        "id": event_id,
+        "type": "customer.created",
+        "created": created,
+        "data": {"object": {"object": "customer", "id": customer_id}},
+    }
+
+
+def test_replay_requires_hub_auth(app):
+    response = app.app.test_client().post(
+        "v1/hub/replay", json={"events": [replay_event("evt_1", "cus_1", 1)]}
+    )
+    assert response.status_code == 401
+
+
+def test_replay(app, mocker):
+    controller.routed_events().clear()
+    g.hub_table.append_event("evt_replay_sent", "salesforce")
+    replayed = []
+
+    def run(self):
+        replayed.append(self.payload["id"])
+        if self.payload["id"] == "evt_replay_failed":
+            raise ClientError("failed")
+        return {r: RouteOutcome(r, SENT, 0.0, None) for r in self.only_routes}
+
+    mocker.patch.object(StripeHubEventPipeline, "run", run)
+    events = [
+        replay_event("evt_replay_2", "cus_replay", 200),
+        replay_event("evt_replay_sent", "cus_other", 100),
+        replay_event("evt_replay_1", "cus_replay", 100),
+        replay_event("evt_replay_failed", "cus_failed", 100),
+    ]
+    response = app.app.test_client().post(
+        "v1/hub/replay",
+        json={"events": events},
+        headers={"Authorization": CFG.HUB_API_KEY},
+    )
+    g.hub_table.remove_from_db("evt_replay_sent")
+    controller.routed_events().clear()
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r["status"] for r in body["results"]] == [
+        "processed",
+        "skipped",
+        "processed",
+        "failed",
+    ]
+    assert (body["processed"], body["skipped"], body["failed"]) == (2, 1, 1)
+    # events of a customer run in the order Stripe created them
+    assert replayed.index("evt_replay_1") < replayed.index("evt_replay_2")
+    assert "evt_replay_sent" not in replayed
+
+
+def test_replay_fails_malformed_events_alone(app, mocker):
+    controller.routed_events().clear()
+    replayed = []
+
+    def run(self):
+        replayed.append(self.payload["id"])
+        return {}
+
+    mocker.patch.object(StripeHubEventPipeline, "run", run)
+    events = [
+        dict(replay_event("evt_replay_null", "cus_1", 100), data=None),
+        {"id": "evt_replay_no_customer", "type": "customer.created", "data": {}},
+        {"type": "customer.created", "data": {"object": {"customer": "cus_1"}}},
+        {"id": "evt_replay_no_type", "created": None},
+        replay_event("evt_replay_ok", "cus_1", 100),
+    ]
+    response = app.app.test_client().post(
+        "v1/hub/replay",
+        json={"events": events},
+        headers={"Authorization": CFG.HUB_API_KEY},
+    )
+    controller.routed_events().clear()
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [(r["event_id"], r["status"]) for r in body["results"]] == [
+        ("evt_replay_null", "processed"),
+        ("evt_replay_no_customer", "processed"),
+        (None, "failed"),
+        ("evt_replay_no_type", "failed"),
+        ("evt_replay_ok", "processed"),
+    ]
+    assert body["results"][2]["error"] == "event has no id"
+    assert sorted(replayed) == [
+        "evt_replay_no_customer",
+        "evt_replay_null",
+        "evt_replay_ok",
+    ]
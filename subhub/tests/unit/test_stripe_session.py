@@ -0,0 +1,161 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from unittest.mock import MagicMock, Mock
+
+import pytest
+from flask import g
+from stripe import Customer, Subscription
+from stripe.util import convert_to_stripe_object
+
+from subhub.metrics import METRICS
+from subhub.stripe_session import StripeSession, record_stripe_calls, stripe_session
+from subhub.sub import payments
+
+
+def customer_object(*subscriptions):
+    return convert_to_stripe_object(
+        {
+            "id": "cus_1",
+            "object": "customer",
+            "metadata": {"userid": "user_1"},
+            "sources": {"object": "list", "data": [{"id": "card_1"}]},
+            "subscriptions": {"object": "list", "data": list(subscriptions)},
+        }
+    )
+
+
+def subscription_object(sub_id, **overrides):
+    values = dict(
+        {
+            "id": sub_id,
+            "object": "subscription",
+            "customer": "cus_1",
+            "status": "active",
+            "cancel_at_period_end": False,
+            "current_period_start": 1_516_229_999,
+            "current_period_end": 1_518_908_399,
+            "ended_at": None,
+            "latest_invoice": None,
+            "plan": {"id": "plan_1", "nickname": "Plan 1"},
+        },
+        **overrides,
+    )
+    return convert_to_stripe_object(values)
+
+
+@pytest.fixture()
+def request_session(app):
+    with app.app.test_request_context():
+        g.subhub_account = MagicMock()
+        g.subhub_account.get_user.return_value.cust_id = "cus_1"
+        g.stripe_session = StripeSession()
+        yield g.stripe_session
+
+
+def test_retrieve_is_memoized(monkeypatch):
+    retrieve = Mock(return_value=customer_object())
+    monkeypatch.setattr("stripe.Customer.retrieve", retrieve)
+    session = StripeSession()
+
+    first = session.retrieve(Customer, "cus_1", expand=["subscriptions"])
+    second = session.retrieve(Customer, "cus_1")
+
+    assert first is second
+    retrieve.assert_called_once_with("cus_1", expand=["subscriptions"])
+    assert session.calls == 1
+
+
+def test_mutation_updates_embedded_subscription(monkeypatch):
+    monkeypatch.setattr(
+        "stripe.Customer.retrieve",
+        Mock(return_value=customer_object(subscription_object("sub_1"))),
+    )
+    monkeypatch.setattr(
+        "stripe.Subscription.modify",
+        Mock(return_value=subscription_object("sub_1", cancel_at_period_end=True)),
+    )
+    monkeypatch.setattr(
+        "stripe.Subscription.create",
+        Mock(return_value=subscription_object("sub_2")),
+    )
+    session = StripeSession()
+    customer = session.retrieve(Customer, "cus_1")
+
+    session.mutate(Subscription.modify, "sub_1", cancel_at_period_end=True)
+    session.mutate(Subscription.create, customer="cus_1", items=[])
+
+    subscriptions = session.retrieve(Customer, "cus_1")["subscriptions"]["data"]
+    assert [s["id"] for s in subscriptions] == ["sub_2", "sub_1"]
+    assert subscriptions[1]["cancel_at_period_end"]
+    assert session.objects[("subscription", "sub_2")] is subscriptions[0]
+    assert session.retrieve(Customer, "cus_1") is customer
+    assert session.calls == 3
+
+
+def test_mutation_result_without_id_is_ignored():
+    session = StripeSession()
+
+    assert session.mutate(Mock(return_value=None)) is None
+    session.mutate(Mock(return_value={"deleted": True}))
+
+    assert session.objects == {}
+    assert session.calls == 2
+
+
+def test_stripe_session_outside_request(app):
+    g.stripe_session = StripeSession()
+    try:
+        assert stripe_session() is not g.stripe_session
+    finally:
+        del g.stripe_session
+
+
+def test_subscribe_retrieves_customer_once(monkeypatch, request_session):
+    retrieve = Mock(return_value=customer_object())
+    create = Mock(return_value=subscription_object("sub_1"))
+    monkeypatch.setattr("stripe.Customer.retrieve", retrieve)
+    monkeypatch.setattr("stripe.Subscription.create", create)
+    monkeypatch.setattr("stripe.Customer.modify", Mock())
+
+    response, code = payments.subscribe_to_plan(
+        "user_1",
+        {
+            "pmt_token": "tok_visa",
+            "plan_id": "plan_1",
+            "origin_system": "Test_system",
+            "email": "user@example.com",
+            "display_name": "User",
+        },
+    )
+
+    assert code == 201
+    assert response["subscriptions"][0]["subscription_id"] == "sub_1"
+    retrieve.assert_called_once()
+    assert request_session.calls == 2
+
+
+def test_cancel_retrieves_customer_once(monkeypatch, request_session):
+    retrieve = Mock(return_value=customer_object(subscription_object("sub_1")))
+    modify = Mock(return_value=subscription_object("sub_1", cancel_at_period_end=True))
+    monkeypatch.setattr("stripe.Customer.retrieve", retrieve)
+    monkeypatch.setattr("stripe.Subscription.modify", modify)
+
+    response, code = payments.cancel_subscription("user_1", "sub_1")
+
+    assert code == 201
+    assert response["message"] == "Subscription cancellation successful"
+    retrieve.assert_called_once()
+    assert request_session.calls == 2
+
+
+def test_record_stripe_calls(request_session):
+    METRICS.reset()
+    request_session.calls = 3
+
+    record_stripe_calls("subhub.sub.payments.cancel_subscription")
+
+    endpoint = "subhub.sub.payments.cancel_subscription"
+    assert METRICS.counter("stripe.calls", endpoint=endpoint) == 3
+    assert METRICS.counter("stripe.requests", endpoint=endpoint) == 1
@@ -0,0 +1,44 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from subhub.hub.stripe.customer import StripeCustomerSubscriptionUpdated
+from subhub.hub.stripe.views import EventView, InvoiceView, first_item
+from subhub.tests.performance import hub_events_bench
+
+
+def test_event_view():
+    event = {
+        "id": "evt_view",
+        "type": "customer.subscription.updated",
+        "created": 1563287210,
+        "data": {"object": {"id": "sub_view", "status": "trialing"}},
+    }
+    handler = StripeCustomerSubscriptionUpdated(event)
+    assert handler.event.id == "evt_view"
+    assert handler.event.created == 1563287210
+    assert handler.object.id == "sub_view"
+    assert handler.object.cancel_at is None
+    assert handler.is_active_or_trialing
+    with pytest.raises(AttributeError):
+        handler.object.unused = True
+
+
+def test_event_view_without_data():
+    view = EventView({"id": "evt_view", "type": "invoice.finalized"})
+    assert view.data == {}
+    assert InvoiceView(view.data.get("object") or {}).id is None
+
+
+def test_first_item():
+    assert first_item({"data": [{"description": "plan"}]}) == {"description": "plan"}
+    with pytest.raises(IndexError):
+        first_item(None)
+
+
+def test_hub_events_bench():
+    results = hub_events_bench.benchmark(iterations=1)
+    assert len(results) == len(hub_events_bench.FIXTURES)
+    assert all(r["view_peak"] < r["attrdict_peak"] for r in results)